@@ -0,0 +1,473 @@
+# Solver backends for the cycle/chain packing problem
+# solve_kidney_matching builds the problem once as a sparse constraint matrix (a PackingProblem) and any of the
+# backends below can solve it, so backends can be swapped per call and compared on identical graphs
+from pulp import LpProblem, LpVariable, LpMaximize, LpAffineExpression, lpDot, PULP_CBC_CMD, LpSolutionOptimal, LpSolutionIntegerFeasible
+from enum import Enum
+import time
+import warnings
+
+import numpy as np
+
+# which solver is used for the packing problem
+class SolverBackend(Enum):
+    PULP_CBC = 1      # PuLP model solved by the CBC command line solver (spawns a process and writes files per solve)
+    SCIPY_HIGHS = 2   # scipy.optimize.milp, which runs HiGHS in-process
+    PYTHON = 3        # pure-Python branch and bound, only needs one LP relaxation (from CBC) for its bound, suits small and medium problems
+
+# maximize weights . x subject to A x <= row_upper, x binary
+# A is given in coordinate form: entry k puts value values[k] at (row_indices[k], column_indices[k])
+class PackingProblem:
+    def __init__(self, weights, row_indices, column_indices, values, row_upper):
+        self.weights = weights
+        self.row_indices = row_indices
+        self.column_indices = column_indices
+        self.values = values
+        self.row_upper = row_upper
+        self.num_columns = len(weights)
+        self.num_rows = len(row_upper)
+
+    # entries of the constraint matrix grouped by row: rows[r] is the list of (column, value) in row r
+    def rows(self):
+        rows = [[] for _ in range(self.num_rows)]
+        for r, c, v in zip(self.row_indices, self.column_indices, self.values):
+            rows[r].append((c, v))
+        return rows
+
+    # entries of the constraint matrix grouped by column: columns[c] is the list of (row, value) in column c
+    def columns(self):
+        columns = [[] for _ in range(self.num_columns)]
+        for r, c, v in zip(self.row_indices, self.column_indices, self.values):
+            columns[c].append((r, v))
+        return columns
+
+    # objective value of a 0/1 solution
+    def objective(self, x):
+        return sum(w for w, v in zip(self.weights, x) if v == 1)
+
+# limits on a single solve - the solver stops after time_limit seconds, or once its packing is proven to be within a
+# relative gap of the optimum, and returns the best packing found so far (None for no limit)
+class SolveLimits:
+    def __init__(self, time_limit=None, gap=None):
+        self.time_limit = time_limit
+        self.gap = gap
+
+    def __repr__(self):
+        return f'SolveLimits(time_limit={self.time_limit}, gap={self.gap})'
+
+# what a limited solve achieved: the objective of the packing returned, an upper bound on the optimal objective, the
+# relative gap between the two (so the packing is at most that far from optimal) and whether the time limit stopped the solver
+class SolveReport:
+    def __init__(self, objective, bound, gap, time_limit_hit):
+        self.objective = objective
+        self.bound = bound
+        self.gap = gap
+        self.time_limit_hit = time_limit_hit
+
+    def __repr__(self):
+        return f'SolveReport(objective={self.objective}, bound={self.bound}, gap={self.gap}, time_limit_hit={self.time_limit_hit})'
+
+def relative_gap(objective, bound):
+    if bound <= objective + 1e-9:
+        return 0.
+    return (bound - objective) / max(abs(bound), 1e-9)
+
+# the solvers below take optional SolveLimits and a feasible starting solution (incumbent), and return the solution
+# (None if none was found), an upper bound on the optimum (None if the solver does not know one) and whether the
+# time limit stopped them
+
+def solve_with_pulp_cbc(problem, limits=None, incumbent=None):
+    lp = LpProblem('kidney_matching', LpMaximize)
+    x = [LpVariable(f'x{c}', cat='Binary') for c in range(problem.num_columns)]
+
+    for r, row in enumerate(problem.rows()):
+        if len(row) > 0:
+            lp += LpAffineExpression([(x[c], v) for c, v in row]) <= problem.row_upper[r]
+
+    lp += lpDot(x, problem.weights)
+
+    options = {}
+    if limits is not None:
+        options['timeLimit'] = limits.time_limit
+        options['gapRel'] = limits.gap
+    if incumbent is not None:
+        for var, v in zip(x, incumbent):
+            var.setInitialValue(v)
+        options['warmStart'] = True
+    lp.solve(PULP_CBC_CMD(msg=0, **options))
+
+    # CBC reports a time-limited stop as an integer feasible (rather than optimal) solution, or as no solution at all
+    time_limit_hit = limits is not None and limits.time_limit is not None and lp.sol_status != LpSolutionOptimal
+    if lp.sol_status not in (LpSolutionOptimal, LpSolutionIntegerFeasible):
+        return None, None, time_limit_hit
+    return [1 if (var.varValue or 0) > 0.5 else 0 for var in x], None, time_limit_hit
+
+def solve_with_scipy_highs(problem, limits=None, incumbent=None):
+    # scipy is only needed for this backend
+    from scipy.optimize import milp, LinearConstraint, Bounds
+    from scipy.sparse import csr_matrix
+
+    # scipy's milp cannot be given a starting solution, so the incumbent is only compared against at the end
+    options = {}
+    if limits is not None:
+        if limits.time_limit is not None:
+            options['time_limit'] = limits.time_limit
+        if limits.gap is not None:
+            options['mip_rel_gap'] = limits.gap
+
+    matrix = csr_matrix((problem.values, (problem.row_indices, problem.column_indices)), shape=(problem.num_rows, problem.num_columns))
+    result = milp(c=-np.array(problem.weights, dtype=np.float64),
+                  constraints=[LinearConstraint(matrix, -np.inf, np.array(problem.row_upper, dtype=np.float64))],
+                  integrality=np.ones(problem.num_columns), bounds=Bounds(0, 1), options=options)
+
+    time_limit_hit = result.status == 1
+    if result.x is None:
+        if time_limit_hit:
+            return None, None, True
+        raise Exception(f'HiGHS did not find a solution: {result.message}')
+    bound = -result.mip_dual_bound if getattr(result, 'mip_dual_bound', None) is not None else None
+    return [1 if v > 0.5 else 0 for v in result.x], bound, time_limit_hit
+
+# LP relaxation of a packing problem (0 <= x, the packing rows already keep x <= 1) - returns the column values and the
+# dual value of every row (>= 0, the marginal gain in objective of loosening the row), as needed for column generation
+def solve_lp_relaxation(problem, backend=SolverBackend.PULP_CBC):
+    if backend == SolverBackend.PULP_CBC:
+        lp = LpProblem('kidney_matching_relaxation', LpMaximize)
+        x = [LpVariable(f'x{c}', lowBound=0) for c in range(problem.num_columns)]
+
+        names = {}
+        for r, row in enumerate(problem.rows()):
+            if len(row) > 0:
+                names[r] = f'row{r}'
+                lp += LpAffineExpression([(x[c], v) for c, v in row]) <= problem.row_upper[r], names[r]
+
+        lp += lpDot(x, problem.weights)
+        lp.solve(PULP_CBC_CMD(msg=0))
+
+        duals = [(lp.constraints[names[r]].pi or 0.) if r in names else 0. for r in range(problem.num_rows)]
+        return [var.varValue or 0. for var in x], [max(0., d) for d in duals]
+    elif backend == SolverBackend.SCIPY_HIGHS:
+        from scipy.optimize import linprog
+        from scipy.sparse import csr_matrix
+
+        matrix = csr_matrix((problem.values, (problem.row_indices, problem.column_indices)), shape=(problem.num_rows, problem.num_columns))
+        result = linprog(c=-np.array(problem.weights, dtype=np.float64), A_ub=matrix, b_ub=np.array(problem.row_upper, dtype=np.float64),
+                         bounds=(0, None), method='highs')
+
+        if result.x is None:
+            raise Exception(f'HiGHS did not solve the LP relaxation: {result.message}')
+        return result.x.tolist(), [max(0., -d) for d in result.ineqlin.marginals.tolist()]
+    raise Exception(f'Solver backend {backend} cannot solve LP relaxations')
+
+# depth-first branch and bound: columns are tried in decreasing order of LP value (then weight) and a branch is cut when its bound cannot
+# beat the best solution so far - the bound is the smaller of taking every remaining positive-weight column and a
+# Lagrangian bound from the duals y >= 0 of the LP relaxation (solved once, with lp_backend): any packing of the
+# remaining columns gains at most y . (row_upper - activity) plus their positive reduced costs w_c - y . a_c, which is
+# the LP optimum at the root and only gets tighter as rows fill up
+# rows with negative entries (chain flow rows) are kept satisfiable while branching: a row may only go over its upper
+# bound by as much as the negative entries of its undecided columns could still take off, so a branch is cut as soon as
+# taking (or leaving out) a column makes one of its rows impossible to satisfy
+# stops after max_nodes nodes (or at the time limit) with the best solution found so far and the bound of what is left
+# unexplored, so the caller can tell the solution is not proven optimal - or raises at max_nodes when given no limits
+# with a gap, a branch is also cut when the best solution so far is within that gap of everything the branch could reach
+def solve_with_python(problem, limits=None, incumbent=None, max_nodes=1000000, lp_backend=SolverBackend.PULP_CBC):
+    gap = limits.gap if limits is not None and limits.gap is not None else 0.
+    deadline = None
+    if limits is not None and limits.time_limit is not None:
+        deadline = time.perf_counter() + limits.time_limit
+
+    columns = problem.columns()
+    relaxation, duals = solve_lp_relaxation(problem, lp_backend)
+    order = sorted(range(problem.num_columns), key=lambda c: (-relaxation[c], -problem.weights[c]))
+    order = [c for c in order if problem.weights[c] > 0 or any(v < 0 for _, v in columns[c])]
+    dual_costs = [sum(duals[r] * v for r, v in columns[c]) for c in range(problem.num_columns)]
+
+    # remaining[i] is the sum of the positive weights from position i of the order onwards, and remaining_reduced[i]
+    # the sum of the positive reduced costs (close to 0 with exact duals)
+    remaining = [0.] * (len(order) + 1)
+    remaining_reduced = [0.] * (len(order) + 1)
+    for i in range(len(order) - 1, -1, -1):
+        remaining[i] = remaining[i + 1] + max(0., problem.weights[order[i]])
+        remaining_reduced[i] = remaining_reduced[i + 1] + max(0., problem.weights[order[i]] - dual_costs[order[i]])
+
+    activity = [0.] * problem.num_rows
+    undecided = [0.] * problem.num_rows     # sum of the negative entries of each row in the columns not decided yet
+    for c in order:
+        for r, v in columns[c]:
+            if v < 0:
+                undecided[r] += v
+    dual_slack = sum(y * upper for y, upper in zip(duals, problem.row_upper))   # y . (row_upper - activity)
+    chosen = []
+    best_value = 0.
+    best_columns = []
+    if incumbent is not None:
+        best_value = problem.objective(incumbent)
+        best_columns = [c for c in range(problem.num_columns) if incumbent[c] == 1]
+    cut_bound = 0.      # largest bound of the branches cut only because of the gap
+
+    # every row of column c can still be satisfied if it is taken, or left out
+    def can_take(c):
+        return all(activity[r] + v + undecided[r] <= problem.row_upper[r] for r, v in columns[c])
+
+    def can_leave(c):
+        return all(activity[r] + undecided[r] <= problem.row_upper[r] for r, v in columns[c] if v < 0)
+
+    # decide (or undo the decision on) column c - its negative entries no longer count as undecided
+    def decide(c, sign):
+        for r, v in columns[c]:
+            if v < 0:
+                undecided[r] -= sign * v
+
+    # take (or give back) column c
+    def take(c, sign):
+        nonlocal dual_slack
+        for r, v in columns[c]:
+            activity[r] += sign * v
+        dual_slack -= sign * dual_costs[c]
+
+    # best objective any solution below a node at position i of the order could reach
+    def node_bound(i, current):
+        return current + min(remaining[i], dual_slack + remaining_reduced[i])
+
+    # iterative search - stage 0: node not expanded yet, 1: exploring the first branch on order[i], 2: exploring the other one
+    # the branch tried first is the one the LP relaxation leans to (taking the column if its LP value is at least 1/2),
+    # so the first dive is the rounded LP solution - the optimum itself when the relaxation is integral
+    nodes = 0
+    stopped = False
+    time_limit_hit = False
+    root_bound = node_bound(0, 0.)
+    frames = [[0, 0., 0]]
+
+    def branch(i, current, taking):
+        c = order[i]
+        if taking and can_take(c):
+            take(c, 1)
+            chosen.append(c)
+            frames.append([i + 1, current + problem.weights[c], 0])
+        elif not taking and can_leave(c):
+            frames.append([i + 1, current, 0])
+
+    while len(frames) > 0:
+        frame = frames[-1]
+        i, current, stage = frame
+
+        if stage == 0:
+            nodes += 1
+            if nodes > max_nodes:
+                stopped = True
+                break
+            if deadline is not None and nodes % 1024 == 0 and time.perf_counter() > deadline:
+                stopped = time_limit_hit = True
+                break
+            bound = node_bound(i, current)
+            if bound <= best_value + 1e-9:
+                frames.pop()
+            elif bound * (1 - gap) <= best_value:
+                cut_bound = max(cut_bound, bound)
+                frames.pop()
+            elif i == len(order):
+                # every row was kept satisfiable on the way down, so the leaf is feasible
+                best_value = current
+                best_columns = list(chosen)
+                frames.pop()
+            else:
+                decide(order[i], 1)
+                frame[2] = 1
+                branch(i, current, relaxation[order[i]] >= 0.5)
+        else:
+            c = order[i]
+            if len(chosen) > 0 and chosen[-1] == c:
+                chosen.pop()
+                take(c, -1)
+            if stage == 1:
+                frame[2] = 2
+                branch(i, current, relaxation[c] < 0.5)
+            else:
+                decide(c, -1)
+                frames.pop()
+
+    # the optimum is at most the best solution, or what a cut or unexplored branch could still have reached
+    bound = max(best_value, cut_bound)
+    if stopped:
+        unexplored = max(current + remaining[i] for i, current, stage in frames if stage < 2)
+        bound = max(bound, min(unexplored, root_bound))
+
+    # without limits the solve is expected to be exact, so an unproven packing is an error rather than a warning
+    if stopped and not time_limit_hit:
+        if limits is None:
+            raise Exception(f'Branch and bound stopped after {max_nodes} nodes before proving its packing optimal (objective {best_value}, '
+                            f'bound {bound}), solve it with SolveLimits or another backend')
+        warnings.warn(f'Branch and bound stopped after {max_nodes} nodes, the solution may not be optimal')
+
+    x = [0] * problem.num_columns
+    for c in best_columns:
+        x[c] = 1
+    return x, bound, time_limit_hit
+
+# simple heuristic packing: take the columns in decreasing weight order whenever every row still fits
+# (columns with negative entries, i.e. chain arcs of the position-indexed formulation, only loosen rows, so the packing stays feasible)
+def greedy_packing(problem):
+    columns = problem.columns()
+    activity = [0.] * problem.num_rows
+    x = [0] * problem.num_columns
+    for c in sorted(range(problem.num_columns), key=lambda c: -problem.weights[c]):
+        if problem.weights[c] <= 0:
+            break
+        if all(activity[r] + v <= problem.row_upper[r] for r, v in columns[c]):
+            for r, v in columns[c]:
+                activity[r] += v
+            x[c] = 1
+    return x
+
+def backend_solver(backend):
+    if backend == SolverBackend.PULP_CBC:
+        return solve_with_pulp_cbc
+    elif backend == SolverBackend.SCIPY_HIGHS:
+        return solve_with_scipy_highs
+    elif backend == SolverBackend.PYTHON:
+        return solve_with_python
+    raise Exception(f'Unknown solver backend {backend}')
+
+# solve a packing problem with the given backend, returning the 0/1 value of every column
+# the solver starts from the greedy packing
+def solve_packing_problem(problem, backend=SolverBackend.PULP_CBC):
+    if problem.num_columns == 0:
+        return []
+
+    incumbent = greedy_packing(problem)
+    x, _, _ = backend_solver(backend)(problem, incumbent=incumbent)
+    if x is None:
+        raise Exception(f'{backend} did not find a solution')
+    if problem.objective(x) < problem.objective(incumbent):
+        x = incumbent
+    return x
+
+# anytime solve of a packing problem within the given SolveLimits: the solver starts from the greedy packing and returns
+# the best packing found when it stops, together with a SolveReport of how good that packing is
+def solve_packing_problem_with_limits(problem, backend=SolverBackend.PULP_CBC, limits=None):
+    if problem.num_columns == 0:
+        return [], SolveReport(0., 0., 0., False)
+
+    incumbent = greedy_packing(problem)
+    x, bound, time_limit_hit = backend_solver(backend)(problem, limits, incumbent)
+
+    # the solver may have stopped before finding anything better than the heuristic
+    if x is None or problem.objective(x) < problem.objective(incumbent):
+        x = incumbent
+    objective = problem.objective(x)
+
+    # a solver that finished has proven its packing to be within the gap it was given - one stopped by the time limit
+    # without a bound of its own gets the bound of the LP relaxation (one more LP solve, small next to the MIP it stopped)
+    if bound is None:
+        gap = limits.gap if limits is not None and limits.gap is not None else 0.
+        if not time_limit_hit:
+            bound = objective / (1 - gap)
+        else:
+            relaxation, _ = solve_lp_relaxation(problem, backend)
+            bound = sum(w * v for w, v in zip(problem.weights, relaxation))
+    bound = max(bound, objective)
+
+    return x, SolveReport(objective, bound, relative_gap(objective, bound), time_limit_hit)
+
+# split a packing problem into independent subproblems - two columns are in the same component if they share a row
+# (e.g. a pair), so components never interact and can be solved separately
+# returns a list of (columns of the component, subproblem)
+def split_packing_problem(problem):
+    parent = list(range(problem.num_rows))
+
+    def find(r):
+        while parent[r] != r:
+            parent[r] = parent[parent[r]]
+            r = parent[r]
+        return r
+
+    columns = problem.columns()
+    for column in columns:
+        first = find(column[0][0])
+        for r, _ in column[1:]:
+            root = find(r)
+            if root != first:
+                parent[root] = first
+
+    # group columns and rows by component
+    component_columns = {}
+    for c in range(problem.num_columns):
+        component_columns.setdefault(find(columns[c][0][0]), []).append(c)
+
+    components = []
+    for component in component_columns.values():
+        row_index = {}
+        row_indices = []
+        column_indices = []
+        values = []
+        for k, c in enumerate(component):
+            for r, v in columns[c]:
+                if r not in row_index:
+                    row_index[r] = len(row_index)
+                row_indices.append(row_index[r])
+                column_indices.append(k)
+                values.append(v)
+
+        row_upper = [0] * len(row_index)
+        for r, k in row_index.items():
+            row_upper[k] = problem.row_upper[r]
+
+        weights = [problem.weights[c] for c in component]
+        components.append((component, PackingProblem(weights, row_indices, column_indices, values, row_upper)))
+
+    return components
+
+# solve_packing_problem_with_limits with the time left until a deadline (in time.time(), so it means the same in every
+# process) when the solve starts - once the deadline has passed, only the greedy packing is returned, with the bound of
+# taking every positive-weight column (no solve fits in a budget already spent)
+def solve_packing_problem_until(problem, backend, deadline, gap):
+    remaining = deadline - time.time()
+    if remaining > 0:
+        return solve_packing_problem_with_limits(problem, backend, SolveLimits(remaining, gap))
+
+    x = greedy_packing(problem)
+    objective = problem.objective(x)
+    bound = max(sum(w for w in problem.weights if w > 0), objective)
+    return x, SolveReport(objective, bound, relative_gap(objective, bound), True)
+
+# solve a packing problem component by component - components with a single column are decided directly,
+# the others are solved with the given backend, concurrently if an executor (e.g. a ProcessPoolExecutor) is given
+# with limits, every component shares the time limit: each one gets the time left until a common deadline when it
+# starts (so components queued behind others on the executor get less), and those starting after the deadline only get
+# the greedy packing - the SolveReport of the whole problem is appended to reports if given
+def solve_packing_problem_by_component(problem, backend=SolverBackend.PULP_CBC, executor=None, limits=None, reports=None):
+    x = [0] * problem.num_columns
+    pending = []
+    deadline = None
+    if limits is not None and limits.time_limit is not None:
+        deadline = time.time() + limits.time_limit
+
+    for component, subproblem in split_packing_problem(problem):
+        if subproblem.num_columns == 1:
+            fits = all(v <= subproblem.row_upper[r] for r, v in zip(subproblem.row_indices, subproblem.values))
+            x[component[0]] = 1 if fits and subproblem.weights[0] > 0 else 0
+            continue
+
+        if limits is None:
+            solve, args = solve_packing_problem, (subproblem, backend)
+        elif deadline is None:
+            solve, args = solve_packing_problem_with_limits, (subproblem, backend, limits)
+        else:
+            solve, args = solve_packing_problem_until, (subproblem, backend, deadline, limits.gap)
+        pending.append((component, executor.submit(solve, *args) if executor is not None else solve(*args)))
+
+    # the bound of the whole problem is the objective plus what every component could still gain
+    slack = 0.
+    time_limit_hit = False
+    for component, result in pending:
+        values = result.result() if executor is not None else result
+        if limits is not None:
+            values, report = values
+            slack += report.bound - report.objective
+            time_limit_hit = time_limit_hit or report.time_limit_hit
+        for c, v in zip(component, values):
+            x[c] = v
+
+    if limits is not None and reports is not None:
+        objective = problem.objective(x)
+        reports.append(SolveReport(objective, objective + slack, relative_gap(objective, objective + slack), time_limit_hit))
+    return x
@@ -0,0 +1,195 @@
+# Benchmarks for the hot paths of the solver
+# Run with: python benchmarks.py [--quick] [--output results.json] [--baseline baseline.json]
+# Every timing is also written as a record {benchmark, parameters, seconds} to a JSON file, which can be saved as a
+# baseline and compared against later, so a performance regression shows up as numbers rather than a feeling
+import argparse
+import contextlib
+import io
+import json
+import platform
+import random
+import time
+
+from patient_donor_pairs import generate_patient_donor_pair, generate_altruistic_donor
+from solver import Graph, ProblemType, MatchingMode, solve_kidney_matching
+from simulator import DynamicSimulator
+import compatibility
+
+# compare the pairwise find_edges against the vectorized one, checking that both give the same edges
+def benchmark_find_edges(sizes=(500, 2000, 10000), seed=0):
+    print()
+    print("find_edges benchmark")
+    print(f"{'pairs':>8} {'pairwise (s)':>14} {'vectorized (s)':>16} {'speedup':>9}")
+
+    results = []
+    for size in sizes:
+        random.seed(seed)
+        pairs = [generate_patient_donor_pair() for _ in range(size)]
+
+        start_time = time.perf_counter()
+        pairwise_edges = Graph.find_edges_pairwise(pairs)
+        pairwise_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        vectorized_edges = Graph.find_edges(pairs)
+        vectorized_time = time.perf_counter() - start_time
+
+        assert pairwise_edges == vectorized_edges, f"edges differ for {size} pairs"
+        print(f"{size:>8} {pairwise_time:>14.3f} {vectorized_time:>16.3f} {pairwise_time / vectorized_time:>8.1f}x")
+        results.append(benchmark_record('find_edges_pairwise', {'pairs': size}, pairwise_time))
+        results.append(benchmark_record('find_edges_vectorized', {'pairs': size}, vectorized_time))
+    return results
+
+def benchmark_record(benchmark, parameters, seconds):
+    return {'benchmark': benchmark, 'parameters': parameters, 'seconds': seconds}
+
+# a seeded static pool of pairs and altruistic donors, as the simulator would see it at time 5 - every vertex arrived
+# in [0, 5] and leaves in (5, 10], so the FAIRNESS weights have something to work with
+def benchmark_pool(num_pairs, num_altruists, seed=0):
+    random.seed(seed)
+    pairs = [generate_patient_donor_pair() for _ in range(num_pairs)]
+    altruistic_donors = [generate_altruistic_donor() for _ in range(num_altruists)]
+    for vertex in pairs + altruistic_donors:
+        vertex.arrival_time = 5 * random.random()
+        vertex.departure_time = vertex.arrival_time + 5
+    return pairs, altruistic_donors, 5.
+
+# best (least disturbed) wall time of repeats calls of function, and its result
+def best_time(function, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start_time)
+    return best, result
+
+# time each stage of building a Graph - chains are kept short, as their number grows exponentially with the length
+# on dense static pools (a few thousand chains of 3 pairs from 20 altruists already take longer than everything else)
+def benchmark_graph(sizes=(250, 1000, 2500, 5000), altruist_counts=(0, 5, 20), max_cycle_length=3, max_chain_length=2,
+                    problem_type=ProblemType.SIMPLE, repeats=3, seed=0):
+    print()
+    print("Graph construction benchmark")
+    stages = ['find_edges', 'find_altruist_edges', 'find_cycles', 'find_chains', 'cycle_weights', 'chain_weights']
+    print(f"{'pairs':>8} {'altruists':>10} {'cycles':>9} {'chains':>8} " + " ".join(f"{s + ' (s)':>22}" for s in stages))
+
+    results = []
+    for size in sizes:
+        for num_altruists in altruist_counts:
+            pairs, altruistic_donors, curr_time = benchmark_pool(size, num_altruists, seed)
+            parameters = {'pairs': size, 'altruists': num_altruists, 'max_cycle_length': max_cycle_length,
+                          'max_chain_length': max_chain_length, 'problem_type': problem_type.name}
+
+            times = {}
+            times['find_edges'], edges = best_time(lambda: Graph.find_edges(pairs), repeats)
+            times['find_altruist_edges'], altruist_edges = best_time(lambda: compatibility.find_altruist_edges(altruistic_donors, pairs), repeats)
+            # the cycles do not depend on the altruists, so they are only enumerated (once, as they are slow) for the first count
+            if num_altruists == altruist_counts[0]:
+                times['find_cycles'], (cycles, _) = best_time(lambda: Graph.find_cycles(pairs, edges, max_cycle_length), 1)
+            times['find_chains'], (chains, _) = best_time(lambda: Graph.find_chains(altruistic_donors, pairs, edges, altruist_edges, max_chain_length), repeats)
+            times['cycle_weights'], _ = best_time(lambda: Graph.find_cycle_weights(problem_type, pairs, cycles, curr_time), repeats)
+            times['chain_weights'], _ = best_time(lambda: Graph.find_chain_weights(problem_type, pairs, altruistic_donors, chains, curr_time), repeats)
+
+            print(f"{size:>8} {num_altruists:>10} {len(cycles):>9} {len(chains):>8} " +
+                  " ".join(f"{times[s]:>22.4f}" if s in times else f"{'':>22}" for s in stages))
+            for stage in times:
+                results.append(benchmark_record('graph_' + stage, parameters, times[stage]))
+    return results
+
+# time solve_kidney_matching end to end (graph and model) for every problem type - sizes are smaller than for the graph,
+# as the packing problem itself dominates beyond a thousand pairs
+def benchmark_solve(sizes=(250, 500, 1000), altruist_counts=(0, 20), problem_types=tuple(ProblemType), max_cycle_length=3,
+                    max_chain_length=2, seed=0):
+    print()
+    print("solve_kidney_matching benchmark")
+    print(f"{'pairs':>8} {'altruists':>10} {'problem type':>13} {'matched':>8} {'time (s)':>10}")
+
+    results = []
+    for size in sizes:
+        for num_altruists in altruist_counts:
+            pairs, altruistic_donors, curr_time = benchmark_pool(size, num_altruists, seed)
+            for problem_type in problem_types:
+                seconds, (matched, _) = best_time(lambda: solve_kidney_matching(pairs, altruistic_donors, problem_type, curr_time,
+                                                                                max_cycle_length=max_cycle_length,
+                                                                                max_chain_length=max_chain_length), 1)
+                print(f"{size:>8} {num_altruists:>10} {problem_type.name:>13} {len(matched):>8} {seconds:>10.3f}")
+                results.append(benchmark_record('solve_kidney_matching', {'pairs': size, 'altruists': num_altruists,
+                                                                          'problem_type': problem_type.name,
+                                                                          'max_cycle_length': max_cycle_length,
+                                                                          'max_chain_length': max_chain_length}, seconds))
+    return results
+
+# time seeded DynamicSimulator runs end to end at small fixed horizons (the simulator's own output is suppressed)
+def benchmark_simulation(time_limits=(5, 20), matching_modes=(MatchingMode.OPTIMAL, MatchingMode.GREEDY), batch_size=10, seed=0):
+    print()
+    print("DynamicSimulator benchmark")
+    print(f"{'time limit':>11} {'matching mode':>14} {'pairs seen':>11} {'time (s)':>10}")
+
+    configuration = {'pair_arrival_rate': 40, 'pair_departure_rate': 0.5, 'altruist_arrival_rate': 3,
+                     'altruist_departure_rate': 0.5, 'problem_type': ProblemType.SIMPLE, 'batch_size': batch_size}
+    results = []
+    for time_limit in time_limits:
+        for matching_mode in matching_modes:
+            simulator = DynamicSimulator(**configuration, matching_mode=matching_mode, seed=seed)
+            with contextlib.redirect_stdout(io.StringIO()):
+                seconds, (_, _, _, _, statistics) = best_time(lambda: simulator.run(time_limit), 1)
+            print(f"{time_limit:>11} {matching_mode.name:>14} {statistics['Number of Pairs Seen']:>11} {seconds:>10.3f}")
+            parameters = dict(configuration, problem_type=ProblemType.SIMPLE.name, matching_mode=matching_mode.name,
+                              time_limit=time_limit, seed=seed)
+            results.append(benchmark_record('simulation', parameters, seconds))
+    return results
+
+def write_results(results, path):
+    with open(path, 'w') as f:
+        json.dump({'python': platform.python_version(), 'machine': platform.machine(), 'results': results}, f, indent=1)
+
+# compare results against a saved results file, printing every benchmark at least tolerance (relative) slower or faster
+# returns the regressions as (benchmark, parameters, baseline seconds, seconds)
+# benchmarks shorter than min_seconds in both runs are ignored, as their timings are mostly noise
+def compare_with_baseline(results, baseline_path, tolerance=0.2, min_seconds=0.05):
+    with open(baseline_path, 'r') as f:
+        baseline = {(r['benchmark'], json.dumps(r['parameters'], sort_keys=True)): r['seconds'] for r in json.load(f)['results']}
+
+    print()
+    print(f"comparison with {baseline_path}")
+    regressions = []
+    for result in results:
+        key = (result['benchmark'], json.dumps(result['parameters'], sort_keys=True))
+        if key not in baseline or max(baseline[key], result['seconds']) < min_seconds:
+            continue
+        ratio = result['seconds'] / baseline[key]
+        if ratio > 1 + tolerance:
+            regressions.append((result['benchmark'], result['parameters'], baseline[key], result['seconds']))
+            print(f"SLOWER {ratio:6.2f}x {result['benchmark']} {result['parameters']}: {baseline[key]:.4f}s -> {result['seconds']:.4f}s")
+        elif ratio < 1 / (1 + tolerance):
+            print(f"faster {1 / ratio:6.2f}x {result['benchmark']} {result['parameters']}: {baseline[key]:.4f}s -> {result['seconds']:.4f}s")
+    print(f"{len(regressions)} regressions")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for the solver and the simulator")
+    parser.add_argument('--quick', action='store_true', help="only the small sizes, for a check in a minute or two")
+    parser.add_argument('--output', default='benchmark_results.json', help="where to write the results")
+    parser.add_argument('--baseline', default=None, help="results file of an earlier run to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="relative slowdown reported as a regression")
+    args = parser.parse_args()
+
+    results = []
+    if args.quick:
+        results += benchmark_find_edges(sizes=(500, 2000))
+        results += benchmark_graph(sizes=(250, 1000))
+        results += benchmark_solve(sizes=(250,))
+        results += benchmark_simulation(time_limits=(5,))
+    else:
+        results += benchmark_find_edges()
+        results += benchmark_graph()
+        results += benchmark_solve()
+        results += benchmark_simulation()
+
+    write_results(results, args.output)
+    print()
+    print(f"results written to {args.output}")
+
+    if args.baseline is not None:
+        regressions = compare_with_baseline(results, args.baseline, args.tolerance)
+        if len(regressions) > 0:
+            raise SystemExit(1)
@@ -0,0 +1,90 @@
+# Vectorized compatibility checks
+# The pool is encoded as flat arrays (blood type codes, patient PRA, donor virtual PRA) so that compatibility comes
+# from ABO table lookups and PRA comparisons over whole arrays, instead of calling Donor.is_compatible_with_patient
+# once per ordered pair of vertices - and donors are grouped by the patient classes they can donate to (see
+# compatible_patient_lists), so the work is one mask per group of donors rather than one comparison per donor and patient
+from bisect import bisect_left
+from itertools import chain
+
+import numpy as np
+
+from patient_donor_pairs import BloodType
+from pool_store import PairView, DonorView, shared_store, view_ids
+
+# abo_table[d, p] is True if a donor with blood type code d can donate to a patient with blood type code p
+# built from BloodType.can_donor_donate_to_patient so the two can never disagree
+blood_types = list(BloodType)
+abo_table = np.array([[BloodType.can_donor_donate_to_patient(d, p) for p in blood_types] for d in blood_types], dtype=bool)
+
+# blood types are encoded by their position in the BloodType enum (O=0, A=1, B=2, AB=3)
+def blood_type_code(blood_type):
+    return blood_type.value - 1
+
+# encode the patients of a list of pairs as (blood type codes, pras)
+def encode_patients(pairs):
+    # views of a PoolStore already have their columns, so they are gathered directly
+    store = shared_store(pairs, PairView)
+    if store is not None:
+        ids = view_ids(pairs)
+        return store.patient_types[ids], store.pras[ids]
+
+    patient_types = np.fromiter((blood_type_code(p.patient.blood_type) for p in pairs), dtype=np.int8, count=len(pairs))
+    pras = np.fromiter((p.patient.pra for p in pairs), dtype=np.float64, count=len(pairs))
+    return patient_types, pras
+
+# encode a list of donors (either the donors of pairs or altruistic donors) as (blood type codes, virtual pras)
+def encode_donors(donors):
+    store = shared_store(donors, DonorView)
+    if store is not None:
+        ids = view_ids(donors)
+        return store.donor_types[ids], store.virtual_pras[ids]
+
+    donor_types = np.fromiter((blood_type_code(d.blood_type) for d in donors), dtype=np.int8, count=len(donors))
+    virtual_pras = np.fromiter((d.virtual_pra for d in donors), dtype=np.float64, count=len(donors))
+    return donor_types, virtual_pras
+
+# patient classes: compatibility only depends on the blood types and on the donor's virtual PRA being above the
+# patient's PRA, and patient PRAs only take a few values, so the patients fall into a few dozen classes of
+# (blood type, PRA level). Donors with the same blood type and the same number of PRA levels below their virtual PRA can
+# donate to exactly the same classes, so the sorted list of their patients is computed once per group of donors (a few
+# dozen numpy masks over the patients) instead of comparing every donor against every patient
+# returns lists[i], the sorted indices of the patients donor i can donate to - donors of one group share the same list
+def compatible_patient_lists(donor_types, virtual_pras, patient_types, pras):
+    levels = np.unique(pras)
+    patient_levels = np.searchsorted(levels, pras)
+    donor_levels = np.searchsorted(levels, virtual_pras)  # number of PRA levels strictly below each virtual PRA
+
+    groups = {}
+    lists = []
+    for key in zip(donor_types.tolist(), donor_levels.tolist()):
+        if key not in groups:
+            donor_type, below = key
+            groups[key] = np.flatnonzero(abo_table[donor_type, patient_types] & (patient_levels < below)).tolist()
+        lists.append(groups[key])
+    return lists
+
+# create adjacency list representation of graph of pairs - edges[i] is the set of pairs whose patient can receive from pair i's donor
+def find_edges(pairs):
+    patient_types, pras = encode_patients(pairs)
+    donor_types, virtual_pras = encode_donors([p.donor for p in pairs])
+
+    edges = []
+    for i, targets in enumerate(compatible_patient_lists(donor_types, virtual_pras, patient_types, pras)):
+        # built in sorted order without i (pairs are not compatible with themselves in the graph)
+        position = bisect_left(targets, i)
+        if position < len(targets) and targets[position] == i:
+            edges.append(set(chain(targets[:position], targets[position + 1:])))
+        else:
+            edges.append(set(targets))
+
+    return edges
+
+# altruist_edges[d] is the sorted list of pairs whose patient can receive from altruistic donor d
+def find_altruist_edges(altruistic_donors, pairs):
+    if len(altruistic_donors) == 0:
+        return []
+
+    patient_types, pras = encode_patients(pairs)
+    donor_types, virtual_pras = encode_donors(altruistic_donors)
+
+    return [list(targets) for targets in compatible_patient_lists(donor_types, virtual_pras, patient_types, pras)]
@@ -0,0 +1,79 @@
+# Bucketed compatibility index
+# Whether a donor can give to a patient only depends on their two blood types and on the donor's virtual PRA being
+# above the patient's PRA - and patient PRAs only take the few values of pra_intervals, so with four blood types there
+# are only a few dozen classes of patients. Patients are kept in buckets by (blood type, PRA level): the patients a donor
+# can give to are the buckets of compatible blood types below its virtual PRA (one bisect over the PRA levels), and the
+# donors that can give to a patient are, for each compatible blood type, the donors above its PRA in a list sorted by
+# virtual PRA (one bisect again). A query costs the size of its answer plus a handful of buckets, instead of a scan of
+# the whole pool. Any PRA value works - each distinct value is a level of its own
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+
+from compatibility import abo_table
+
+# compatible_patient_types[d] are the patient blood type codes donor blood type code d can give to, and
+# compatible_donor_types[p] the donor blood type codes patient blood type code p can receive from
+compatible_patient_types = [np.flatnonzero(abo_table[d]).tolist() for d in range(len(abo_table))]
+compatible_donor_types = [np.flatnonzero(abo_table[:, p]).tolist() for p in range(len(abo_table))]
+
+class CompatibilityIndex:
+    def __init__(self):
+        num_types = len(abo_table)
+        self.pra_levels = []                                    # sorted distinct PRAs of the patients indexed
+        self.patients = [{} for _ in range(num_types)]          # patients[t][pra] is the set of ids of patients of blood type t with that PRA
+        self.level_counts = {}                                  # pra -> number of patients with that PRA
+        self.donor_pras = [[] for _ in range(num_types)]        # donor_pras[t] is the sorted virtual PRAs of the donors of blood type t
+        self.donor_ids = [[] for _ in range(num_types)]         # ids of those donors in the same order
+        self.patient_keys = {}                                  # id -> (blood type code, pra)
+        self.donor_keys = {}                                    # id -> (blood type code, virtual pra)
+
+    def add_patient(self, vertex_id, blood_type, pra):
+        if pra not in self.level_counts:
+            self.pra_levels.insert(bisect_left(self.pra_levels, pra), pra)
+            self.level_counts[pra] = 0
+        self.level_counts[pra] += 1
+        self.patients[blood_type].setdefault(pra, set()).add(vertex_id)
+        self.patient_keys[vertex_id] = (blood_type, pra)
+
+    def remove_patient(self, vertex_id):
+        blood_type, pra = self.patient_keys.pop(vertex_id)
+        self.patients[blood_type][pra].discard(vertex_id)
+        self.level_counts[pra] -= 1
+        if self.level_counts[pra] == 0:
+            del self.level_counts[pra]
+            del self.pra_levels[bisect_left(self.pra_levels, pra)]
+
+    def add_donor(self, vertex_id, blood_type, virtual_pra):
+        position = bisect_right(self.donor_pras[blood_type], virtual_pra)
+        self.donor_pras[blood_type].insert(position, virtual_pra)
+        self.donor_ids[blood_type].insert(position, vertex_id)
+        self.donor_keys[vertex_id] = (blood_type, virtual_pra)
+
+    def remove_donor(self, vertex_id):
+        blood_type, virtual_pra = self.donor_keys.pop(vertex_id)
+        position = bisect_left(self.donor_pras[blood_type], virtual_pra)
+        while self.donor_ids[blood_type][position] != vertex_id:    # donors with the same virtual PRA
+            position += 1
+        del self.donor_pras[blood_type][position]
+        del self.donor_ids[blood_type][position]
+
+    # sorted ids of the patients a donor of the given blood type code and virtual PRA can give to
+    def patients_compatible_with(self, blood_type, virtual_pra):
+        below = self.pra_levels[:bisect_left(self.pra_levels, virtual_pra)]
+        ids = []
+        for patient_type in compatible_patient_types[blood_type]:
+            buckets = self.patients[patient_type]
+            for pra in below:
+                if pra in buckets:
+                    ids.extend(buckets[pra])
+        ids.sort()
+        return ids
+
+    # sorted ids of the donors that can give to a patient of the given blood type code and PRA
+    def donors_compatible_with(self, blood_type, pra):
+        ids = []
+        for donor_type in compatible_donor_types[blood_type]:
+            ids.extend(self.donor_ids[donor_type][bisect_right(self.donor_pras[donor_type], pra):])
+        ids.sort()
+        return ids
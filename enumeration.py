@@ -0,0 +1,68 @@
+# Bounded enumeration of cycles and chains
+# A single depth-first engine walks the simple paths of the compatibility graph, so cycles and chains of any
+# maximum length come from the same code. Cycles are only searched from their smallest vertex, and a path is
+# only extended to vertices that are still close enough to get back to the start, so each cycle is found once
+# Works on both the list-of-sets edges of Graph and the dict-of-sets edges of PoolGraph
+
+# within[r] is the set of vertices with a path of at most r edges to target, only going through vertices for which can_use is True
+def reachable_within(target, in_edges, max_distance, can_use=None):
+    within = [{target}]
+    frontier = {target}
+    for _ in range(max_distance):
+        frontier = {i for j in frontier for i in in_edges[j] if i not in within[-1] and (can_use is None or can_use(i))}
+        within.append(within[-1] | frontier)
+    return within
+
+# generator over every simple path starting at start with at most max_length vertices
+# next_vertices(path) gives the vertices the path may be extended to (vertices already on the path are skipped)
+# the same list is yielded each time and modified afterwards, so copy it to keep it
+def find_paths(start, max_length, next_vertices):
+    path = [start]
+    on_path = {start}
+    yield path
+
+    if max_length <= 1:
+        return
+
+    stack = [iter(next_vertices(path))]
+    while len(stack) > 0:
+        j = next(stack[-1], None)
+
+        # no more ways to extend the current path, so backtrack
+        if j is None:
+            stack.pop()
+            on_path.discard(path.pop())
+            continue
+
+        if j in on_path:
+            continue
+
+        path.append(j)
+        on_path.add(j)
+        yield path
+
+        if len(path) < max_length:
+            stack.append(iter(next_vertices(path)))
+        else:
+            on_path.discard(path.pop())
+
+# generator over every cycle through start of at most max_cycle_length vertices, as paths beginning at start
+# can_use restricts the other vertices of the cycle (e.g. to vertices larger than start, so each cycle is only found from its smallest vertex)
+# can_extend(path), if given, says whether any longer path through path is worth looking at (e.g. a reduced cost bound)
+def find_cycles_through(start, edges, in_edges, max_cycle_length, can_use=None, can_extend=None):
+    # prune by distance - a path of length l can only be extended to vertices at most max_cycle_length - l edges away from start
+    within = reachable_within(start, in_edges, max_cycle_length - 1, can_use)
+
+    def next_vertices(path):
+        if can_extend is not None and not can_extend(path):
+            return ()
+        return edges[path[-1]] & within[max_cycle_length - len(path)]
+
+    for path in find_paths(start, max_cycle_length, next_vertices):
+        if len(path) >= 2 and start in edges[path[-1]]:
+            yield path
+
+# generator over every chain of at most max_chain_length pairs starting with one of first_pairs, as lists of pairs
+def find_chains_from(first_pairs, edges, max_chain_length):
+    for first_pair in first_pairs:
+        yield from find_paths(first_pair, max_chain_length, lambda path: edges[path[-1]])
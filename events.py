@@ -0,0 +1,123 @@
+# Discrete-event core of the dynamic simulator
+# Every future event (arrivals, departures, match triggers) sits in one priority queue ordered by time. Arrivals are
+# generated one at a time as the previous one is processed, and the departure of a matched vertex is cancelled in
+# O(log n) instead of staying in the queue until its time comes
+from collections import deque
+from enum import Enum
+
+# kinds of events - events at the same time are handled in this order
+class EventType(Enum):
+    DEPARTURE = 0           # a vertex leaves the pool unmatched (if it is still there)
+    PAIR_ARRIVAL = 1
+    ALTRUIST_ARRIVAL = 2
+    MATCH = 3               # run the matching algorithm on the pool
+
+# binary heap of events that knows where every event is, so any event can be removed in O(log n)
+# events at the same time and of the same type come out in the order they were pushed
+class EventQueue:
+    def __init__(self):
+        self.heap = []          # entries (time, event type value, sequence number, event type, payload)
+        self.positions = {}     # sequence number -> position in the heap
+        self.next_sequence = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    # add an event, returning a handle that can be given to cancel
+    def push(self, time, event_type, payload=None):
+        sequence = self.next_sequence
+        self.next_sequence += 1
+
+        self.heap.append((time, event_type.value, sequence, event_type, payload))
+        self.positions[sequence] = len(self.heap) - 1
+        self.sift_up(len(self.heap) - 1)
+
+        return sequence
+
+    # remove the next event, returning (time, event type, payload)
+    def pop(self):
+        entry = self.heap[0]
+        self.remove_at(0)
+        return entry[0], entry[3], entry[4]
+
+    # remove a pending event
+    def cancel(self, handle):
+        self.remove_at(self.positions[handle])
+
+    def remove_at(self, i):
+        del self.positions[self.heap[i][2]]
+        last = self.heap.pop()
+        if i < len(self.heap):
+            self.heap[i] = last
+            self.positions[last[2]] = i
+            self.sift_down(self.sift_up(i))
+
+    def swap(self, i, j):
+        self.heap[i], self.heap[j] = self.heap[j], self.heap[i]
+        self.positions[self.heap[i][2]] = i
+        self.positions[self.heap[j][2]] = j
+
+    def sift_up(self, i):
+        while i > 0:
+            parent = (i - 1) // 2
+            if self.heap[i][:3] >= self.heap[parent][:3]:
+                break
+            self.swap(i, parent)
+            i = parent
+        return i
+
+    def sift_down(self, i):
+        n = len(self.heap)
+        while True:
+            smallest = i
+            for child in (2 * i + 1, 2 * i + 2):
+                if child < n and self.heap[child][:3] < self.heap[smallest][:3]:
+                    smallest = child
+            if smallest == i:
+                return i
+            self.swap(i, smallest)
+            i = smallest
+
+# Poisson arrivals of pairs or altruistic donors up to a time limit, each with an exponential lifetime
+# next() draws the (arrival time, departure time) of the next vertex, or None once past the time limit
+class ArrivalProcess:
+    def __init__(self, arrival_generator, departure_generator, arrival_rate, departure_rate, time_limit):
+        self.arrival_generator = arrival_generator
+        self.departure_generator = departure_generator
+        self.arrival_rate = arrival_rate
+        self.departure_rate = departure_rate
+        self.time_limit = time_limit
+
+        self.curr_time = 0.0
+        self.finished = arrival_rate <= 0
+        self.preloaded = None   # times drawn up front (see preload)
+
+    def draw(self):
+        # Get the arrival and departure time from exponential distributions
+        entry_time = self.curr_time + self.arrival_generator.draw()
+        if self.departure_rate > 0:
+            exit_time = entry_time + self.departure_generator.draw()
+        else:
+            exit_time = float('inf')
+        self.curr_time = entry_time
+
+        if entry_time > self.time_limit:  # we have reached the limit of our time
+            self.finished = True
+            return None
+        return entry_time, exit_time
+
+    # draw every arrival up front - only needed when the draws share a random stream with other draws of the
+    # simulation, so that they are made in the same order whenever the vertices arrive
+    def preload(self):
+        self.preloaded = deque()
+        while not self.finished:
+            times = self.draw()
+            if times is not None:
+                self.preloaded.append(times)
+
+    def next(self):
+        if self.preloaded is not None:
+            return self.preloaded.popleft() if len(self.preloaded) > 0 else None
+        if self.finished:
+            return None
+        return self.draw()
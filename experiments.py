@@ -1,46 +1,100 @@
 # Here we should run all of the experiments that we need to run
 
 from simulator import DynamicSimulator
-from solver import ProblemType
+from solver import ProblemType, SolverBackend
+from result_cache import ResultCache
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import hashlib
+import inspect
+import math
 import random
 import time
 
-def run_experiment(number_of_repetitions,
-                  time_limit,
-                  pair_arrival_rate, pair_departure_rate=0,
-                  altruist_arrival_rate=0, altruist_departure_rate=0,
-                  problem_type=ProblemType.SIMPLE, batch_size=10):
-    start_time = time.time()
-
+# every replication gets its own seed, derived only from its configuration and repetition index,
+# so results are the same whatever order replications run in and however many worker processes are used
+def replication_seed(configuration, repetition):
+    key = repr((sorted(configuration.items()), repetition)).encode()
+    return int.from_bytes(hashlib.sha256(key).digest()[:8], 'big')
+
+# with common random numbers, every configuration of a sweep is given the same seed for a repetition, so all of them see
+# exactly the same arrivals, departures and patients (see DynamicSimulator) and their differences are far less noisy
+def replication_configuration(configuration, repetition, common_random_numbers=False):
+    if not common_random_numbers:
+        return configuration
+    return dict(configuration, seed=replication_seed({}, repetition))
+
+# run a single replication - configuration holds the keyword arguments of DynamicSimulator
+def run_replication(configuration, repetition, time_limit):
+    random.seed(replication_seed(configuration, repetition))
+    simulator = DynamicSimulator(**configuration)
+    _, _, _, _, statistics = simulator.run(time_limit)
+    return statistics
+
+# average the statistics of the replications of one configuration, adding them up in repetition order
+# statistics only reported by some replications (e.g. altruist proportions when no altruist arrived) are averaged over those
+def average_statistics(all_statistics):
     averaged_statistics = {}
-
-    random.seed(0)
-    for _ in range(number_of_repetitions):
-        simulator = DynamicSimulator(pair_arrival_rate=pair_arrival_rate, pair_departure_rate=pair_departure_rate, 
-                                    altruist_arrival_rate=altruist_arrival_rate, altruist_departure_rate=altruist_departure_rate, 
-                                    problem_type=problem_type, batch_size=batch_size)
-        _, _, _, _, statistics = simulator.run(time_limit)
-    
-        if len(averaged_statistics) == 0:
-            averaged_statistics = statistics
-        else:
-            for key in statistics:
+    counts = {}
+    for statistics in all_statistics:
+        for key in statistics:
+            if key not in averaged_statistics:
+                averaged_statistics[key] = statistics[key]
+                counts[key] = 1
+            else:
                 averaged_statistics[key] += statistics[key]
-    
+                counts[key] += 1
+
     for key in averaged_statistics:
-        averaged_statistics[key] /= number_of_repetitions
-    
+        averaged_statistics[key] /= counts[key]
+
+    return averaged_statistics
+
+# mean difference (statistics - baseline_statistics) over paired replications and the half width of its 95% confidence
+# interval (normal approximation) - replications where either side is nan are left out
+def paired_differences(baseline_statistics, all_statistics):
+    differences = {}
+    for key in baseline_statistics[0]:
+        paired = [statistics[key] - baseline[key] for baseline, statistics in zip(baseline_statistics, all_statistics)
+                  if key in baseline and key in statistics and not math.isnan(baseline[key]) and not math.isnan(statistics[key])]
+        if len(paired) == 0:
+            continue
+
+        mean = math.fsum(paired) / len(paired)
+        if len(paired) > 1:
+            variance = math.fsum((d - mean) ** 2 for d in paired) / (len(paired) - 1)
+            half_width = 1.96 * math.sqrt(variance / len(paired))
+        else:
+            half_width = float('nan')
+        differences[key] = (mean, half_width)
+
+    return differences
+
+def print_paired_differences(baseline_configuration, configuration, differences):
+    changed = {key: value for key, value in configuration.items() if baseline_configuration.get(key) != value}
+    print()
+    print(f"PAIRED DIFFERENCES ({changed} against the first configuration)")
+    for key in differences:
+        mean, half_width = differences[key]
+        print(f"Difference in {key}: {round(mean, 4)} +- {round(half_width, 4)}")
+
+# default values of the optional keyword arguments of DynamicSimulator, for configurations that leave them out
+simulator_defaults = {name: parameter.default for name, parameter in inspect.signature(DynamicSimulator).parameters.items()
+                      if parameter.default is not inspect.Parameter.empty}
+
+def print_experiment(number_of_repetitions, time_limit, configuration, averaged_statistics):
     print()
     print()
     print("EXPERIMENT HYPERPARAMETERS")
     print("Number of reps:", number_of_repetitions)
     print("Time limit:", time_limit)
-    print("Pair arrival rate:", pair_arrival_rate)
-    print("Pair departure rate:", pair_departure_rate)
-    print("Altruist arrival rate:", altruist_arrival_rate)
-    print("Altruist departure rate:", altruist_departure_rate)
-    print("Problem Type:", problem_type)
-    print("Batch size:", batch_size)
+    print("Pair arrival rate:", configuration["pair_arrival_rate"])
+    print("Pair departure rate:", configuration["pair_departure_rate"])
+    print("Altruist arrival rate:", configuration["altruist_arrival_rate"])
+    print("Altruist departure rate:", configuration["altruist_departure_rate"])
+    print("Problem Type:", configuration["problem_type"])
+    print("Batch size:", configuration.get("batch_size", simulator_defaults["batch_size"]))
+    print("Solver backend:", configuration.get("backend", simulator_defaults["backend"]))
 
     print()
     print("EXPERIMENT RESULTS")
@@ -49,54 +103,128 @@ def run_experiment(number_of_repetitions,
     print("Averaged Statistics:")
     for key in averaged_statistics:
         print(f"Average {key}: {round(averaged_statistics[key], 4)}")
-    
+
+# run every (configuration, repetition) pair, on a pool of worker processes if workers > 1,
+# and return the averaged statistics of each configuration
+# with a cache_dir, replications already stored there are reused and new ones are stored as soon as they finish
+# with common_random_numbers, the configurations share their random streams and the paired differences of every
+# configuration against the first one are reported as well
+def run_experiments(configurations, number_of_repetitions, time_limit, workers=1, cache_dir=None, common_random_numbers=False):
+    start_time = time.time()
+    cache = ResultCache(cache_dir) if cache_dir is not None else None
+
+    tasks = [(c, r) for c in range(len(configurations)) for r in range(number_of_repetitions)]
+    task_configurations = {(c, r): replication_configuration(configurations[c], r, common_random_numbers) for c, r in tasks}
+    results = {}
+    if cache is not None:
+        for c, r in tasks:
+            statistics = cache.get(task_configurations[(c, r)], time_limit, replication_seed(task_configurations[(c, r)], r))
+            if statistics is not None:
+                results[(c, r)] = statistics
+        print(f"Reusing {len(results)} of {len(tasks)} cached replications")
+    tasks = [task for task in tasks if task not in results]
+
+    def finish(task, statistics):
+        results[task] = statistics
+        if cache is not None:
+            cache.put(task_configurations[task], time_limit, replication_seed(task_configurations[task], task[1]), statistics)
+
+    if workers > 1 and len(tasks) > 0:
+        with ProcessPoolExecutor(workers) as executor:
+            futures = {executor.submit(run_replication, task_configurations[task], task[1], time_limit): task for task in tasks}
+            for future in as_completed(futures):
+                finish(futures[future], future.result())
+    else:
+        for task in tasks:
+            finish(task, run_replication(task_configurations[task], task[1], time_limit))
+
+    all_averaged_statistics = []
+    for c, configuration in enumerate(configurations):
+        averaged_statistics = average_statistics([results[(c, r)] for r in range(number_of_repetitions)])
+        print_experiment(number_of_repetitions, time_limit, configuration, averaged_statistics)
+        all_averaged_statistics.append(averaged_statistics)
+
+    if common_random_numbers:
+        baseline_statistics = [results[(0, r)] for r in range(number_of_repetitions)]
+        for c in range(1, len(configurations)):
+            differences = paired_differences(baseline_statistics, [results[(c, r)] for r in range(number_of_repetitions)])
+            print_paired_differences(configurations[0], configurations[c], differences)
+
     end_time = time.time()
     print()
     print(f"Total Time for Experiment: {round((end_time - start_time) / 60, 3)} minutes")
 
+    return all_averaged_statistics
 
-# Baseline hyperparameters
-number_of_repetitions = 5
-time_limit = 20                 # run no longer than 10 units of time
-pair_arrival_rate = 100         # means that 100 pairs are going to be arriving every one time period
-base_pair_departure_rate = 0.4      # means that each pairs is expected to last 2.25 units of time
-base_altruist_arrival_rate = 1.0     # means 1 altruist in expectation will show up each unit of time
-base_altruist_departure_rate = 0.4   # means altruist last 2.25 units of time in expectation
-
-
-# Batch size experiments (no altruists)
-batch_sizes = [10, 20, 30, 50, 100, 1]
-for batch_size in batch_sizes:
-    run_experiment(number_of_repetitions, time_limit, pair_arrival_rate, pair_departure_rate=base_pair_departure_rate, batch_size=batch_size)
-
-
-# Pair departure rates experiments (no altruists)
-departure_rates = [0.2, 0.4, 0.6, 0.8]
-batch_sizes = [10, 30, 50, 1]
-for batch_size in batch_sizes:
-    for departure_rate in departure_rates:
-        run_experiment(number_of_repetitions, time_limit, pair_arrival_rate, pair_departure_rate=departure_rate, batch_size=batch_size)
-
-
-# Impact of altruists (departure rate selected)
-altruist_arrival_rates = [0.5, 1.0]
-batch_sizes = [10, 30, 50, 1]
-for batch_size in batch_sizes:
-    for altruist_arrival_rate in altruist_arrival_rates:
-        run_experiment(number_of_repetitions, time_limit, pair_arrival_rate, pair_departure_rate=base_pair_departure_rate, altruist_arrival_rate=altruist_arrival_rate, altruist_departure_rate=base_altruist_departure_rate, batch_size=batch_size)
-
-
-# Potential and Fairness Weighted
-for solver_type in [ProblemType.POTENTIALS, ProblemType.FAIRNESS]:
-    for batch_size in [1, 10, 30]:
-        run_experiment(number_of_repetitions, time_limit, pair_arrival_rate, pair_departure_rate=base_pair_departure_rate, 
-                        altruist_arrival_rate=base_altruist_arrival_rate, altruist_departure_rate=base_altruist_departure_rate, batch_size=batch_size, problem_type=solver_type)
-
-
-
-
-
-
-
-
+def experiment_configuration(pair_arrival_rate, pair_departure_rate=0,
+                             altruist_arrival_rate=0, altruist_departure_rate=0,
+                             problem_type=ProblemType.SIMPLE, batch_size=10, backend=SolverBackend.PULP_CBC):
+    return {"pair_arrival_rate": pair_arrival_rate, "pair_departure_rate": pair_departure_rate,
+            "altruist_arrival_rate": altruist_arrival_rate, "altruist_departure_rate": altruist_departure_rate,
+            "problem_type": problem_type, "batch_size": batch_size, "backend": backend}
 
+def run_experiment(number_of_repetitions,
+                  time_limit,
+                  pair_arrival_rate, pair_departure_rate=0,
+                  altruist_arrival_rate=0, altruist_departure_rate=0,
+                  problem_type=ProblemType.SIMPLE, batch_size=10, backend=SolverBackend.PULP_CBC, workers=1, cache_dir=None, baseline=None):
+    configuration = experiment_configuration(pair_arrival_rate, pair_departure_rate, altruist_arrival_rate, altruist_departure_rate,
+                                             problem_type, batch_size, backend)
+    if baseline is None:
+        return run_experiments([configuration], number_of_repetitions, time_limit, workers, cache_dir)[0]
+
+    # baseline holds the settings to compare against (e.g. {"batch_size": 1}) - both run on common random numbers
+    # and the paired differences are reported
+    return run_experiments([dict(configuration, **baseline), configuration], number_of_repetitions, time_limit, workers, cache_dir,
+                           common_random_numbers=True)[1]
+
+
+if __name__ == "__main__":
+    # Baseline hyperparameters
+    number_of_repetitions = 5
+    time_limit = 20                 # run no longer than 10 units of time
+    pair_arrival_rate = 100         # means that 100 pairs are going to be arriving every one time period
+    base_pair_departure_rate = 0.4      # means that each pairs is expected to last 2.25 units of time
+    base_altruist_arrival_rate = 1.0     # means 1 altruist in expectation will show up each unit of time
+    base_altruist_departure_rate = 0.4   # means altruist last 2.25 units of time in expectation
+
+    # the sweeps run as they always have (one process, no cache, independent replications) unless asked otherwise
+    parser = argparse.ArgumentParser(description="Experiments of the dynamic kidney exchange simulator")
+    parser.add_argument('--workers', type=int, default=1, help="replications of a sweep run in parallel (e.g. the number of cores)")
+    parser.add_argument('--cache-dir', default=None,
+                        help="keep finished replications there (e.g. experimental_results/cache), so a rerun only computes what is missing")
+    parser.add_argument('--common-random-numbers', action='store_true',
+                        help="configurations of a sweep see the same patients, so their differences need fewer repetitions")
+    args = parser.parse_args()
+    workers = args.workers
+    cache_dir = args.cache_dir
+    common_random_numbers = args.common_random_numbers
+
+
+    # Batch size experiments (no altruists)
+    batch_sizes = [10, 20, 30, 50, 100, 1]
+    run_experiments([experiment_configuration(pair_arrival_rate, pair_departure_rate=base_pair_departure_rate, batch_size=batch_size)
+                     for batch_size in batch_sizes], number_of_repetitions, time_limit, workers, cache_dir, common_random_numbers)
+
+
+    # Pair departure rates experiments (no altruists)
+    departure_rates = [0.2, 0.4, 0.6, 0.8]
+    batch_sizes = [10, 30, 50, 1]
+    run_experiments([experiment_configuration(pair_arrival_rate, pair_departure_rate=departure_rate, batch_size=batch_size)
+                     for batch_size in batch_sizes for departure_rate in departure_rates], number_of_repetitions, time_limit, workers, cache_dir, common_random_numbers)
+
+
+    # Impact of altruists (departure rate selected)
+    altruist_arrival_rates = [0.5, 1.0]
+    batch_sizes = [10, 30, 50, 1]
+    run_experiments([experiment_configuration(pair_arrival_rate, pair_departure_rate=base_pair_departure_rate, altruist_arrival_rate=altruist_arrival_rate,
+                                              altruist_departure_rate=base_altruist_departure_rate, batch_size=batch_size)
+                     for batch_size in batch_sizes for altruist_arrival_rate in altruist_arrival_rates], number_of_repetitions, time_limit, workers, cache_dir, common_random_numbers)
+
+
+    # Potential and Fairness Weighted
+    run_experiments([experiment_configuration(pair_arrival_rate, pair_departure_rate=base_pair_departure_rate,
+                                              altruist_arrival_rate=base_altruist_arrival_rate, altruist_departure_rate=base_altruist_departure_rate,
+                                              batch_size=batch_size, problem_type=solver_type)
+                     for solver_type in [ProblemType.POTENTIALS, ProblemType.FAIRNESS] for batch_size in [1, 10, 30]],
+                    number_of_repetitions, time_limit, workers, cache_dir, common_random_numbers)
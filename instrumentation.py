@@ -0,0 +1,104 @@
+# Per-batch instrumentation of the simulator
+# When a BatchRecorder is active, every match of the simulator writes one record (pool size, edge / cycle / chain
+# counts, wall time of each stage of the solve, peak memory) as a line of JSON or a row of CSV.
+# The hot paths only call stage() and count(), which do nothing but check a global when instrumentation is off
+from contextlib import contextmanager, nullcontext
+import csv
+import json
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:     # not available on Windows
+    resource = None
+
+# BatchRecorder collecting the current batch, None when instrumentation is off
+recorder = None
+
+# shared context manager for when instrumentation is off
+no_op = nullcontext()
+
+# time a stage of the current batch: with instrumentation.stage('solve'): ...
+def stage(name):
+    if recorder is None:
+        return no_op
+    return recorder.stage(name)
+
+# record a count (e.g. the number of cycles) for the current batch
+def count(name, value):
+    if recorder is not None:
+        recorder.record[name] = value
+
+# columns of the CSV output, in order - stages and counts are in seconds and numbers of items
+csv_columns = ['batch', 'time', 'pool_pairs', 'pool_altruists', 'edges', 'altruist_edges', 'cycles', 'chains', 'chain_arcs',
+               'matched_pairs', 'matched_altruists', 'update_pool_graph', 'snapshot', 'find_edges', 'find_cycles', 'find_chains',
+               'weights', 'build_model', 'solve', 'gap', 'time_limit_hit', 'batch_wall_time', 'peak_rss_kb', 'peak_traced_kb']
+
+class BatchRecorder:
+    # path ends in .csv for CSV output, anything else gives JSON lines
+    # with trace_memory, tracemalloc is used for the peak Python memory of each batch (exact, but slows everything down)
+    def __init__(self, path, trace_memory=False):
+        self.path = path
+        self.csv = path.endswith('.csv')
+        self.trace_memory = trace_memory
+        self.file = None
+        self.writer = None
+        self.batch = 0
+        self.record = {}
+        self.batch_start = None
+
+    # with append, the records go after those already in the file (a resumed run, see DynamicSimulator.resume)
+    def open(self, append=False):
+        self.file = open(self.path, 'a' if append else 'w', newline='')
+        if self.csv:
+            self.writer = csv.DictWriter(self.file, fieldnames=csv_columns, extrasaction='ignore')
+            if not append:
+                self.writer.writeheader()
+        if self.trace_memory:
+            tracemalloc.start()
+        self.start_batch()
+        return self
+
+    def close(self):
+        if self.trace_memory:
+            tracemalloc.stop()
+        self.file.close()
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record[name] = self.record.get(name, 0.) + time.perf_counter() - start
+
+    def start_batch(self):
+        self.record = {}
+        self.batch_start = time.perf_counter()
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+
+    # write the record of the batch that just ended, with the given fields, and start the next one
+    def end_batch(self, **fields):
+        self.record.update(fields)
+        self.record['batch'] = self.batch
+        self.record['batch_wall_time'] = time.perf_counter() - self.batch_start
+        if resource is not None:
+            self.record['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if self.trace_memory:
+            self.record['peak_traced_kb'] = tracemalloc.get_traced_memory()[1] / 1024
+
+        if self.csv:
+            self.writer.writerow(self.record)
+        else:
+            self.file.write(json.dumps(self.record) + '\n')
+        self.file.flush()
+
+        self.batch += 1
+        self.start_batch()
+
+# make recorder the active recorder (or turn instrumentation off with None)
+def activate(batch_recorder):
+    global recorder
+    recorder = batch_recorder
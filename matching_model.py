@@ -0,0 +1,215 @@
+# Persistent matching model kept alive across simulator batches
+# Instead of building a new PuLP problem and shelling out to CBC on every batch, a MatchingModel keeps one in-process
+# HiGHS model for the whole run: every vertex of the pool is a row (used at most once) and every cycle or chain is a
+# column keyed by the stable ids of its vertices (see PoolGraph). A batch only adds the columns of new cycles and chains,
+# deletes the columns and rows of vertices that have left the pool, refreshes the objective and warm starts from the
+# last solution - nothing is written to disk
+try:
+    import highspy
+except ImportError:
+    highspy = None
+
+import numpy as np
+
+from solver import Graph
+from backends import PackingProblem, SolveReport, greedy_packing, relative_gap
+import instrumentation
+
+class MatchingModel:
+    # with limits (a SolveLimits), every solve stops at the time limit or gap and keeps the best packing found, which is
+    # never worse than the warm start from the previous batch
+    def __init__(self, problem_type, max_cycle_length=3, max_chain_length=10, max_structures=None, limits=None):
+        if highspy is None:
+            raise ImportError('The persistent matching model needs highspy (pip install highspy)')
+
+        self.problem_type = problem_type
+        self.max_cycle_length = max_cycle_length
+        self.max_chain_length = max_chain_length
+        self.max_structures = max_structures
+
+        self.limits = limits
+        self.highs = self.new_model()
+
+        self.rows = []            # row keys in model order: ('pair', id) or ('altruist', id)
+        self.row_index = {}       # row key -> position in the model
+        self.columns = []         # column keys in model order: ('cycle', pair ids) or ('chain', altruist id, pair ids)
+        self.column_index = {}    # column key -> position in the model
+        self.solution = []        # value of each column in the last solve, used as the warm start of the next one
+
+    def new_model(self):
+        highs = highspy.Highs()
+        highs.setOptionValue('output_flag', False)
+        highs.changeObjectiveSense(highspy.ObjSense.kMaximize)
+        if self.limits is not None and self.limits.time_limit is not None:
+            highs.setOptionValue('time_limit', float(self.limits.time_limit))
+        if self.limits is not None and self.limits.gap is not None:
+            highs.setOptionValue('mip_rel_gap', float(self.limits.gap))
+        return highs
+
+    # the HiGHS model cannot be pickled (checkpoints of the simulator), so it is rebuilt from its rows and columns when
+    # loading - the costs are all refreshed by the next solve, and the warm start is kept
+    def __getstate__(self):
+        return {key: value for key, value in self.__dict__.items() if key != 'highs'}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.highs = self.new_model()
+        rows, columns, solution = self.rows, self.columns, self.solution
+        self.rows, self.row_index, self.columns, self.column_index = [], {}, [], {}
+        self.add_rows(rows)
+        self.add_columns(columns)
+        self.solution = solution
+
+    # rows used by a column: one per pair, plus the altruistic donor for chains
+    def column_rows(key):
+        if key[0] == 'cycle':
+            return [('pair', i) for i in key[1]]
+        return [('altruist', key[1])] + [('pair', i) for i in key[2]]
+
+    # delete the columns that are no longer in the pool, then the rows of vertices that have left it
+    def remove_stale(self, current_columns, current_rows):
+        stale_columns = [c for c in range(len(self.columns)) if self.columns[c] not in current_columns]
+        if len(stale_columns) > 0:
+            self.highs.deleteCols(len(stale_columns), np.array(stale_columns, dtype=np.int32))
+            stale = set(stale_columns)
+            self.columns = [self.columns[c] for c in range(len(self.columns)) if c not in stale]
+            self.solution = [self.solution[c] for c in range(len(self.solution)) if c not in stale]
+            self.column_index = {key: c for c, key in enumerate(self.columns)}
+
+        stale_rows = [r for r in range(len(self.rows)) if self.rows[r] not in current_rows]
+        if len(stale_rows) > 0:
+            self.highs.deleteRows(len(stale_rows), np.array(stale_rows, dtype=np.int32))
+            stale = set(stale_rows)
+            self.rows = [self.rows[r] for r in range(len(self.rows)) if r not in stale]
+            self.row_index = {key: r for r, key in enumerate(self.rows)}
+
+    # add a row (at most one cycle or chain) for every vertex not yet in the model
+    def add_rows(self, current_rows):
+        new_rows = [key for key in current_rows if key not in self.row_index]
+        if len(new_rows) == 0:
+            return
+
+        for key in new_rows:
+            self.row_index[key] = len(self.rows)
+            self.rows.append(key)
+
+        no_entries = np.array([], dtype=np.int32)
+        self.highs.addRows(len(new_rows), np.full(len(new_rows), -highspy.kHighsInf), np.ones(len(new_rows)), 0, no_entries, no_entries, np.array([]))
+
+    # add a binary column for every cycle or chain not yet in the model
+    def add_columns(self, current_columns):
+        new_columns = [key for key in current_columns if key not in self.column_index]
+        if len(new_columns) == 0:
+            return
+
+        starts = []
+        indices = []
+        for key in new_columns:
+            starts.append(len(indices))
+            indices.extend(self.row_index[row] for row in MatchingModel.column_rows(key))
+
+            self.column_index[key] = len(self.columns)
+            self.columns.append(key)
+            self.solution.append(0.)
+
+        n = len(new_columns)
+        first = len(self.columns) - n
+        self.highs.addCols(n, np.zeros(n), np.zeros(n), np.ones(n), len(indices), np.array(starts, dtype=np.int32),
+                           np.array(indices, dtype=np.int32), np.ones(len(indices)))
+        self.highs.changeColsIntegrality(n, np.arange(first, first + n, dtype=np.int32), np.array([highspy.HighsVarType.kInteger] * n))
+
+    # solve the matching problem for the current pool (a PoolSnapshot) - same return values as solve_kidney_matching
+    # with limits, the SolveReport of the solve is appended to reports if given
+    # chains are enumerated in parallel on enumeration_executor if given (see Graph)
+    def solve(self, snapshot, curr_time, reports=None, enumeration_executor=None):
+        graph = Graph(snapshot.pairs, snapshot.altruistic_donors, self.problem_type, curr_time, edges=snapshot.edges,
+                      altruist_edges=snapshot.altruist_edges, cycles=snapshot.cycles, chains=snapshot.chains, max_cycle_length=self.max_cycle_length,
+                      max_chain_length=self.max_chain_length, max_structures=self.max_structures,
+                      enumeration_executor=enumeration_executor)
+        pair_ids = snapshot.pair_ids
+        altruist_ids = snapshot.altruist_ids
+
+        # every cycle and chain of the current pool, keyed by stable ids so they line up with the columns of earlier batches
+        keys = [('cycle', tuple(pair_ids[p] for p in c.pairs)) for c in graph.cycles]
+        keys += [('chain', altruist_ids[c.altruistic_donor], tuple(pair_ids[p] for p in c.pairs)) for c in graph.chains]
+        weights = graph.cycle_weights + graph.chain_weights
+
+        current_rows = [('pair', i) for i in pair_ids] + [('altruist', a) for a in altruist_ids]
+
+        # bring the model up to date with the pool
+        with instrumentation.stage('build_model'):
+            self.remove_stale(set(keys), set(current_rows))
+            self.add_rows(current_rows)
+            self.add_columns(keys)
+            if len(keys) == 0:
+                if self.limits is not None:
+                    self.record(SolveReport(0., 0., 0., False), reports)
+                return [], []
+
+            # weights depend on the current time for some problem types, so the whole objective is refreshed
+            positions = np.array([self.column_index[key] for key in keys], dtype=np.int32)
+            self.highs.changeColsCost(len(keys), positions, np.array(weights, dtype=np.float64))
+
+        # warm start from the previous solution or the greedy packing, whichever is heavier - kept as the solution if
+        # a limited solve finds nothing better
+        self.solution = self.warm_start(keys, positions, weights)
+        warm_start = highspy.HighsSolution()
+        warm_start.col_value = self.solution
+        self.highs.setSolution(warm_start)
+
+        with instrumentation.stage('solve'):
+            self.highs.run()
+        if self.limits is None or self.highs.getInfo().primal_solution_status == 2:   # kSolutionStatusFeasible
+            self.solution = list(self.highs.getSolution().col_value)
+        if self.limits is not None:
+            self.report(positions, weights, reports)
+
+        # gets pairs and altruistic donors of the selected cycles and chains
+        selected = [self.solution[c] > 0.5 for c in positions]
+        selected_cycles = [graph.cycles[k] for k in range(len(graph.cycles)) if selected[k]]
+        selected_chains = [graph.chains[k] for k in range(len(graph.chains)) if selected[len(graph.cycles) + k]]
+
+        matched = [snapshot.pairs[p] for s in selected_cycles + selected_chains for p in s.pairs]
+        used_altruistic_donors = [snapshot.altruistic_donors[c.altruistic_donor] for c in selected_chains]
+
+        # check to make sure no pair or donor was used twice
+        assert len(matched) == len(set(matched))
+        assert len(used_altruistic_donors) == len(set(used_altruistic_donors))
+
+        return matched, used_altruistic_donors
+
+    # the previous solution (new columns start at 0, which is always feasible) or the greedy packing of the current
+    # columns (see greedy_packing), whichever is heavier, as column values in model order
+    def warm_start(self, keys, positions, weights):
+        rows = [MatchingModel.column_rows(key) for key in keys]
+        row_indices = [self.row_index[row] for key_rows in rows for row in key_rows]
+        column_indices = [k for k, key_rows in enumerate(rows) for _ in key_rows]
+        greedy = greedy_packing(PackingProblem(weights, row_indices, column_indices, [1] * len(row_indices), [1] * len(self.rows)))
+
+        previous_objective = sum(w for c, w in zip(positions, weights) if self.solution[c] > 0.5)
+        if sum(w for v, w in zip(greedy, weights) if v == 1) <= previous_objective:
+            return self.solution
+        solution = [0.] * len(self.columns)
+        for c, v in zip(positions, greedy):
+            solution[c] = float(v)
+        return solution
+
+    # record how good the packing of a limited solve is
+    def report(self, positions, weights, reports):
+        objective = sum(w for c, w in zip(positions, weights) if self.solution[c] > 0.5)
+        info = self.highs.getInfo()
+        time_limit_hit = self.highs.getModelStatus() == highspy.HighsModelStatus.kTimeLimit
+        if np.isfinite(info.mip_dual_bound):
+            bound = max(info.mip_dual_bound, objective)
+        elif time_limit_hit:    # stopped before HiGHS had a bound - taking every positive-weight column is one
+            bound = max(sum(w for w in weights if w > 0), objective)
+        else:
+            bound = objective
+        self.record(SolveReport(objective, bound, relative_gap(objective, bound), time_limit_hit), reports)
+
+    # count a SolveReport in the instrumentation and keep it in reports if given
+    def record(self, report, reports):
+        instrumentation.count('gap', report.gap)
+        instrumentation.count('time_limit_hit', report.time_limit_hit)
+        if reports is not None:
+            reports.append(report)
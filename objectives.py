@@ -0,0 +1,148 @@
+# Objective weights of cycles and chains
+# Every objective gives each vertex of the pool a score once per batch: the weight of a cycle is then
+# constant + size_weight * (number of pairs) + the scores of its pairs, and a chain also adds the score of its altruistic
+# donor. The weights of all cycles (or chains) come from one gather of the scores at a flat array of pair indices and
+# one bincount, instead of recomputing the per-vertex terms of every pair of every cycle and chain.
+# New objectives are plain functions registered under a name (see register_objective) - the ProblemType members are
+# registered under their names, and a problem type can be a ProblemType, the name of a registered objective or an
+# objective function itself
+from itertools import chain as concatenate
+
+import numpy as np
+
+from patient_donor_pairs import BloodType, Patient, Donor
+import compatibility
+from pool_store import PairView, DonorView, shared_store, view_ids
+
+# potentials by blood type code (see compatibility.py)
+patient_potentials = np.array([Patient.get_potential(blood_type) for blood_type in BloodType])
+donor_potentials = np.array([Donor.get_potential(blood_type) for blood_type in BloodType])
+
+# per-vertex decomposition of the weights of an objective - pair_scores[i] is the score of pair i and
+# altruist_scores[d] the score of altruistic donor d (numpy arrays)
+class VertexScores:
+    def __init__(self, pair_scores, altruist_scores, constant=0., size_weight=0.):
+        self.pair_scores = np.asarray(pair_scores, dtype=np.float64)
+        self.altruist_scores = np.asarray(altruist_scores, dtype=np.float64)
+        self.constant = constant            # added once to every cycle and chain
+        self.size_weight = size_weight      # added once per pair of every cycle and chain
+
+# columns of a list of pairs or altruistic donors, gathered when an objective first asks for them (straight from the
+# PoolStore for its views)
+class VertexColumns:
+    def __init__(self, vertices, is_pair):
+        self.vertices = vertices
+        self.is_pair = is_pair
+        self.columns = {}
+
+    def __len__(self):
+        return len(self.vertices)
+
+    def column(self, name, compute):
+        if name not in self.columns:
+            self.columns[name] = compute()
+        return self.columns[name]
+
+    # blood type codes of the patients (pairs only)
+    @property
+    def patient_types(self):
+        return self.column('patient_types', lambda: compatibility.encode_patients(self.vertices)[0])
+
+    # blood type codes of the donors
+    @property
+    def donor_types(self):
+        donors = [p.donor for p in self.vertices] if self.is_pair else self.vertices
+        return self.column('donor_types', lambda: compatibility.encode_donors(donors)[0])
+
+    @property
+    def arrival_times(self):
+        return self.column('arrival_times', lambda: self.times('arrival_times', 'arrival_time'))
+
+    @property
+    def departure_times(self):
+        return self.column('departure_times', lambda: self.times('departure_times', 'departure_time'))
+
+    def times(self, store_column, attribute):
+        store = shared_store(self.vertices, PairView if self.is_pair else DonorView)
+        if store is not None:
+            return getattr(store, store_column)[view_ids(self.vertices)]
+        return np.fromiter((getattr(v, attribute) for v in self.vertices), dtype=np.float64, count=len(self.vertices))
+
+# name -> objective function(pairs, altruistic_donors, curr_time) returning VertexScores, where pairs and
+# altruistic_donors are VertexColumns
+objectives = {}
+
+# register an objective function under a name - also works as a decorator: @register_objective('NAME')
+def register_objective(name, function=None):
+    if function is None:
+        return lambda function: register_objective(name, function)
+    objectives[name] = function
+    return function
+
+# the objective function of a problem type (a ProblemType, the name of a registered objective or an objective function)
+def objective_function(problem_type):
+    if callable(problem_type):
+        return problem_type
+    name = getattr(problem_type, 'name', problem_type)
+    if name not in objectives:
+        raise Exception(f'Unknown objective {name}')
+    return objectives[name]
+
+# SIMPLE: weights are the number of pairs matched
+@register_objective('SIMPLE')
+def simple_objective(pairs, altruistic_donors, curr_time):
+    return VertexScores(np.zeros(len(pairs)), np.zeros(len(altruistic_donors)), size_weight=1.)
+
+# POTENTIALS: weights are the number of pairs matched minus the potential of each patient and donor used, and minus
+# 3 times the potential of the altruistic donor of a chain
+@register_objective('POTENTIALS')
+def potentials_objective(pairs, altruistic_donors, curr_time):
+    pair_scores = -(patient_potentials[pairs.patient_types] + donor_potentials[pairs.donor_types]) if len(pairs) > 0 else []
+    altruist_scores = -3 * donor_potentials[altruistic_donors.donor_types] if len(altruistic_donors) > 0 else []
+    return VertexScores(pair_scores, altruist_scores, size_weight=1.)
+
+# FAIRNESS: weights take into account waiting time and time before departure of every pair
+@register_objective('FAIRNESS')
+def fairness_objective(pairs, altruistic_donors, curr_time):
+    pair_scores = []
+    if len(pairs) > 0:
+        pair_scores = np.sqrt(curr_time - pairs.arrival_times) + np.maximum(0, 10 - (pairs.departure_times - curr_time))
+    return VertexScores(pair_scores, np.zeros(len(altruistic_donors)), constant=1.)
+
+# scores of the pairs and altruistic donors of a batch under the objective of problem_type
+def vertex_scores(problem_type, pairs, altruistic_donors, curr_time):
+    return objective_function(problem_type)(VertexColumns(pairs, True), VertexColumns(altruistic_donors, False), curr_time)
+
+# sums[k] is the sum of scores over groups[k] (lists of indices), and sizes[k] the length of groups[k]
+# the scores are added in the order of each group, like sum() would
+def gather_sums(scores, groups):
+    sizes = np.fromiter(map(len, groups), dtype=np.int64, count=len(groups))
+    flat = np.fromiter(concatenate.from_iterable(groups), dtype=np.int64, count=int(sizes.sum()))
+    owners = np.repeat(np.arange(len(groups)), sizes)
+    return np.bincount(owners, weights=scores[flat], minlength=len(groups)), sizes
+
+# weights of a list of Cycles
+def cycle_weights(scores, cycles):
+    if len(cycles) == 0:
+        return []
+    sums, sizes = gather_sums(scores.pair_scores, [c.pairs for c in cycles])
+    return ((scores.constant + scores.size_weight * sizes) + sums).tolist()
+
+# weights of a list of Chains
+def chain_weights(scores, chains):
+    if len(chains) == 0:
+        return []
+    sums, sizes = gather_sums(scores.pair_scores, [c.pairs for c in chains])
+    donors = np.fromiter((c.altruistic_donor for c in chains), dtype=np.int64, count=len(chains))
+    return (((scores.constant + scores.size_weight * sizes) + sums) + scores.altruist_scores[donors]).tolist()
+
+# weights of the arcs (s, j, k) of the position-indexed chain formulation - summed over the arcs of a chain they give its
+# chain weight: every arc adds its receiving pair j, and the first arc (k == 1) adds the constant and altruistic donor s
+def chain_arc_weights(scores, arcs):
+    if len(arcs) == 0:
+        return []
+    sources, receivers, positions = (np.array(column, dtype=np.int64) for column in zip(*arcs))
+    weights = scores.size_weight + scores.pair_scores[receivers]
+    first = positions == 1
+    weights[first] += scores.constant + scores.altruist_scores[sources[first]]
+    return weights.tolist()
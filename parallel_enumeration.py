@@ -0,0 +1,160 @@
+# Parallel enumeration of cycles and chains
+# The search for cycles from each smallest vertex, and for chains from each altruistic donor, is independent of every
+# other, so the start vertices (or altruistic donors) are split into shards enumerated by a process pool. The edges
+# are written once per graph to shared memory in compressed sparse row form, and every worker process builds its own
+# adjacency sets from it the first time it sees the graph, instead of the whole list of sets being pickled into every task.
+# The results are merged by start vertex (or altruistic donor), so the output is the same whatever the number of
+# processes - the same as the serial enumeration whenever the edges were built in sorted order (as by find_edges)
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import enumeration
+
+# number of shards the start vertices are split into - more shards than processes so that a few heavy start vertices
+# (small vertices start many cycles) do not leave the other processes idle
+default_shards = 32
+
+# edges (edges[i] is the set of vertices i has an edge to) in compressed sparse row form in shared memory:
+# offsets (n + 1 int64) followed by the sorted targets (int32) - close() once the enumeration is done
+class SharedAdjacency:
+    def __init__(self, edges):
+        self.num_vertices = len(edges)
+        self.num_edges = sum(len(e) for e in edges)
+
+        self.memory = shared_memory.SharedMemory(create=True, size=max(1, SharedAdjacency.size(self.num_vertices, self.num_edges)))
+        offsets, targets = SharedAdjacency.arrays(self.memory, self.num_vertices, self.num_edges)
+        offsets[0] = 0
+        offsets[1:] = np.cumsum([len(e) for e in edges])
+        for i, e in enumerate(edges):
+            targets[offsets[i]:offsets[i + 1]] = sorted(e)
+
+        # what a worker needs to attach to it
+        self.handle = (self.memory.name, self.num_vertices, self.num_edges)
+
+    def size(num_vertices, num_edges):
+        return 8 * (num_vertices + 1) + 4 * num_edges
+
+    def arrays(memory, num_vertices, num_edges):
+        offsets = np.ndarray(num_vertices + 1, dtype=np.int64, buffer=memory.buf)
+        targets = np.ndarray(num_edges, dtype=np.int32, buffer=memory.buf, offset=8 * (num_vertices + 1))
+        return offsets, targets
+
+    def close(self):
+        self.memory.close()
+        self.memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# adjacency of the last graph seen by this worker process: (shared memory name, edges, in_edges)
+attached = None
+
+# edges and in_edges (lists of sets) of a SharedAdjacency, built once per worker process and graph
+def attach(handle):
+    global attached
+    name, num_vertices, num_edges = handle
+    if attached is not None and attached[0] == name:
+        return attached[1], attached[2]
+
+    memory = shared_memory.SharedMemory(name=name)
+    offsets, targets = SharedAdjacency.arrays(memory, num_vertices, num_edges)
+    offsets, targets = offsets.tolist(), targets.tolist()   # copies, so no view of the buffer is left when it is closed
+    memory.close()
+
+    edges = [set(targets[offsets[i]:offsets[i + 1]]) for i in range(num_vertices)]
+    in_edges = [set() for _ in range(num_vertices)]
+    for i in range(num_vertices):
+        for j in targets[offsets[i]:offsets[i + 1]]:
+            in_edges[j].add(i)
+
+    attached = (name, edges, in_edges)
+    return edges, in_edges
+
+# paths found by a shard, packed into flat arrays to keep what goes back to the main process small:
+# the key (start vertex or altruistic donor) and length of every path, and the vertices of all paths one after the other
+class ShardPaths:
+    def __init__(self):
+        self.keys = []
+        self.lengths = []
+        self.vertices = []
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key, path):
+        self.keys.append(key)
+        self.lengths.append(len(path))
+        self.vertices.extend(path)
+
+    def packed(self, truncated):
+        return np.array(self.keys, dtype=np.int32), np.array(self.lengths, dtype=np.int16), np.array(self.vertices, dtype=np.int32), truncated
+
+# cycles found from the start vertices of one shard - stops after limit cycles if given
+def shard_cycles(handle, starts, max_cycle_length, limit):
+    edges, in_edges = attach(handle)
+    found = ShardPaths()
+    for i in starts:
+        for path in enumeration.find_cycles_through(i, edges, in_edges, max_cycle_length, lambda j: j > i):
+            if limit is not None and len(found) == limit:
+                return found.packed(True)
+            found.add(i, path)
+    return found.packed(False)
+
+# chains from the altruistic donors of one shard - first_pairs[k] is altruist_edges[donors[k]]
+def shard_chains(handle, donors, first_pairs, max_chain_length, limit):
+    edges, _ = attach(handle)
+    found = ShardPaths()
+    for d, starts in zip(donors, first_pairs):
+        for path in enumeration.find_chains_from(starts, edges, max_chain_length):
+            if limit is not None and len(found) == limit:
+                return found.packed(True)
+            found.add(d, path)
+    return found.packed(False)
+
+# run function over shards of the given keys (interleaved, so that consecutive keys land in different shards), then merge
+# the paths by key - stable, so the paths of one key keep the order they were found in
+# every shard stops at limit, which is enough to know the first limit paths overall
+# returns the keys and paths (lists of vertices), and whether there were more than limit
+def run_shards(executor, function, keys, shard_arguments, limit, shards):
+    futures = []
+    for s in range(min(shards, len(keys))):
+        futures.append(executor.submit(function, *shard_arguments(keys[s::shards]), limit))
+
+    results = [future.result() for future in futures]
+    if len(results) == 0:
+        return [], [], False
+    path_keys = np.concatenate([r[0] for r in results])
+    lengths = np.concatenate([r[1] for r in results])
+    vertices = np.concatenate([r[2] for r in results]).tolist()
+    truncated = any(r[3] for r in results)
+
+    starts = (np.cumsum(lengths, dtype=np.int64) - lengths).tolist()
+    lengths = lengths.tolist()
+    order = np.argsort(path_keys, kind='stable')
+    if limit is not None and len(order) > limit:
+        order = order[:limit]
+        truncated = True
+
+    order = order.tolist()
+    return path_keys[order].tolist(), [vertices[starts[k]:starts[k] + lengths[k]] for k in order], truncated
+
+# every cycle of at most max_cycle_length vertices, each from its smallest vertex, enumerated on executor
+# returns lists of vertices in the order of Graph.find_cycles, and whether the enumeration was truncated at limit
+def find_cycles(executor, edges, max_cycle_length=3, limit=None, shards=default_shards):
+    with SharedAdjacency(edges) as adjacency:
+        _, cycles, truncated = run_shards(executor, shard_cycles, list(range(len(edges))),
+                                          lambda starts: (adjacency.handle, starts, max_cycle_length), limit, shards)
+    return cycles, truncated
+
+# every chain of at most max_chain_length pairs from every altruistic donor, enumerated on executor
+# returns (altruistic donor, list of pairs) in the order of Graph.find_chains, and whether the enumeration was truncated at limit
+def find_chains(executor, altruist_edges, edges, max_chain_length=10, limit=None, shards=default_shards):
+    with SharedAdjacency(edges) as adjacency:
+        donors, chains, truncated = run_shards(executor, shard_chains, list(range(len(altruist_edges))),
+                                               lambda donors: (adjacency.handle, donors, [altruist_edges[d] for d in donors], max_chain_length),
+                                               limit, shards)
+    return list(zip(donors, chains)), truncated
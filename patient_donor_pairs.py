@@ -1,9 +1,14 @@
 from enum import Enum
+from bisect import bisect_left
+import hashlib
 import random
+import os
 
-# Global variable for storing the composition of the NKR pool
+# PRA levels a patient can have (the columns of distributions.txt)
 pra_intervals = [0, 0.05, 0.3, 0.65, 0.875, 0.97, 0.995]
-nkr_pool_composition = {}
+
+# NKR Pool Composition (2010-2014) shipped with the code
+default_distributions_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "distributions.txt")
 
 class BloodType(Enum):
     O = 1
@@ -92,37 +97,98 @@ class Pair():
         self.was_matched = False
         self.match_time = -1
 
+# Distribution of the ABO types and PRA of incoming patient-donor pairs
+# Nothing is read until the composition is first used, so creating one (or importing this module) costs nothing,
+# and several compositions can be simulated side by side by passing them to the generators and the simulator
+class PoolComposition:
+    def __init__(self, path=default_distributions_path, data=None):
+        self.path = path if data is None else None  # file in the format of distributions.txt, read on first use
+        self.data = data                            # or the table itself: (patient type, donor type) -> {"probability_of_pair", "cond_probability_pra"}
+
+        self.abo_pairs = None           # ABO combinations in file order
+        self.abo_cumulative = None      # running sum of the probability of each ABO combination
+        self.pra_cumulative = None      # running sums of the PRA probabilities of each ABO combination
+
+    # a hash of the distributions themselves, stable across processes and checkouts, so a composition can be part of an
+    # experiment configuration (see replication_seed and ResultCache) - compositions with the same distributions have
+    # the same repr whether they were read from a file (wherever it is) or given as a table, and different ones never do
+    def __repr__(self):
+        return f"PoolComposition(sha256={self.fingerprint()})"
+
+    def fingerprint(self):
+        self.load()
+        return hashlib.sha256(repr(list(self.data.items())).encode()).hexdigest()[:16]
+
+    # read a file in the format of distributions.txt
+    def read(path):
+        data = {}
+        with open(path, "r") as f:
+            for line in f.readlines():
+                line = line.split()
+
+                patient_type, donor_type = line[0].split('-')[0], line[0].split('-')[1]
+                patient_type = BloodType.get_blood_type_from_string(patient_type)
+                donor_type = BloodType.get_blood_type_from_string(donor_type)
+
+                # Get data for current pair
+                curr_pair_data = {}
+                curr_pair_data["probability_of_pair"] = float(line[1]) / 100
+                curr_pair_data["cond_probability_pra"] = [float(i) / 100 for i in line[2:]]
+
+                # Add data for current pair to the table
+                data[(patient_type, donor_type)] = curr_pair_data
+        return data
+
+    # load the table if needed and precompute the cumulative tables
+    def load(self):
+        if self.abo_pairs is not None:
+            return self
+
+        if self.data is None:
+            self.data = PoolComposition.read(self.path)
+
+        self.abo_pairs = list(self.data.keys())
+        self.abo_cumulative = running_sums([self.data[p]["probability_of_pair"] for p in self.abo_pairs])
+        self.pra_cumulative = [running_sums(self.data[p]["cond_probability_pra"]) for p in self.abo_pairs]
+        return self
+
+# running sums added up left to right, so searching them gives exactly what walking the probabilities would
+def running_sums(probabilities):
+    sums = []
+    running_sum = 0.
+    for probability in probabilities:
+        running_sum += probability
+        sums.append(running_sum)
+    return sums
+
+# composition used when none is given
+default_composition = PoolComposition()
+
 # A function for generating a new patient and donor pair
-def generate_patient_donor_pair():
+# rng is where the random numbers come from - the global random module, or a random.Random stream of its own
+def generate_patient_donor_pair(composition=None, rng=random):
+    composition = (composition if composition is not None else default_composition).load()
+
     # Continue until a valid pair is generated
     while True:
         # Generate ABO of patient donor pair based on NKR Pool Composition
-        abo_pair_ran = random.random()
-        abo_pair = None
-        running_sum = 0.
-        for pair in nkr_pool_composition.keys():
-            running_sum += nkr_pool_composition[pair]["probability_of_pair"]
-            if abo_pair_ran <= running_sum:
-                abo_pair = pair
-                break
-
-        if abo_pair is None:
-            raise Exception(f"Invalid ABO found, running sum is {running_sum}")
+        abo_pair_ran = rng.random()
+        k = bisect_left(composition.abo_cumulative, abo_pair_ran)
+        if k == len(composition.abo_pairs):
+            raise Exception(f"Invalid ABO found, running sum is {composition.abo_cumulative[-1]}")
+        abo_pair = composition.abo_pairs[k]
         
         # Generate PRA of Patient
-        pra_ran = random.random()
+        pra_ran = rng.random()
         pra = None
-        running_sum = 0.
-        for i_c, cond_prob in enumerate(nkr_pool_composition[abo_pair]["cond_probability_pra"]):
-            running_sum += cond_prob 
-            if pra_ran <= running_sum:
-                pra = pra_intervals[i_c]
-                break
+        i_c = bisect_left(composition.pra_cumulative[k], pra_ran)
+        if i_c < len(composition.pra_cumulative[k]):
+            pra = pra_intervals[i_c]
         if not pra:
             pra = pra_intervals[-1]
         
         # Generate virtual pra of donor
-        virtual_pra = random.random() # uniform between 0 and 1
+        virtual_pra = rng.random() # uniform between 0 and 1
         
         # If virtual_pra is not less than pra, then we need to redraw
         if not (virtual_pra < pra) and BloodType.can_donor_donate_to_patient(abo_pair[1], abo_pair[0]):
@@ -136,9 +202,9 @@ def generate_patient_donor_pair():
     return Pair(patient, donor)
 
 # Generate an altruistic donor
-def generate_altruistic_donor():
+def generate_altruistic_donor(rng=random):
     # Assume altruistic donor is drawn from general population
-    ran_donor = random.random()
+    ran_donor = rng.random()
     
     # Base off of nationwide distribution from https://stanfordbloodcenter.org/donate-blood/blood-donation-facts/blood-types/
     if ran_donor < 0.44:
@@ -151,32 +217,11 @@ def generate_altruistic_donor():
         blood_type = BloodType.AB
     
     # Generate virtual pra of donor
-    virtual_pra = random.random() # uniform between 0 and 1
+    virtual_pra = rng.random() # uniform between 0 and 1
 
     return Donor(blood_type, virtual_pra)
 
 
-# Read in the distribution of pairs from the NKR Pool Composition (2010-2014)'
-print("Generating NKR Pool Composition")
-with open("distributions.txt", "r") as f:
-    lines = f.readlines()
-    for line in lines:
-        line = line.split()
-
-        patient_type, donor_type = line[0].split('-')[0], line[0].split('-')[1]
-        patient_type = BloodType.get_blood_type_from_string(patient_type)
-        donor_type = BloodType.get_blood_type_from_string(donor_type)
-
-        # Get data for current pair
-        curr_pair_data = {}
-        curr_pair_data["probability_of_pair"] = float(line[1]) / 100
-        curr_pair_data["cond_probability_pra"] = [float(i) / 100 for i in line[2:]]
-
-        # Add data for current pair to the table
-        nkr_pool_composition[(patient_type, donor_type)] = curr_pair_data
-
-
-
 
 
 # Legacy code - I realized I couldn't figure out Baye's rule for Model 2 - big sad
@@ -0,0 +1,207 @@
+# Incremental compatibility graph for the dynamic simulator
+# Instead of rebuilding the whole graph of the pool on every batch, the simulator keeps one PoolGraph
+# alive for the entire run: the edges of every arrival come from a CompatibilityIndex of the current pool (the
+# patient classes below its donor's virtual PRA and the donors above its patient's PRA, rather than a scan of the pool)
+# and every match or expiry only touches the edges of the vertex that leaves
+# The cycles of the pool are indexed the same way, so they never have to be re-enumerated - and so are its chains if a
+# maximum chain length is given: the chains through a new pair are an indexed chain (or an altruist) leading to it,
+# followed by a path from it, and leaving vertices only drop the chains through them
+from compatibility import blood_type_code
+from compatibility_index import CompatibilityIndex
+from enumeration import find_cycles_through, find_paths
+
+# dense view of the pool handed to the solver - pairs and donors are indexed by position like in Graph
+class PoolSnapshot:
+    def __init__(self, pairs, altruistic_donors, edges, altruist_edges, cycles, chains, pair_ids, altruist_ids):
+        self.pairs = pairs
+        self.altruistic_donors = altruistic_donors
+        self.edges = edges                     # edges[i] is the set of pair indices pair i can donate to
+        self.altruist_edges = altruist_edges   # altruist_edges[d] is the sorted list of pair indices altruist d can donate to
+        self.cycles = cycles                   # cycles of the pool as lists of pair indices, smallest first
+        self.chains = chains                   # chains of the pool as (altruist index, list of pair indices), None if not indexed
+        self.pair_ids = pair_ids               # stable id of each pair
+        self.altruist_ids = altruist_ids       # stable id of each altruistic donor
+
+class PoolGraph:
+    # with a max_chain_length, every chain of at most that many pairs is indexed as well (None to leave chains out, e.g.
+    # when the solver never enumerates them)
+    def __init__(self, max_cycle_length=3, max_chain_length=None):
+        self.max_cycle_length = max_cycle_length
+        self.max_chain_length = max_chain_length
+        self.next_id = 0
+        self.vertex_ids = {}         # vertex object (Pair or altruistic Donor) -> stable id
+
+        self.pairs = {}              # stable id -> Pair, in arrival order
+        self.altruists = {}          # stable id -> altruistic Donor, in arrival order
+
+        self.out_edges = {}          # pair id -> ids of pairs whose patient can receive from its donor
+        self.in_edges = {}           # pair id -> ids of pairs whose donor can donate to its patient
+        self.altruist_edges = {}     # altruist id -> ids of pairs it can donate to
+        self.altruist_in_edges = {}  # pair id -> ids of altruists that can donate to it
+
+        self.cycles = set()          # every cycle of at most max_cycle_length pairs in the pool as a tuple of pair ids, smallest id first
+        self.vertex_cycles = {}      # pair id -> cycles going through it
+
+        self.chains = {}             # every chain of at most max_chain_length pairs as (altruist id, tuple of pair ids), in the order found
+        self.vertex_chains = {}      # pair or altruist id -> chains using it
+        self.chains_ending_at = {}   # pair id -> chains whose last pair it is
+
+        self.pair_index = CompatibilityIndex()      # patients and donors of the pairs
+        self.altruist_index = CompatibilityIndex()  # altruistic donors
+
+    def __len__(self):
+        return len(self.pairs) + len(self.altruists)
+
+    def __contains__(self, vertex):
+        return vertex in self.vertex_ids
+
+    def new_id(self, vertex):
+        vertex_id = self.next_id
+        self.next_id += 1
+        self.vertex_ids[vertex] = vertex_id
+        return vertex_id
+
+    # add a new pair to the pool, with its edges to and from the pairs and altruists already there
+    def add_pair(self, pair):
+        pair_id = self.new_id(pair)
+        donor_type, patient_type = blood_type_code(pair.donor.blood_type), blood_type_code(pair.patient.blood_type)
+
+        out_edges = set(self.pair_index.patients_compatible_with(donor_type, pair.donor.virtual_pra))
+        in_edges = set(self.pair_index.donors_compatible_with(patient_type, pair.patient.pra))
+        altruist_in_edges = set(self.altruist_index.donors_compatible_with(patient_type, pair.patient.pra))
+
+        for j in out_edges:
+            self.in_edges[j].add(pair_id)
+        for j in in_edges:
+            self.out_edges[j].add(pair_id)
+        for a in altruist_in_edges:
+            self.altruist_edges[a].add(pair_id)
+
+        self.pairs[pair_id] = pair
+        self.out_edges[pair_id] = out_edges
+        self.in_edges[pair_id] = in_edges
+        self.altruist_in_edges[pair_id] = altruist_in_edges
+        self.pair_index.add_patient(pair_id, patient_type, pair.patient.pra)
+        self.pair_index.add_donor(pair_id, donor_type, pair.donor.virtual_pra)
+
+        self.add_cycles_through(pair_id)
+        if self.max_chain_length is not None:
+            self.add_chains_through(pair_id)
+
+        return pair_id
+
+    # index the cycles going through a newly added pair - every one of them is new, so no deduplication is needed
+    def add_cycles_through(self, pair_id):
+        cycles = set()
+        for path in find_cycles_through(pair_id, self.out_edges, self.in_edges, self.max_cycle_length):
+            smallest = path.index(min(path))
+            cycles.add(tuple(path[smallest:] + path[:smallest]))
+
+        self.vertex_cycles[pair_id] = cycles
+        for c in cycles:
+            self.cycles.add(c)
+            for j in c:
+                if j != pair_id:
+                    self.vertex_cycles[j].add(c)
+
+    def add_chain(self, chain):
+        self.chains[chain] = None
+        a, c = chain
+        self.vertex_chains[a].add(chain)
+        for j in c:
+            self.vertex_chains[j].add(chain)
+        self.chains_ending_at[c[-1]].add(chain)
+
+    # index the chains going through a newly added pair - each one is a chain already indexed (or just an altruist)
+    # that can donate to the new pair, followed by a path from the new pair avoiding that prefix
+    def add_chains_through(self, pair_id):
+        self.vertex_chains[pair_id] = set()
+        self.chains_ending_at[pair_id] = set()
+
+        prefixes = [(a, ()) for a in self.altruist_in_edges[pair_id]]
+        prefixes += [chain for j in self.in_edges[pair_id] for chain in self.chains_ending_at[j] if len(chain[1]) < self.max_chain_length]
+        for a, prefix in prefixes:
+            before = set(prefix)
+            for path in find_paths(pair_id, self.max_chain_length - len(prefix), lambda path: self.out_edges[path[-1]] - before):
+                self.add_chain((a, prefix + tuple(path)))
+
+    # index the chains from a newly added altruistic donor
+    def add_chains_from(self, altruist_id):
+        self.vertex_chains[altruist_id] = set()
+        for first in self.altruist_edges[altruist_id]:
+            for path in find_paths(first, self.max_chain_length, lambda path: self.out_edges[path[-1]]):
+                self.add_chain((altruist_id, tuple(path)))
+
+    # drop the chains using a vertex that leaves the pool
+    def remove_chains_through(self, vertex_id):
+        for chain in self.vertex_chains.pop(vertex_id):
+            del self.chains[chain]
+            a, c = chain
+            for j in (a,) + c:
+                if j != vertex_id:
+                    self.vertex_chains[j].discard(chain)
+            if c[-1] != vertex_id:
+                self.chains_ending_at[c[-1]].discard(chain)
+        self.chains_ending_at.pop(vertex_id, None)
+
+    # add a new altruistic donor to the pool, with its edges to the pairs there
+    def add_altruist(self, donor):
+        altruist_id = self.new_id(donor)
+        donor_type = blood_type_code(donor.blood_type)
+
+        out_edges = set(self.pair_index.patients_compatible_with(donor_type, donor.virtual_pra))
+        for j in out_edges:
+            self.altruist_in_edges[j].add(altruist_id)
+
+        self.altruists[altruist_id] = donor
+        self.altruist_edges[altruist_id] = out_edges
+        self.altruist_index.add_donor(altruist_id, donor_type, donor.virtual_pra)
+        if self.max_chain_length is not None:
+            self.add_chains_from(altruist_id)
+
+        return altruist_id
+
+    # remove a pair or altruistic donor from the pool (once matched or expired)
+    def remove(self, vertex):
+        vertex_id = self.vertex_ids.pop(vertex)
+        if self.max_chain_length is not None:
+            self.remove_chains_through(vertex_id)
+
+        if vertex_id in self.pairs:
+            del self.pairs[vertex_id]
+            for c in self.vertex_cycles.pop(vertex_id):
+                self.cycles.discard(c)
+                for j in c:
+                    if j != vertex_id:
+                        self.vertex_cycles[j].discard(c)
+            for j in self.out_edges.pop(vertex_id):
+                self.in_edges[j].discard(vertex_id)
+            for j in self.in_edges.pop(vertex_id):
+                self.out_edges[j].discard(vertex_id)
+            for a in self.altruist_in_edges.pop(vertex_id):
+                self.altruist_edges[a].discard(vertex_id)
+            self.pair_index.remove_patient(vertex_id)
+            self.pair_index.remove_donor(vertex_id)
+        else:
+            del self.altruists[vertex_id]
+            for j in self.altruist_edges.pop(vertex_id):
+                self.altruist_in_edges[j].discard(vertex_id)
+            self.altruist_index.remove_donor(vertex_id)
+
+    # dense copy of the current pool for the solver
+    def snapshot(self):
+        pair_ids = list(self.pairs)
+        altruist_ids = list(self.altruists)
+        index = {pair_id: i for i, pair_id in enumerate(pair_ids)}
+        altruist_index = {a: d for d, a in enumerate(altruist_ids)}
+
+        edges = [{index[j] for j in self.out_edges[pair_id]} for pair_id in pair_ids]
+        altruist_edges = [sorted(index[j] for j in self.altruist_edges[a]) for a in altruist_ids]
+
+        # ids increase with arrival order, so indices keep the smallest-first rotation of each cycle
+        cycles = [[index[j] for j in c] for c in self.cycles]
+        chains = None
+        if self.max_chain_length is not None:
+            chains = [(altruist_index[a], [index[j] for j in c]) for a, c in self.chains]
+
+        return PoolSnapshot(list(self.pairs.values()), list(self.altruists.values()), edges, altruist_edges, cycles, chains, pair_ids, altruist_ids)
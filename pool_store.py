@@ -0,0 +1,246 @@
+# Compact store of every vertex seen by the dynamic simulator
+# Pairs and altruistic donors live in contiguous arrays indexed by an integer id (blood type codes, PRAs, times and
+# status), instead of one Pair object with nested Patient and Donor objects (each with its own __dict__) per vertex.
+# The views below have __slots__ and read and write the arrays, so code written against the Pair / Patient / Donor
+# API keeps working, while the solver can take whole columns at once (see compatibility.encode_patients)
+import numpy as np
+
+from patient_donor_pairs import BloodType, Patient, Donor
+
+# status of a vertex
+WAITING = 0    # still in the pool
+MATCHED = 1
+EXPIRED = 2
+RELEASED = 3   # slot of a vertex that is no longer needed, free for a new vertex
+
+class PoolStore:
+    # name and type of every column
+    columns = [
+        ('is_pair', np.bool_),          # False for altruistic donors
+        ('patient_types', np.int8),     # blood type codes as in compatibility.py (unused for altruistic donors)
+        ('pras', np.float64),           # unused for altruistic donors
+        ('donor_types', np.int8),
+        ('virtual_pras', np.float64),
+        ('arrival_times', np.float64),
+        ('departure_times', np.float64),
+        ('match_times', np.float64),
+        ('statuses', np.int8),
+    ]
+
+    def __init__(self, capacity=1024):
+        self.size = 0
+        self.free_slots = []    # ids of released vertices, reused by new ones
+        self.archived = False   # while True, matched and expired vertices are left out of pickles (saved elsewhere, see DynamicSimulator.checkpoint)
+        for name, dtype in PoolStore.columns:
+            setattr(self, name, np.zeros(capacity, dtype=dtype))
+
+    def __len__(self):
+        return self.size
+
+    # only the slots in use are pickled (checkpoints of the simulator), the spare capacity is added back when loading
+    # archived, only the vertices that have not left the pool are - the others come back with restore
+    def __getstate__(self):
+        if not self.archived:
+            return dict(self.__dict__, **{name: getattr(self, name)[:self.size] for name, _ in PoolStore.columns})
+
+        kept = np.flatnonzero((self.statuses[:self.size] != MATCHED) & (self.statuses[:self.size] != EXPIRED))
+        return dict(self.__dict__, archived=False, kept_ids=kept, **{name: getattr(self, name)[kept] for name, _ in PoolStore.columns})
+
+    def __setstate__(self, state):
+        kept = state.pop('kept_ids', None)
+        self.__dict__.update(state)
+        capacity = max(1024, 2 * self.size)
+        for name, dtype in PoolStore.columns:
+            column = getattr(self, name)
+            if kept is None:
+                setattr(self, name, np.concatenate([column, np.zeros(capacity - len(column), dtype=dtype)]))
+            else:
+                full = np.zeros(capacity, dtype=dtype)
+                full[kept] = column
+                setattr(self, name, full)
+        # archived vertices stay out of every query until they are restored
+        if kept is not None:
+            missing = np.ones(self.size, dtype=np.bool_)
+            missing[kept] = False
+            self.statuses[:self.size][missing] = RELEASED
+
+    # every column of the given vertices, as saved with an archived store
+    def rows(self, ids):
+        return {name: getattr(self, name)[ids] for name, _ in PoolStore.columns}
+
+    def restore(self, ids, rows):
+        for name, _ in PoolStore.columns:
+            getattr(self, name)[ids] = rows[name]
+
+    def grow(self):
+        for name, _ in PoolStore.columns:
+            column = getattr(self, name)
+            setattr(self, name, np.concatenate([column, np.zeros_like(column)]))
+
+    def add(self, is_pair, patient_type, pra, donor_type, virtual_pra, arrival_time, departure_time):
+        if len(self.free_slots) > 0:
+            vertex_id = self.free_slots.pop()
+        else:
+            if self.size == len(self.statuses):
+                self.grow()
+            vertex_id = self.size
+            self.size += 1
+
+        self.is_pair[vertex_id] = is_pair
+        self.patient_types[vertex_id] = patient_type
+        self.pras[vertex_id] = pra
+        self.donor_types[vertex_id] = donor_type
+        self.virtual_pras[vertex_id] = virtual_pra
+        self.arrival_times[vertex_id] = arrival_time
+        self.departure_times[vertex_id] = departure_time
+        self.match_times[vertex_id] = -1
+        self.statuses[vertex_id] = WAITING
+
+        return vertex_id
+
+    # store a generated Pair and return its view
+    def add_pair(self, pair, arrival_time, departure_time):
+        vertex_id = self.add(True, pair.patient.blood_type.value - 1, pair.patient.pra, pair.donor.blood_type.value - 1,
+                             pair.donor.virtual_pra, arrival_time, departure_time)
+        return PairView(self, vertex_id)
+
+    # store a generated altruistic Donor and return its view
+    def add_altruist(self, donor, arrival_time, departure_time):
+        vertex_id = self.add(False, 0, 0., donor.blood_type.value - 1, donor.virtual_pra, arrival_time, departure_time)
+        return DonorView(self, vertex_id)
+
+    def view(self, vertex_id):
+        return PairView(self, vertex_id) if self.is_pair[vertex_id] else DonorView(self, vertex_id)
+
+    def set_status(self, vertex_id, status, match_time=None):
+        self.statuses[vertex_id] = status
+        if match_time is not None:
+            self.match_times[vertex_id] = match_time
+
+    # free the slot of a vertex that has left the pool and will not be looked at again, so long runs only need
+    # memory for the vertices in the pool - its id (and any view of it) will be reused by a later vertex
+    def release(self, vertex_id):
+        self.statuses[vertex_id] = RELEASED
+        self.free_slots.append(vertex_id)
+
+    # ids of the pairs (or altruistic donors) in the store, only those with the given status if one is given
+    def ids(self, is_pair=True, status=None):
+        mask = self.is_pair[:self.size] == is_pair
+        if status is not None:
+            mask &= self.statuses[:self.size] == status
+        else:
+            mask &= self.statuses[:self.size] != RELEASED
+        return np.flatnonzero(mask)
+
+    def pairs(self, status=None):
+        return [PairView(self, int(i)) for i in self.ids(True, status)]
+
+    def altruists(self, status=None):
+        return [DonorView(self, int(i)) for i in self.ids(False, status)]
+
+    def count(self, is_pair=True, status=None):
+        return len(self.ids(is_pair, status))
+
+# base of the views - a vertex is identified by its store and id, so two views of the same vertex are equal
+class VertexView:
+    __slots__ = ('store', 'id')
+
+    def __init__(self, store, vertex_id):
+        self.store = store
+        self.id = vertex_id
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.store is other.store and self.id == other.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+    @property
+    def arrival_time(self):
+        return float(self.store.arrival_times[self.id])
+
+    @arrival_time.setter
+    def arrival_time(self, value):
+        self.store.arrival_times[self.id] = value
+
+    @property
+    def departure_time(self):
+        return float(self.store.departure_times[self.id])
+
+    @departure_time.setter
+    def departure_time(self, value):
+        self.store.departure_times[self.id] = value
+
+    @property
+    def match_time(self):
+        return float(self.store.match_times[self.id])
+
+    @match_time.setter
+    def match_time(self, value):
+        self.store.match_times[self.id] = value
+
+    @property
+    def was_matched(self):
+        return bool(self.store.statuses[self.id] == MATCHED)
+
+    @was_matched.setter
+    def was_matched(self, value):
+        self.store.statuses[self.id] = MATCHED if value else WAITING
+
+class PatientView(VertexView):
+    __slots__ = ()
+
+    @property
+    def blood_type(self):
+        return BloodType(int(self.store.patient_types[self.id]) + 1)
+
+    @property
+    def pra(self):
+        return float(self.store.pras[self.id])
+
+    @property
+    def potential(self):
+        return Patient.get_potential(self.blood_type)
+
+    is_compatible_with_donor = Patient.is_compatible_with_donor
+
+# the donor of a pair or an altruistic donor
+class DonorView(VertexView):
+    __slots__ = ()
+
+    @property
+    def blood_type(self):
+        return BloodType(int(self.store.donor_types[self.id]) + 1)
+
+    @property
+    def virtual_pra(self):
+        return float(self.store.virtual_pras[self.id])
+
+    @property
+    def potential(self):
+        return Donor.get_potential(self.blood_type)
+
+    is_compatible_with_patient = Donor.is_compatible_with_patient
+
+class PairView(VertexView):
+    __slots__ = ()
+
+    @property
+    def patient(self):
+        return PatientView(self.store, self.id)
+
+    @property
+    def donor(self):
+        return DonorView(self.store, self.id)
+
+# the store shared by a list of views, or None if they are not all views of one store
+def shared_store(views, view_type):
+    if len(views) == 0 or not isinstance(views[0], view_type):
+        return None
+    store = views[0].store
+    if all(isinstance(v, view_type) and v.store is store for v in views):
+        return store
+    return None
+
+def view_ids(views):
+    return np.fromiter((v.id for v in views), dtype=np.int64, count=len(views))
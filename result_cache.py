@@ -0,0 +1,59 @@
+# On-disk cache of experiment replications
+# Every finished replication is written to its own JSON file, keyed by its full configuration, time limit, seed and a
+# fingerprint of the code, so an interrupted or extended sweep only computes what is missing (or was run with other code)
+import hashlib
+import json
+import modulefinder
+import os
+
+# files whose contents decide the results of a replication - every module of the package simulator.py imports (found by
+# following its imports, so a new module is picked up without being listed) and the pool composition, but not the
+# drivers (experiments.py, benchmarks.py), so adding a configuration to a sweep keeps the cells already run
+def simulation_files(directory):
+    finder = modulefinder.ModuleFinder(path=[directory])
+    finder.run_script(os.path.join(directory, 'simulator.py'))
+    modules = sorted(os.path.relpath(module.__file__, directory) for module in finder.modules.values() if module.__file__ is not None)
+    return modules + ['distributions.txt']
+
+# hash of the simulation code and pool composition - any change to them invalidates the cached results
+def code_fingerprint(directory=os.path.dirname(os.path.abspath(__file__))):
+    digest = hashlib.sha256()
+    for name in simulation_files(directory):
+        digest.update(name.encode())
+        with open(os.path.join(directory, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+class ResultCache:
+    def __init__(self, directory, fingerprint=None):
+        self.directory = directory
+        self.fingerprint = fingerprint if fingerprint is not None else code_fingerprint()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, configuration, time_limit, seed):
+        return hashlib.sha256(repr((sorted(configuration.items()), time_limit, seed, self.fingerprint)).encode()).hexdigest()
+
+    def path(self, configuration, time_limit, seed):
+        return os.path.join(self.directory, self.key(configuration, time_limit, seed) + '.json')
+
+    # cached statistics of a replication, or None if it has not been run with this code
+    def get(self, configuration, time_limit, seed):
+        path = self.path(configuration, time_limit, seed)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)['statistics']
+
+    # store the statistics of a finished replication (written to a temporary file first so a crash never leaves half a file)
+    def put(self, configuration, time_limit, seed, statistics):
+        path = self.path(configuration, time_limit, seed)
+        record = {
+            'configuration': {key: str(value) for key, value in configuration.items()},
+            'time_limit': time_limit,
+            'seed': seed,
+            'fingerprint': self.fingerprint,
+            'statistics': statistics,
+        }
+        with open(path + '.tmp', 'w') as f:
+            json.dump(record, f)
+        os.replace(path + '.tmp', path)
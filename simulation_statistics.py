@@ -0,0 +1,177 @@
+# Streaming statistics of a simulation run
+# Every vertex is added to the collector once, when it is matched, expires or is still waiting at the end of the run,
+# so the statistics need neither a pass over every vertex ever seen nor keeping those vertices around
+import math
+
+from patient_donor_pairs import BloodType
+from pool_store import WAITING, MATCHED, EXPIRED
+
+# patients with at least this PRA are counted in "Proportion with PRA > ... Matched"
+pra_thresholds = [0.05, 0.2, 0.4, 0.6, 0.8, 0.9]
+
+# (name in the statistics, threshold) - pairs whose lifetime is at most the threshold are counted
+# the 0.25 bucket has always been computed with a 0.2 threshold, which is kept so results stay comparable
+expiration_buckets = [("0.01", 0.01), ("0.05", 0.05), ("0.1", 0.1), ("0.25", 0.2), ("0.5", 0.5)]
+
+# quantiles of the waiting times of matched pairs and altruists that can be asked for (see StatisticsCollector), e.g.
+# "Pair 90th Percentile Wait Time" - taken from histograms, so they are the upper edge of the histogram bin holding the quantile
+wait_time_quantiles = [0.5, 0.9, 0.99]
+
+# exactly rounded running sum (Shewchuk's algorithm, like math.fsum) - the result does not depend on the order
+# the values were added in, and only a handful of partial sums are kept
+class ExactSum:
+    def __init__(self):
+        self.partials = []
+
+    def add(self, x):
+        i = 0
+        for y in self.partials:
+            if abs(x) < abs(y):
+                x, y = y, x
+            high = x + y
+            low = y - (high - x)
+            if low:
+                self.partials[i] = low
+                i += 1
+            x = high
+        self.partials[i:] = [x]
+
+    def value(self):
+        return math.fsum(self.partials)
+
+# histogram of non-negative values in bins of a fixed width, for approximate quantiles
+class Histogram:
+    def __init__(self, bin_width=0.01):
+        self.bin_width = bin_width
+        self.counts = {}    # bin -> number of values in it
+        self.total = 0
+
+    def add(self, x):
+        b = int(x / self.bin_width)
+        self.counts[b] = self.counts.get(b, 0) + 1
+        self.total += 1
+
+    # upper edge of the bin holding the q-quantile (nan if empty)
+    def quantile(self, q):
+        if self.total == 0:
+            return float('nan')
+        rank = q * self.total
+        seen = 0
+        for b in sorted(self.counts):
+            seen += self.counts[b]
+            if seen >= rank:
+                return (b + 1) * self.bin_width
+        return (max(self.counts) + 1) * self.bin_width
+
+# proportion matched of a group of pairs, nan if the group is empty
+def proportion(matched, total):
+    if total == 0:
+        return float('nan')
+    return matched / total
+
+# average of an ExactSum over count values, nan if there are none
+def average(total, count):
+    if count == 0:
+        return float('nan')
+    return total.value() / count
+
+# with quantiles (e.g. wait_time_quantiles), those quantiles of the waiting times are reported as well - they are left
+# out by default so the statistics (and the experiment results and caches built on them) keep their keys
+class StatisticsCollector:
+    def __init__(self, quantiles=None):
+        self.quantiles = quantiles if quantiles is not None else []
+        self.pairs_seen = 0
+        self.altruists_seen = 0
+        self.pair_counts = {WAITING: 0, MATCHED: 0, EXPIRED: 0}
+        self.altruist_counts = {WAITING: 0, MATCHED: 0, EXPIRED: 0}
+
+        self.pair_wait_time = ExactSum()        # sum of the waiting times of matched pairs
+        self.altruist_wait_time = ExactSum()
+        self.pair_wait_times = Histogram()
+        self.altruist_wait_times = Histogram()
+
+        # [number of pairs, number matched] of every group
+        self.pra_counts = [[0, 0] for _ in pra_thresholds]
+        self.blood_type_counts = [[0, 0] for _ in BloodType]
+        self.expiration_counts = [[0, 0] for _ in expiration_buckets]
+
+    def arrived(self, is_pair):
+        if is_pair:
+            self.pairs_seen += 1
+        else:
+            self.altruists_seen += 1
+
+    # add a vertex of a PoolStore once it has left the pool (or at the end of the run if it never did)
+    def add(self, store, vertex_id):
+        status = int(store.statuses[vertex_id])
+        matched = status == MATCHED
+
+        if not store.is_pair[vertex_id]:
+            self.altruist_counts[status] += 1
+            if matched:
+                wait_time = float(store.match_times[vertex_id] - store.arrival_times[vertex_id])
+                self.altruist_wait_time.add(wait_time)
+                self.altruist_wait_times.add(wait_time)
+            return
+
+        self.pair_counts[status] += 1
+        if matched:
+            wait_time = float(store.match_times[vertex_id] - store.arrival_times[vertex_id])
+            self.pair_wait_time.add(wait_time)
+            self.pair_wait_times.add(wait_time)
+
+        pra = store.pras[vertex_id]
+        for k, threshold in enumerate(pra_thresholds):
+            if pra >= threshold:
+                self.pra_counts[k][0] += 1
+                self.pra_counts[k][1] += matched
+
+        blood_type_counts = self.blood_type_counts[int(store.patient_types[vertex_id])]
+        blood_type_counts[0] += 1
+        blood_type_counts[1] += matched
+
+        lifetime = store.departure_times[vertex_id] - store.arrival_times[vertex_id]
+        for k, (_, threshold) in enumerate(expiration_buckets):
+            if lifetime <= threshold:
+                self.expiration_counts[k][0] += 1
+                self.expiration_counts[k][1] += matched
+
+    # statistics of the run, once every vertex has been added
+    def statistics(self):
+        total_pairs = sum(self.pair_counts.values())
+        total_altruists = sum(self.altruist_counts.values())
+
+        statistics = {}
+        statistics["Number of Pairs Matched"] = self.pair_counts[MATCHED]
+        statistics["Number of Pairs Seen"] = self.pairs_seen
+        statistics["Number of Pairs Expired"] = self.pair_counts[EXPIRED]
+        statistics["Proportion of Pairs Matched"] = self.pair_counts[MATCHED] / total_pairs
+        statistics["Proportion of Pairs Expired"] = self.pair_counts[EXPIRED] / total_pairs
+        statistics["Proportion of Pairs Left At End"] = self.pair_counts[WAITING] / total_pairs
+        statistics["Pair Average Wait Time"] = average(self.pair_wait_time, self.pair_counts[MATCHED])
+        for q in self.quantiles:
+            statistics[f"Pair {round(100 * q)}th Percentile Wait Time"] = self.pair_wait_times.quantile(q)
+
+        statistics["Number of Altruists Matched"] = self.altruist_counts[MATCHED]
+        statistics["Number of Altruists Seen"] = self.altruists_seen
+        statistics["Number of Altruists Expired"] = self.altruist_counts[EXPIRED]
+
+        if total_altruists > 0:
+            statistics["Proportion of Altruists Matched"] = self.altruist_counts[MATCHED] / total_altruists
+            statistics["Proportion of Altruists Left At End"] = self.altruist_counts[WAITING] / total_altruists
+            statistics["Proportion of Altruists Expired"] = self.altruist_counts[EXPIRED] / total_altruists
+        statistics["Altruist Average Wait Time"] = average(self.altruist_wait_time, self.altruist_counts[MATCHED])
+        for q in self.quantiles:
+            statistics[f"Altruist {round(100 * q)}th Percentile Wait Time"] = self.altruist_wait_times.quantile(q)
+
+        # Calculate fairness statistics
+        for threshold, (total, matched) in zip(pra_thresholds, self.pra_counts):
+            statistics[f"Proportion with PRA > {threshold} Matched"] = proportion(matched, total)
+
+        for blood_type, (total, matched) in zip(BloodType, self.blood_type_counts):
+            statistics[f"Proportion of Type {blood_type.name} Matched"] = proportion(matched, total)
+
+        for (name, _), (total, matched) in zip(expiration_buckets, self.expiration_counts):
+            statistics[f"Proportion with expiration {name} Matched"] = proportion(matched, total)
+
+        return statistics
@@ -6,103 +6,161 @@ But it was written in Java, and it didn't account for altruistic donors.
 
 """
 
-from collections import deque # deques are always nice, hopefully will provide a slight speed up
-import heapq                  # just priority queue functionality, will allow us to order patients
+from concurrent.futures import ProcessPoolExecutor
 
 import random
 import math
-from enum import Enum
+import os
+import pickle
 import time
 
-from patient_donor_pairs import generate_patient_donor_pair, generate_altruistic_donor, Donor, Pair, BloodType
-from solver import solve_kidney_matching
+from patient_donor_pairs import generate_patient_donor_pair, generate_altruistic_donor, default_composition
+from solver import solve_kidney_matching, greedy_solve_kidney_matching, ChainFormulation, SolverBackend, MatchingMode
+from backends import SolveLimits
+from pool_graph import PoolGraph
+from matching_model import MatchingModel
+from pool_store import PoolStore, MATCHED, EXPIRED
+from simulation_statistics import StatisticsCollector
+from events import EventQueue, EventType, ArrivalProcess
+from instrumentation import BatchRecorder
+import instrumentation
 
-# Will likely want to introduce a seed at some point
+import numpy as np
+
+# wall time (seconds) between checkpoints when a checkpoint_path is given without an interval
+default_checkpoint_seconds = 60
+
+# rng is the random stream draws come from (the global random module unless the simulator is seeded)
 class ExponentialDistribution():
-    def __init__(self, rate):
+    def __init__(self, rate, rng=random):
         self.rate = rate 
+        self.rng = rng
     
     def draw(self):
-        return -(math.log(random.random()) / self.rate) # there's a name in Stat 110 for this, but you basically invert the CDF of the exponential distribution
-
-# Altruists vs Pair
-class Vertex(Enum):
-    Pair = 1
-    Altruist = 2
-
-# General functions for calculating statistics
-def calculate_average_waiting_time(vertices):       # average waiting time for people that were matched
-    if len(vertices) == 0:
-        return float('nan')
-    
-    total_wait_time = 0
-    for vertex in vertices:
-        total_wait_time += (vertex.match_time - vertex.arrival_time)
-    
-    return total_wait_time / len(vertices)
-
-def calculate_pra_prop_matched(pairs, pra):
-    num_high_pra = 0
-    num_high_pra_matched = 0
-    for pair in pairs:
-        patient = pair.patient
-        if patient.pra >= pra:
-            num_high_pra += 1
-
-            if pair.was_matched:
-                num_high_pra_matched += 1
-    if num_high_pra == 0:
-        return float('nan')
-
-    return num_high_pra_matched / num_high_pra
-
-def calculate_prop_matched_expiration(pairs, expiration_time):
-    num_high_expiration = 0
-    num_high_expiration_matched = 0
-    for pair in pairs:
-        if pair.departure_time - pair.arrival_time <= expiration_time:
-            num_high_expiration += 1
-
-            if pair.was_matched:
-                num_high_expiration_matched += 1
-    
-    if num_high_expiration == 0:
-        return float('nan')
-    
-    return num_high_expiration_matched / num_high_expiration
-
-def calculate_prop_matched_blood_type(pairs, blood_type):
-    num_blood_type = 0
-    num_blood_type_matched = 0
-    for pair in pairs:
-        patient = pair.patient
-        if patient.blood_type == blood_type:
-            num_blood_type += 1
-
-            if pair.was_matched:
-                num_blood_type_matched += 1
-
-    if num_blood_type == 0:
-        return float('nan')
-
-    return num_blood_type_matched / num_blood_type
+        return -(math.log(self.rng.random()) / self.rate) # there's a name in Stat 110 for this, but you basically invert the CDF of the exponential distribution
+
+    def __getstate__(self):
+        return dict(self.__dict__, rng=pickled_rng(self.rng))
+
+    def __setstate__(self, state):
+        self.__dict__.update(state, rng=unpickled_rng(state['rng']))
+
+# the global random module cannot be pickled, so a stream drawing from it is pickled as None (checkpoints save the state
+# of the global stream separately)
+def pickled_rng(rng):
+    return None if rng is random else rng
+
+def unpickled_rng(rng):
+    return random if rng is None else rng
+
+# Everything a run needs to carry on from where it is, besides the pool itself - kept on the simulator while it runs, so
+# a checkpoint of the simulator is a checkpoint of the run
+class SimulationState:
+    def __init__(self, time_limit, pair_arrivals, altruist_arrivals):
+        self.time_limit = time_limit
+        self.pair_arrivals = pair_arrivals          # ArrivalProcess of the pairs
+        self.altruist_arrivals = altruist_arrivals  # ArrivalProcess of the altruistic donors
+
+        # Every future event of the simulation - there is only ever one pending arrival of each kind
+        self.events = EventQueue()
+        self.departure_events = {}      # id of a vertex in the pool -> handle of its departure event
+        self.pending_arrivals = 0
+
+        self.curr_time = 0.0
+        self.curr_batch = 0             # if matching with batches, matches whenever curr_batch >= batch_size
+        self.match_pending = False      # whether a match event is in the queue
+        self.recent_arrivals = {}       # vertices that arrived since the last match and are still in the pool, in arrival order (used by greedy matching)
+        self.batches = 0                # number of matches so far
+
+        self.elapsed = 0.               # wall time (seconds) of the run up to started
+        self.started = time.time()      # wall time the run was started or resumed, or the last checkpoint written
+        self.last_checkpoint = self.started
+
+        # with the whole history kept, vertices that left the pool are appended to the history file of the checkpoint
+        # (see DynamicSimulator.checkpoint) instead of being saved again in every checkpoint
+        self.unsaved_history = []       # ids of the vertices that left the pool since the last checkpoint
+        self.history_size = 0           # bytes of the history file the last checkpoint goes with
 
 class DynamicSimulator():
     def __init__(self, pair_arrival_rate, pair_departure_rate, altruist_arrival_rate, altruist_departure_rate, 
-                    problem_type, batch_size=1):
+                    problem_type, batch_size=1, chain_formulation=ChainFormulation.ENUMERATE, max_cycle_length=3, max_chain_length=10,
+                    max_structures=None, persistent_model=False, backend=SolverBackend.PULP_CBC, matching_mode=MatchingMode.OPTIMAL,
+                    local_search_steps=0, decompose=False, workers=1, composition=None, seed=None, keep_history=True,
+                    instrumentation_path=None, trace_memory=False, solve_time_limit=None, solve_gap=None, parallel_enumeration=False,
+                    checkpoint_path=None, checkpoint_batches=None, checkpoint_seconds=None, wait_time_quantiles=None):
         self.pair_arrival_rate = pair_arrival_rate           # Poisson(arrival_rate) number of pairs arriving every time period
         self.pair_departure_rate = pair_departure_rate         # Exp(survival_rate) - lifespan of a pair in the donor pool
         self.altruist_arrival_rate = altruist_arrival_rate
         self.altruist_departure_rate = altruist_departure_rate
 
+        self.composition = composition if composition is not None else default_composition   # distribution of arriving pairs (a PoolComposition)
         self.problem_type = problem_type                # solver problem type
         self.batch_size = batch_size                    # If Batch frequency, use batch_size
-
-
-        self.pair_arrival_generator = ExponentialDistribution(self.pair_arrival_rate)
-        self.pair_survival_generator = ExponentialDistribution(self.pair_departure_rate)
-        self.altruist_arrival_generator = ExponentialDistribution(self.altruist_arrival_rate)
-        self.altruist_departure_generator = ExponentialDistribution(self.altruist_departure_rate)
+        self.chain_formulation = chain_formulation      # how the solver models altruist chains
+        self.max_cycle_length = max_cycle_length        # maximum number of pairs in a cycle
+        self.max_chain_length = max_chain_length        # maximum number of pairs in a chain
+        self.max_structures = max_structures            # cap on the number of cycles and chains given to the solver (None for no cap)
+
+
+        # With a seed, the arrival times, departure times and attributes of pairs and of altruists each come from their
+        # own stream, so two simulators with the same seed see exactly the same patients whatever their policy (common
+        # random numbers), and arrivals can be drawn lazily in any order - without one, everything is drawn from the
+        # global random module
+        self.seed = seed
+        self.rngs = {name: random.Random(f"{seed}:{name}") if seed is not None else random
+                     for name in ["pair_arrivals", "pair_departures", "pairs", "altruist_arrivals", "altruist_departures", "altruists"]}
+        self.pair_rng = self.rngs["pairs"]
+        self.altruist_rng = self.rngs["altruists"]
+
+        self.pair_arrival_generator = ExponentialDistribution(self.pair_arrival_rate, self.rngs["pair_arrivals"])
+        self.pair_survival_generator = ExponentialDistribution(self.pair_departure_rate, self.rngs["pair_departures"])
+        self.altruist_arrival_generator = ExponentialDistribution(self.altruist_arrival_rate, self.rngs["altruist_arrivals"])
+        self.altruist_departure_generator = ExponentialDistribution(self.altruist_departure_rate, self.rngs["altruist_departures"])
+
+        self.persistent_model = persistent_model        # if True, keep one in-process matching model across batches instead of rebuilding it
+        self.backend = backend                          # solver backend used when the model is rebuilt every batch
+        self.matching_mode = matching_mode              # optimal matching over the pool (enumerated or column generation) or greedy matching around new arrivals
+        self.local_search_steps = local_search_steps    # rounds of local search after a greedy match
+        self.decompose = decompose                      # solve each independent component of the pool separately
+        self.workers = workers                          # number of processes solving components concurrently (if decompose) or enumerating (if parallel_enumeration)
+        self.parallel_enumeration = parallel_enumeration  # enumerate the chains (and cycles not already known) of each batch on the worker processes
+
+        # latency budget (seconds) and relative gap tolerance of every solve - a solve that reaches either returns the best
+        # packing found so far (never worse than a greedy packing), and how good it was is kept in solve_reports
+        self.solve_limits = SolveLimits(solve_time_limit, solve_gap) if solve_time_limit is not None or solve_gap is not None else None
+        self.solve_reports = []                         # SolveReport of every limited solve of the last run
+
+        self.keep_history = keep_history                # keep every vertex of the run in the store, or only those in the pool (for very long runs)
+        self.store = None                               # pairs and altruistic donors of the run (see PoolStore)
+        self.statistics_collector = None                # statistics of the vertices that have left the pool (see StatisticsCollector)
+        self.wait_time_quantiles = wait_time_quantiles  # quantiles of the waiting times also reported in the statistics (e.g. simulation_statistics.wait_time_quantiles)
+        self.instrumentation_path = instrumentation_path  # if given, one record per batch is written there (.csv for CSV, otherwise JSON lines)
+        self.trace_memory = trace_memory                # also record the peak Python memory of each batch with tracemalloc (slow)
+        self.pool_graph = None                          # compatibility graph of the current pool, kept up to date across batches
+        self.matching_model = None                      # persistent matching model (only if persistent_model)
+
+        # with a checkpoint_path, the state of the run is saved there every checkpoint_batches matches and/or every
+        # checkpoint_seconds of wall time (every default_checkpoint_seconds if neither is given) - see checkpoint, load and resume
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_batches = checkpoint_batches
+        self.checkpoint_seconds = checkpoint_seconds
+        self.state = None                               # state of the current run (see SimulationState)
+
+    def __getstate__(self):
+        return dict(self.__dict__, rngs={name: pickled_rng(rng) for name, rng in self.rngs.items()},
+                    pair_rng=pickled_rng(self.pair_rng), altruist_rng=pickled_rng(self.altruist_rng))
+
+    def __setstate__(self, state):
+        self.__dict__.update(state, rngs={name: unpickled_rng(rng) for name, rng in state['rngs'].items()},
+                             pair_rng=unpickled_rng(state['pair_rng']), altruist_rng=unpickled_rng(state['altruist_rng']))
+
+    # record the size of the pool about to be matched in the current batch
+    def record_pool(self):
+        instrumentation.count('pool_pairs', len(self.pool_graph.pairs))
+        instrumentation.count('pool_altruists', len(self.pool_graph.altruists))
+        instrumentation.count('edges', sum(len(e) for e in self.pool_graph.out_edges.values()))
+        instrumentation.count('altruist_edges', sum(len(e) for e in self.pool_graph.altruist_edges.values()))
+        instrumentation.count('cycles', len(self.pool_graph.cycles))
 
     def run(self, time_limit):
         """
@@ -110,265 +168,255 @@ class DynamicSimulator():
 
             time_limit: how long to run the simulation for (this many time periods)
         """
-        start_time = time.time()
-
-        entry_count = 0               # heapq breaks without the entry_count for ties
         print()
         print()
         print("Simulator Starting")
 
-        # Preload the pair arrival times, departure times
-        pair_arrival_times = deque()
-        pair_departure_times = deque()
-
-        curr_time = 0.0
-        while True:
-            # Get the arrival and departure time from exponential distributions
-            entry_time = curr_time + self.pair_arrival_generator.draw()
-            if self.pair_departure_rate > 0:
-                exit_time = entry_time + self.pair_survival_generator.draw()
-            else:
-                exit_time = float('inf')
-
-            curr_time = entry_time
-            
-            if curr_time > time_limit:  # we have reached the limit of our time
-                break 
-
-            pair_arrival_times.append(entry_time)
-            pair_departure_times.append(exit_time)
-
-        # Preload the altruistic donor arrival times, departure times (if necessary)
-        altruist_arrival_times = deque()
-        altruist_departure_times = deque()
-
-        if self.altruist_arrival_rate > 0:
-            curr_time = 0.0
-            while True:
-                # Get the arrival and departure time of altruist from exponential distribution
-                entry_time = curr_time + self.altruist_arrival_generator.draw()
-                if self.altruist_departure_rate > 0:
-                    exit_time = entry_time + self.altruist_departure_generator.draw()
-                else:
-                    exit_time = float('inf')
-                curr_time = entry_time
-                
-                if curr_time > time_limit:  # reach limit of time
-                    break
-
-                altruist_arrival_times.append(entry_time)
-                altruist_departure_times.append(exit_time)
-
-        print(f"This simulator will involve {len(pair_arrival_times)} pairs")
-        print(f"This simulator will involve {len(altruist_departure_times)} altruistic donors")
-        
-        # Combine the arrival times together
-        arrival_times = deque()
-        departure_times = deque()
-        while len(pair_arrival_times) > 0 and len(altruist_arrival_times) > 0:
-            if pair_arrival_times[0] <= altruist_arrival_times[0]:
-                arrival_times.append((Vertex.Pair, pair_arrival_times[0]))
-                departure_times.append((Vertex.Pair, pair_departure_times[0]))      # not that in case tie with altruist, departure times of pairs come first
-                pair_arrival_times.popleft()
-                pair_departure_times.popleft()
-            else:
-                arrival_times.append((Vertex.Altruist, altruist_arrival_times[0]))
-                departure_times.append((Vertex.Altruist, altruist_departure_times[0]))
-                altruist_arrival_times.popleft()
-                altruist_departure_times.popleft()
-        while len(pair_arrival_times) > 0:
-            arrival_times.append((Vertex.Pair, pair_arrival_times[0]))
-            departure_times.append((Vertex.Pair, pair_departure_times[0]))      # not that in case tie with altruist, departure times of pairs come first
-            pair_arrival_times.popleft()
-            pair_departure_times.popleft()
-        while len(altruist_arrival_times) > 0:
-            arrival_times.append((Vertex.Altruist, altruist_arrival_times[0]))
-            departure_times.append((Vertex.Altruist, altruist_departure_times[0]))
-            altruist_arrival_times.popleft()
-            altruist_departure_times.popleft()
-
-        # Track the current state of the pool
-        pair_pool = set()
-        altruist_pool = set()
-
-        vertices_by_exit_time = []  # this will be a priority queue of tuples (exit_time, entry_count, (Patient, Donor) pair or altruistic donor)
-        all_matched_pairs = set()
-        all_matched_altruists = set()
-        
-        # For stats purposes
-        all_expired_pairs = set()
-        all_expired_altruists = set()
-
-        # General statistics about the process
-        total_pairs_matched = 0
-        total_altruists_matched = 0
-        total_pairs_expired = 0
-        total_altruists_expired = 0
-        total_pairs_seen = 0                          # total number of pairs that arrive to the exchange
-        total_altruists_seen = 0
+        # Arrivals of pairs and altruistic donors, drawn one at a time as the simulation reaches them
+        pair_arrivals = ArrivalProcess(self.pair_arrival_generator, self.pair_survival_generator,
+                                       self.pair_arrival_rate, self.pair_departure_rate, time_limit)
+        altruist_arrivals = ArrivalProcess(self.altruist_arrival_generator, self.altruist_departure_generator,
+                                           self.altruist_arrival_rate, self.altruist_departure_rate, time_limit)
+
+        # Unseeded runs draw everything from the global random stream, so their arrival times are drawn up front in
+        # the order they always have been (all pairs, then all altruists) to keep results reproducible
+        if self.seed is None:
+            pair_arrivals.preload()
+            altruist_arrivals.preload()
+
+        self.state = SimulationState(time_limit, pair_arrivals, altruist_arrivals)
+        for arrival_type, arrivals in [(EventType.PAIR_ARRIVAL, pair_arrivals), (EventType.ALTRUIST_ARRIVAL, altruist_arrivals)]:
+            next_arrival = arrivals.next()
+            if next_arrival is not None:
+                self.state.events.push(next_arrival[0], arrival_type, next_arrival[1])
+                self.state.pending_arrivals += 1
+
+        # Track the current state of the pool - the status of every vertex is kept in the store
+        self.store = PoolStore()
+        # chains are indexed along with the cycles whenever every batch would enumerate them all - unless they are enumerated on the workers
+        enumerated_chains = self.persistent_model or (self.matching_mode == MatchingMode.OPTIMAL and self.chain_formulation == ChainFormulation.ENUMERATE)
+        self.pool_graph = PoolGraph(self.max_cycle_length, self.max_chain_length if enumerated_chains and not self.parallel_enumeration else None)
+        if self.persistent_model:
+            self.matching_model = MatchingModel(self.problem_type, max_cycle_length=self.max_cycle_length,
+                                                max_chain_length=self.max_chain_length, max_structures=self.max_structures,
+                                                limits=self.solve_limits)
+        self.solve_reports = []
+
+        # General statistics about the process, updated as vertices arrive and leave
+        self.statistics_collector = StatisticsCollector(self.wait_time_quantiles)
+
+        return self.simulate()
+
+    # carry on with a run loaded from a checkpoint (see load), up to the time limit it was started with - the results
+    # are exactly those the run would have had without the interruption
+    def resume(self):
+        print()
+        print()
+        print(f"Simulator Resuming at time {round(self.state.curr_time, 3)} (batch {self.state.batches})")
+        return self.simulate(resuming=True)
+
+    # save everything the run needs to carry on to checkpoint_path - pickled to a temporary file first and then renamed
+    # over the previous checkpoint, so a crash while writing leaves the previous checkpoint intact
+    # with the whole history kept, the vertices that left the pool since the last checkpoint are appended to
+    # checkpoint_path + '.history' first and left out of the checkpoint itself, so each checkpoint only costs as much as
+    # the pool and what changed - the checkpoint records how much of the history file belongs to it, anything after
+    # that (from a checkpoint that was never completed) is overwritten
+    # the global random stream is not part of the simulator, so its state is saved with it for unseeded runs
+    def checkpoint(self):
+        state = self.state
+        state.elapsed += time.time() - state.started
+        state.started = time.time()
+
+        if self.keep_history:
+            with open(self.checkpoint_path + '.history', 'r+b' if state.history_size > 0 else 'wb') as f:
+                f.seek(state.history_size)
+                f.truncate()
+                ids = np.array(state.unsaved_history, dtype=np.int64)
+                pickle.dump((ids, self.store.rows(ids)), f, protocol=pickle.HIGHEST_PROTOCOL)
+                state.history_size = f.tell()
+            state.unsaved_history = []
+
+        temporary_path = self.checkpoint_path + '.tmp'
+        self.store.archived = self.keep_history
+        try:
+            with open(temporary_path, 'wb') as f:
+                pickle.dump((self, random.getstate() if self.seed is None else None), f, protocol=pickle.HIGHEST_PROTOCOL)
+        finally:
+            self.store.archived = False
+        os.replace(temporary_path, self.checkpoint_path)
+        state.last_checkpoint = time.time()
+
+    # the simulator saved in a checkpoint, ready to resume() - restores the vertices saved in the history file and the
+    # global random stream for unseeded runs
+    def load(checkpoint_path):
+        with open(checkpoint_path, 'rb') as f:
+            simulator, random_state = pickle.load(f)
+        if simulator.keep_history:
+            with open(checkpoint_path + '.history', 'rb') as f:
+                while f.tell() < simulator.state.history_size:
+                    ids, rows = pickle.load(f)
+                    simulator.store.restore(ids, rows)
+        if random_state is not None:
+            random.setstate(random_state)
+        return simulator
+
+    # whether a checkpoint is due after the batch that just ended
+    def checkpoint_due(self):
+        if self.checkpoint_path is None:
+            return False
+        checkpoint_seconds = self.checkpoint_seconds
+        if self.checkpoint_batches is None and checkpoint_seconds is None:
+            checkpoint_seconds = default_checkpoint_seconds
+        return ((self.checkpoint_batches is not None and self.state.batches % self.checkpoint_batches == 0) or
+                (checkpoint_seconds is not None and time.time() - self.state.last_checkpoint >= checkpoint_seconds))
+
+    # a vertex that left the pool is added to the statistics, then forgotten unless the whole history is kept
+    def finish(self, vertex_id):
+        self.statistics_collector.add(self.store, vertex_id)
+        if not self.keep_history:
+            self.store.release(vertex_id)
+        elif self.checkpoint_path is not None:
+            self.state.unsaved_history.append(vertex_id)
+
+    # run the events of self.state until the end of the simulation
+    def simulate(self, resuming=False):
+        state = self.state
+        state.started = time.time()
+        state.last_checkpoint = state.started
+
+        # Per-batch instrumentation (see instrumentation.py) - off unless a path is given
+        # a resumed run appends to the records (batches after the checkpoint that were already written are written again)
+        recorder = None
+        if self.instrumentation_path is not None:
+            recorder = BatchRecorder(self.instrumentation_path, self.trace_memory).open(append=resuming)
+            recorder.batch = state.batches
+        instrumentation.activate(recorder)
+
+        # Processes for solving independent components concurrently, and for enumerating cycles and chains in parallel
+        executor = ProcessPoolExecutor(self.workers) if (self.decompose or self.parallel_enumeration) and self.workers > 1 else None
 
         # Simulate everything!
-        curr_time = 0.0 
-        curr_batch = 0              # if matching with batches, matches whenever curr_batch >= self.batch_size
-        while True:
-            # Remove vertices between the current time and the next entry time - these go unmatched for now, we can change this...
-            if len(arrival_times) > 0 :
-                next_entry_time = arrival_times[0][1]
-                while len(vertices_by_exit_time) != 0 and min(vertices_by_exit_time)[0] <= next_entry_time:  # a vertex expires before next vertex arrives
-                    # Get the vertex that is leaving and make sure it hasn't been matched already
-                    critical_vertex = heapq.heappop(vertices_by_exit_time)[2]
-                    
-                    if type(critical_vertex) == Pair:
-                        if critical_vertex not in pair_pool:
-                            continue
-                        else:
-                            pair_pool.remove(critical_vertex)   # for now, just remove from pool, we will want to probably match these though (can discuss this)
-                            all_expired_pairs.add(critical_vertex)
-                            total_pairs_expired += 1
-                    elif type(critical_vertex) == Donor:
-                        if critical_vertex not in altruist_pool:
-                            continue
-                        else:
-                            altruist_pool.remove(critical_vertex)
-                            all_expired_altruists.add(critical_vertex)
-                            total_altruists_expired += 1
-
-            
-            # If no new vertices to enter, we are finished!
-            if len(arrival_times) == 0:
-                break
-
-            # Otherwise, simulate arrivals
-            curr_time = next_entry_time
-
-            # Determine number of arrivals at this time (may be more than 1)
-            new_pair_arrivals = 0
-            new_altruist_arrivals = 0
-            while len(arrival_times) != 0 and arrival_times[0][1] == curr_time:
-                curr_arrival_type = arrival_times.popleft()[0]
-                if curr_arrival_type == Vertex.Pair:
-                    new_pair_arrivals += 1
-                elif curr_arrival_type == Vertex.Altruist:
-                    new_altruist_arrivals += 1
-
-            # Update the number of pairs that have arrived
-            total_pairs_seen += new_pair_arrivals
-            total_altruists_seen += new_altruist_arrivals
-            curr_batch += (new_pair_arrivals + new_altruist_arrivals)
-
-            # Generate the new pairs
-            new_pairs = set()
-            for _ in range(new_pair_arrivals):
-                curr_pair = generate_patient_donor_pair()
-                curr_pair.arrival_time = curr_time 
-
-                # Obtain departure time for pair
-                departure_entry = departure_times.popleft()
-                assert(departure_entry[0] == Vertex.Pair)       # quick sanity check
-                departure_time = departure_entry[1]
-                curr_pair.departure_time = departure_time
+        # The simulation ends with the last arrival (and the match it may trigger), vertices still waiting then are left at the end
+        events = state.events
+        while state.pending_arrivals > 0 or state.match_pending:
+            state.curr_time, event_type, payload = events.pop()
+            curr_time = state.curr_time
+
+            if event_type == EventType.DEPARTURE:
+                # Matched vertices have their departure cancelled, so the vertex is still waiting
+                # for now, just remove from pool, we will want to probably match these though (can discuss this)
+                del state.departure_events[payload]
+                vertex = self.store.view(payload)
+                self.store.set_status(payload, EXPIRED)
+                with instrumentation.stage('update_pool_graph'):
+                    self.pool_graph.remove(vertex)
+                state.recent_arrivals.pop(vertex, None)
+                self.finish(payload)
+
+            elif event_type == EventType.PAIR_ARRIVAL or event_type == EventType.ALTRUIST_ARRIVAL:
+                departure_time = payload
+                if event_type == EventType.PAIR_ARRIVAL:
+                    vertex = self.store.add_pair(generate_patient_donor_pair(self.composition, self.pair_rng), curr_time, departure_time)
+                    with instrumentation.stage('update_pool_graph'):
+                        self.pool_graph.add_pair(vertex)
+                    arrivals = state.pair_arrivals
+                else:
+                    vertex = self.store.add_altruist(generate_altruistic_donor(self.altruist_rng), curr_time, departure_time)
+                    with instrumentation.stage('update_pool_graph'):
+                        self.pool_graph.add_altruist(vertex)
+                    arrivals = state.altruist_arrivals
+                self.statistics_collector.arrived(event_type == EventType.PAIR_ARRIVAL)
+                state.recent_arrivals[vertex] = None
 
                 # track when it will be leaving the simulation
-                heapq.heappush(vertices_by_exit_time, (departure_time, entry_count, curr_pair))
-                entry_count += 1
+                state.departure_events[vertex.id] = events.push(departure_time, EventType.DEPARTURE, vertex.id)
 
-                new_pairs.add(curr_pair)
+                # the next vertex of the same kind
+                state.pending_arrivals -= 1
+                next_arrival = arrivals.next()
+                if next_arrival is not None:
+                    events.push(next_arrival[0], event_type, next_arrival[1])
+                    state.pending_arrivals += 1
 
-            # Generate the new altruistic donors
-            new_altruists = set()
-            for _ in range(new_altruist_arrivals):
-                curr_donor = generate_altruistic_donor()
-                curr_donor.arrival_time = curr_time
+                # match once every vertex arriving at this time is in the pool
+                state.curr_batch += 1
+                if state.curr_batch >= self.batch_size and not state.match_pending:
+                    events.push(curr_time, EventType.MATCH)
+                    state.match_pending = True
 
-                # Obtain departure time
-                departure_entry = departure_times.popleft()  # in case of tie between pair and donor, departure_time of donor is after pair...
-                assert(departure_entry[0] == Vertex.Altruist)       # quick sanity check
-                departure_time = departure_entry[1]
-                curr_donor.departure_time = departure_time
+            else:
+                # Undergo matching algorithm
+                state.match_pending = False
+                if instrumentation.recorder is not None:
+                    self.record_pool()
+
+                if self.matching_mode == MatchingMode.GREEDY:
+                    with instrumentation.stage('solve'):
+                        matched_pairs, matched_donors = greedy_solve_kidney_matching(list(state.recent_arrivals), self.pool_graph, self.problem_type, curr_time,
+                                                                                     max_chain_length=self.max_chain_length,
+                                                                                     local_search_steps=self.local_search_steps)
+                elif self.matching_model is not None:
+                    with instrumentation.stage('snapshot'):
+                        snapshot = self.pool_graph.snapshot()
+                    matched_pairs, matched_donors = self.matching_model.solve(snapshot, curr_time, self.solve_reports,
+                                                                              executor if self.parallel_enumeration else None)
+                else:
+                    with instrumentation.stage('snapshot'):
+                        snapshot = self.pool_graph.snapshot()
+                    matched_pairs, matched_donors = solve_kidney_matching(snapshot.pairs, snapshot.altruistic_donors, self.problem_type, curr_time,
+                                                                          edges=snapshot.edges, altruist_edges=snapshot.altruist_edges, cycles=snapshot.cycles,
+                                                                          chains=snapshot.chains, chain_formulation=self.chain_formulation, max_cycle_length=self.max_cycle_length,
+                                                                          max_chain_length=self.max_chain_length, max_structures=self.max_structures,
+                                                                          backend=self.backend, decompose=self.decompose,
+                                                                          executor=executor if self.decompose else None,
+                                                                          column_generation=self.matching_mode == MatchingMode.COLUMN_GENERATION,
+                                                                          limits=self.solve_limits, reports=self.solve_reports,
+                                                                          enumeration_executor=executor if self.parallel_enumeration else None)
+                state.curr_batch = 0
+                state.recent_arrivals = {}
+
+                # Remove the matched vertices, their departures will not happen
+                for vertex in matched_pairs + matched_donors:
+                    self.store.set_status(vertex.id, MATCHED, curr_time)
+                    self.pool_graph.remove(vertex)
+                    events.cancel(state.departure_events.pop(vertex.id))
+                    self.finish(vertex.id)
+
+                if recorder is not None:
+                    recorder.end_batch(time=curr_time, matched_pairs=len(matched_pairs), matched_altruists=len(matched_donors))
+
+                state.batches += 1
+                if self.checkpoint_due():
+                    self.checkpoint()
+
+        # the vertices still waiting are left at the end
+        for vertex in self.pool_graph.vertex_ids:
+            self.statistics_collector.add(self.store, vertex.id)
+
+        print(f"This simulator involved {self.statistics_collector.pairs_seen} pairs")
+        print(f"This simulator involved {self.statistics_collector.altruists_seen} altruistic donors")
+        if len(self.solve_reports) > 0:
+            print(f"{sum(r.time_limit_hit for r in self.solve_reports)} of {len(self.solve_reports)} solves hit the time limit, "
+                  f"largest gap {round(max(r.gap for r in self.solve_reports), 4)}")
+
+        if executor is not None:
+            executor.shutdown()
+        if recorder is not None:
+            recorder.close()
+            instrumentation.activate(None)
 
-                # track when it will be leaving the simulation
-                heapq.heappush(vertices_by_exit_time, (departure_time, entry_count, curr_donor))
-                entry_count += 1
-
-                new_altruists.add(curr_donor)
-
-            # Add the new vertices to the pools
-            pair_pool |= new_pairs
-            altruist_pool |= new_altruists
-
-            # Undergo matching algorithm if necessary
-            matched_pairs = None
-            matched_donors = None
-            if curr_batch >= self.batch_size:
-                matched_pairs, matched_donors = solve_kidney_matching(list(pair_pool), list(altruist_pool), self.problem_type, curr_time)
-                curr_batch = 0
-
-
-            # Remove any matched pairs
-            if matched_pairs is not None:
-                for pair in matched_pairs:
-                    pair.was_matched = True
-                    pair.match_time = curr_time
-                    pair_pool.remove(pair)
-                    all_matched_pairs.add(pair)
-                total_pairs_matched += len(matched_pairs)
-                
-            
-            # Remove any matched donors
-            if matched_donors is not None:
-                for donor in matched_donors:
-                    donor.was_matched = True
-                    donor.match_time = curr_time
-                    altruist_pool.remove(donor)
-                    all_matched_altruists.add(donor)
-                total_altruists_matched += len(matched_donors)
-
-        end_time = time.time()
         print()
-        print(f"Total time of simulation: {round((end_time - start_time) / 60, 3)} minutes")
+        print(f"Total time of simulation: {round((state.elapsed + time.time() - state.started) / 60, 3)} minutes")
         print()
 
         # Collect helpful statistics in dictionary
-        original_pair_pool = pair_pool | all_expired_pairs | all_matched_pairs
-        original_altruist_pool = altruist_pool | all_expired_altruists | all_matched_altruists
-
-        statistics = {}
-        statistics["Number of Pairs Matched"] = total_pairs_matched
-        statistics["Number of Pairs Seen"] = total_pairs_seen
-        statistics["Number of Pairs Expired"] = total_pairs_expired
-        statistics["Proportion of Pairs Matched"] = total_pairs_matched / len(original_pair_pool)
-        statistics["Proportion of Pairs Expired"] = total_pairs_expired / len(original_pair_pool)
-        statistics["Proportion of Pairs Left At End"] = len(pair_pool) / len(original_pair_pool)
-        statistics["Pair Average Wait Time"] = calculate_average_waiting_time(all_matched_pairs)
-
-        statistics["Number of Altruists Matched"] = total_altruists_matched
-        statistics["Number of Altruists Seen"] = total_altruists_seen
-        statistics["Number of Altruists Expired"] = total_altruists_expired
-
-        if len(original_altruist_pool) > 0:
-            statistics["Proportion of Altruists Matched"] = total_altruists_matched / len(original_altruist_pool)
-            statistics["Proportion of Altruists Left At End"] = len(altruist_pool) / len(original_altruist_pool)
-            statistics["Proportion of Altruists Expired"] = total_altruists_expired / len(original_altruist_pool)
-        statistics["Altruist Average Wait Time"] = calculate_average_waiting_time(all_matched_altruists)
-
-        # Calculate fairness statistics
-        statistics["Proportion with PRA > 0.05 Matched"] = calculate_pra_prop_matched(original_pair_pool, 0.05)
-        statistics["Proportion with PRA > 0.2 Matched"] = calculate_pra_prop_matched(original_pair_pool, 0.2)
-        statistics["Proportion with PRA > 0.4 Matched"] = calculate_pra_prop_matched(original_pair_pool, 0.4)
-        statistics["Proportion with PRA > 0.6 Matched"] = calculate_pra_prop_matched(original_pair_pool, 0.6)
-        statistics["Proportion with PRA > 0.8 Matched"] = calculate_pra_prop_matched(original_pair_pool, 0.8)
-        statistics["Proportion with PRA > 0.9 Matched"] = calculate_pra_prop_matched(original_pair_pool, 0.9)
-
-        statistics["Proportion of Type O Matched"] = calculate_prop_matched_blood_type(original_pair_pool, BloodType.O)
-        statistics["Proportion of Type A Matched"] = calculate_prop_matched_blood_type(original_pair_pool, BloodType.A)
-        statistics["Proportion of Type B Matched"] = calculate_prop_matched_blood_type(original_pair_pool, BloodType.B)
-        statistics["Proportion of Type AB Matched"] = calculate_prop_matched_blood_type(original_pair_pool, BloodType.AB)
-
-        statistics["Proportion with expiration 0.01 Matched"] = calculate_prop_matched_expiration(original_pair_pool, 0.01)
-        statistics["Proportion with expiration 0.05 Matched"] = calculate_prop_matched_expiration(original_pair_pool, 0.05)
-        statistics["Proportion with expiration 0.1 Matched"] = calculate_prop_matched_expiration(original_pair_pool, 0.1)
-        statistics["Proportion with expiration 0.25 Matched"] = calculate_prop_matched_expiration(original_pair_pool, 0.2)
-        statistics["Proportion with expiration 0.5 Matched"] = calculate_prop_matched_expiration(original_pair_pool, 0.5)
+        statistics = self.statistics_collector.statistics()
+
+        # the vertices that left the pool are only still there if the whole history was kept
+        all_matched_pairs = set(self.store.pairs(MATCHED))
+        all_expired_pairs = set(self.store.pairs(EXPIRED))
+        all_matched_altruists = set(self.store.altruists(MATCHED))
+        all_expired_altruists = set(self.store.altruists(EXPIRED))
         
         print()
         print("RESULTS")
@@ -378,3 +426,7 @@ class DynamicSimulator():
         
         return all_matched_pairs, all_expired_pairs, all_matched_altruists, all_expired_altruists, statistics
 
+# continue the run saved in a checkpoint - returns what DynamicSimulator.run would have, with the same results as if the
+# run had never been interrupted
+def resume(checkpoint_path):
+    return DynamicSimulator.load(checkpoint_path).resume()
@@ -1,21 +1,33 @@
-from pulp import LpProblem, LpVariable, LpMaximize, value, lpSum, lpDot, PULP_CBC_CMD
 from enum import Enum
-from math import sqrt
+import heapq
+import warnings
 
 from patient_donor_pairs import generate_patient_donor_pair
-
-# generate patient-donor pairs
-number_of_pairs = 500
-all_pairs = []
-for i in range(number_of_pairs):
-    all_pairs.append(generate_patient_donor_pair())
-
-# problem type enum
+import compatibility
+import enumeration
+import objectives
+import parallel_enumeration
+import instrumentation
+from backends import PackingProblem, SolverBackend, solve_packing_problem, solve_packing_problem_by_component, solve_lp_relaxation, solve_packing_problem_with_limits
+
+# problem type enum - each is an objective registered under its name in objectives.py, and any other registered
+# objective (or objective function) can be used as a problem type too
 class ProblemType(Enum):
     SIMPLE = 1
     POTENTIALS = 2
     FAIRNESS = 3
 
+# how chains are modelled in the matching problem
+class ChainFormulation(Enum):
+    ENUMERATE = 1           # one variable per chain, every chain is enumerated up front
+    POSITION_INDEXED = 2    # one variable per (arc, position in chain), chains are never enumerated (PICEF-style)
+
+# how matches are chosen when the simulator triggers a match
+class MatchingMode(Enum):
+    OPTIMAL = 1     # solve the packing problem over the whole pool
+    GREEDY = 2      # only look at cycles and chains through the vertices that arrived since the last match
+    COLUMN_GENERATION = 3   # solve the packing problem over the whole pool, generating cycles and chains as needed
+
 # cycle data structure
 class Cycle:
     def __init__(self, pairs):
@@ -31,19 +43,72 @@ class Chain:
 
 # graph data structure
 class Graph:
-    def __init__(self, pairs, altruistic_donors, problem_type, curr_time):
+    # edges, altruist_edges, cycles and chains (as (altruistic donor, pairs)) can be passed in when they are already known (e.g. from a PoolGraph snapshot)
+    # max_structures caps the total number of cycles and chains enumerated - self.truncated records whether it was hit
+    # with an enumeration_executor (e.g. a ProcessPoolExecutor), cycles and chains are enumerated in parallel on it
+    def __init__(self, pairs, altruistic_donors, problem_type, curr_time, edges=None, altruist_edges=None, cycles=None, chains=None,
+                 chain_formulation=ChainFormulation.ENUMERATE, max_cycle_length=3, max_chain_length=10, max_structures=None,
+                 enumeration_executor=None):
         self.pairs = pairs
-        self.edges = Graph.find_edges(self.pairs)
-        self.cycles = Graph.find_cycles(self.pairs, self.edges)
+        with instrumentation.stage('find_edges'):
+            self.edges = edges if edges is not None else Graph.find_edges(self.pairs)
+        self.max_cycle_length = max_cycle_length
+        self.max_structures = max_structures
+        with instrumentation.stage('find_cycles'):
+            if cycles is not None:
+                self.cycles = [Cycle(c) for c in cycles[:max_structures]]
+                self.truncated = max_structures is not None and len(cycles) > max_structures
+            else:
+                self.cycles, self.truncated = Graph.find_cycles(self.pairs, self.edges, self.max_cycle_length, self.max_structures, enumeration_executor)
         self.problem_type = problem_type
         self.curr_time = curr_time
-        self.cycle_weights = Graph.find_cycle_weights(self.problem_type, self.pairs, self.cycles, self.curr_time)
+        # per-vertex scores of the objective, computed once and summed over every cycle and chain (see objectives.py)
+        with instrumentation.stage('weights'):
+            self.scores = objectives.vertex_scores(self.problem_type, self.pairs, altruistic_donors, self.curr_time)
+            self.cycle_weights = Graph.find_cycle_weights(self.problem_type, self.pairs, self.cycles, self.curr_time, self.scores)
         self.altruistic_donors = altruistic_donors
-        self.chains = Graph.find_chains(self.altruistic_donors, self.pairs, self.edges)
-        self.chain_weights = Graph.find_chain_weights(self.problem_type, self.pairs, self.altruistic_donors, self.chains, self.curr_time)
-
-    # create adjacency list representation of graph of pairs
+        with instrumentation.stage('find_edges'):
+            self.altruist_edges = altruist_edges if altruist_edges is not None else compatibility.find_altruist_edges(self.altruistic_donors, self.pairs)
+        self.chain_formulation = chain_formulation
+        self.max_chain_length = max_chain_length
+
+        # either enumerate every chain, or only the position-indexed arcs chains can be built from
+        self.chains = []
+        self.chain_weights = []
+        self.chain_arcs = []
+        self.chain_arc_weights = []
+        if self.chain_formulation == ChainFormulation.ENUMERATE:
+            chain_limit = None if self.max_structures is None else self.max_structures - len(self.cycles)
+            with instrumentation.stage('find_chains'):
+                if chains is not None:
+                    self.chains = [Chain(d, c) for d, c in chains[:chain_limit]]
+                    chains_truncated = chain_limit is not None and len(chains) > chain_limit
+                else:
+                    self.chains, chains_truncated = Graph.find_chains(self.altruistic_donors, self.pairs, self.edges, self.altruist_edges, self.max_chain_length,
+                                                                      chain_limit, enumeration_executor)
+            self.truncated = self.truncated or chains_truncated
+            with instrumentation.stage('weights'):
+                self.chain_weights = Graph.find_chain_weights(self.problem_type, self.pairs, self.altruistic_donors, self.chains, self.curr_time, self.scores)
+        elif self.chain_formulation == ChainFormulation.POSITION_INDEXED:
+            with instrumentation.stage('find_chains'):
+                self.chain_arcs = Graph.find_chain_arcs(self.altruist_edges, self.edges, self.max_chain_length)
+            with instrumentation.stage('weights'):
+                self.chain_arc_weights = Graph.find_chain_arc_weights(self.problem_type, self.pairs, self.altruistic_donors, self.chain_arcs, self.curr_time,
+                                                                      self.scores)
+
+        instrumentation.count('cycles', len(self.cycles))
+        instrumentation.count('chains', len(self.chains))
+        instrumentation.count('chain_arcs', len(self.chain_arcs))
+
+        if self.truncated:
+            warnings.warn(f'Enumeration stopped after {self.max_structures} cycles and chains, the matching only uses those found')
+
+    # create adjacency list representation of graph of pairs (vectorized, see compatibility.py)
     def find_edges(pairs):
+        return compatibility.find_edges(pairs)
+
+    # original pairwise version of find_edges - kept as a reference for checking and benchmarking the vectorized one
+    def find_edges_pairwise(pairs):
         edges = [set() for _ in range(len(pairs))]
 
         for i in range(len(pairs)):
@@ -55,135 +120,353 @@ class Graph:
         
         return edges
 
-    # find all 2 and 3 cycles for graph of pairs
-    def find_cycles(pairs, edges):
-        cycles = set()
+    # find all cycles of at most max_cycle_length pairs, each found exactly once from its smallest pair
+    # stops after limit cycles if given - returns the cycles and whether the enumeration was truncated
+    # the start vertices are shared out over executor if given (see parallel_enumeration.py)
+    def find_cycles(pairs, edges, max_cycle_length=3, limit=None, executor=None):
+        if executor is not None:
+            cycles, truncated = parallel_enumeration.find_cycles(executor, edges, max_cycle_length, limit)
+            return [Cycle(c) for c in cycles], truncated
+
+        cycles = []
 
-        # loop over all edges
+        # reverse edges, used to prune paths that can no longer get back to the start
+        in_edges = [set() for _ in range(len(pairs))]
         for i in range(len(pairs)):
             for j in edges[i]:
-                # checks for 2-cycles
-                if i in edges[j]: 
-                    cycles.add((min(i, j), max(i,j)))
-
-                # check for 3-cycles
-                for k in edges[j]:
-                    if i in edges[k]:
-                        c = [i, j, k]
-                        ind = c.index(min(c))
-                        c = c[ind:] + c[:ind]
-                        cycles.add(tuple(c))
+                in_edges[j].add(i)
 
-        cycles = list(cycles)
-        cycles = [Cycle(list(c)) for c in cycles]
+        for i in range(len(pairs)):
+            for path in enumeration.find_cycles_through(i, edges, in_edges, max_cycle_length, lambda j: j > i):
+                if limit is not None and len(cycles) == limit:
+                    return cycles, True
+                cycles.append(Cycle(list(path)))
 
         # print(f'Number of Cycles in Graph: {len(cycles)}')
-        return cycles
-
-    # function that establishes the optimization weights for each cycle based on the problem type
-    def find_cycle_weights(problem_type, pairs, cycles, curr_time):
-        if problem_type == ProblemType.SIMPLE: # if simple, weights are size of the cycle
-            return [c.size for c in cycles]
-        elif problem_type == ProblemType.POTENTIALS: # if potentials, weights are size of cycle minus potential of each vertex in cycle
-            return [c.size - sum([pairs[p].patient.potential + pairs[p].donor.potential for p in c.pairs]) for c in cycles]
-        elif problem_type == ProblemType.FAIRNESS: # if fairness, weights take into account waiting time and time before departure
-            return [1 + sum([sqrt(curr_time - pairs[p].arrival_time) + max(0, 10 - (pairs[p].departure_time - curr_time)) for p in c.pairs]) for c in cycles]
-
-    # function that finds all the chains in a graph from a given list of altruistic donors
-    def find_chains(altruistic_donors, pairs, edges):
+        return cycles, False
+
+    # function that establishes the optimization weights for each cycle based on the problem type (see objectives.py)
+    # scores can be passed in when the vertex scores of the batch are already known
+    def find_cycle_weights(problem_type, pairs, cycles, curr_time, scores=None):
+        if scores is None:
+            scores = objectives.vertex_scores(problem_type, pairs, [], curr_time)
+        return objectives.cycle_weights(scores, cycles)
+
+    # function that finds all the chains of at most max_chain_length pairs from a given list of altruistic donors
+    # stops after limit chains if given - returns the chains and whether the enumeration was truncated
+    # the altruistic donors are shared out over executor if given (see parallel_enumeration.py)
+    def find_chains(altruistic_donors, pairs, edges, altruist_edges=None, max_chain_length=10, limit=None, executor=None):
         chains = []
 
-        # loop over all altruistic donors
-        for d in range(len(altruistic_donors)):
-            donor = altruistic_donors[d]
+        # altruist_edges[d] is every pair that could start a chain from altruistic donor d
+        if altruist_edges is None:
+            altruist_edges = compatibility.find_altruist_edges(altruistic_donors, pairs)
 
-            # get all elements that could start a chain
-            first_elems = [i for i in range(len(pairs)) if donor.is_compatible_with_patient(pairs[i].patient)]
+        if executor is not None:
+            chains, truncated = parallel_enumeration.find_chains(executor, altruist_edges, edges, max_chain_length, limit)
+            return [Chain(d, c) for d, c in chains], truncated
 
-            # function to find all chains of size at most 10
-            def get_chains(start, past, found):
-                found.add(start)
-                chains.append(Chain(d, past + [start])) # add current chain to list
+        # loop over all altruistic donors
+        for d in range(len(altruistic_donors)):
+            for path in enumeration.find_chains_from(altruist_edges[d], edges, max_chain_length):
+                if limit is not None and len(chains) == limit:
+                    return chains, True
+                chains.append(Chain(d, list(path)))
 
-                # stop if size exceeds 10
-                if len(past) + 1 == 10:
-                    return
+        # print(f'Number of Chains in Graph: {len(chains)}')
+        return chains, False
+
+    def find_chain_weights(problem_type, pairs, altruistic_donors, chains, curr_time, scores=None):
+        if scores is None:
+            scores = objectives.vertex_scores(problem_type, pairs, altruistic_donors, curr_time)
+        return objectives.chain_weights(scores, chains)
+
+    # per-vertex decomposition of the weights, used to price cycles and chains in column generation: a cycle weighs
+    # cycle_constant + the pair_scores of its pairs, and a chain chain_constant + the altruist_scores of its donor + the pair_scores of its pairs
+    def find_vertex_scores(problem_type, pairs, altruistic_donors, curr_time):
+        scores = objectives.vertex_scores(problem_type, pairs, altruistic_donors, curr_time)
+        return (scores.size_weight + scores.pair_scores).tolist(), scores.altruist_scores.tolist(), scores.constant, scores.constant
+
+    # function that finds the position-indexed arcs of all chains of at most max_chain_length pairs, without enumerating the chains
+    # arc (s, j, k) puts pair j at position k of a chain: s is the altruistic donor if k == 1, and the pair at position k - 1 otherwise
+    def find_chain_arcs(altruist_edges, edges, max_chain_length):
+        arcs = [(d, j, 1) for d in range(len(altruist_edges)) for j in altruist_edges[d]]
+
+        # pairs that can be at position k of a chain are the neighbours of the pairs that can be at position k - 1
+        layer = sorted({j for starts in altruist_edges for j in starts})
+        for k in range(2, max_chain_length + 1):
+            next_layer = set()
+            for i in layer:
+                for j in sorted(edges[i]):
+                    arcs.append((i, j, k))
+                    next_layer.add(j)
+            layer = sorted(next_layer)
+
+        return arcs
+
+    # per-arc weights for the position-indexed formulation - summed over the arcs of a chain they give its find_chain_weights weight
+    def find_chain_arc_weights(problem_type, pairs, altruistic_donors, arcs, curr_time, scores=None):
+        if scores is None:
+            scores = objectives.vertex_scores(problem_type, pairs, altruistic_donors, curr_time)
+        return objectives.chain_arc_weights(scores, arcs)
+
+# build the matching problem as a sparse packing problem (see backends.py)
+# columns are the cycles, then the chains, then the chain arcs of the graph
+# rows are the pairs, then the altruistic donors (each used at most once), then the chain flow rows of the position-indexed formulation
+def build_packing_problem(graph):
+    num_pairs = len(graph.pairs)
+    num_donors = len(graph.altruistic_donors)
+    row_indices = []
+    column_indices = []
+    values = []
+
+    def add_entry(row, column, value):
+        row_indices.append(row)
+        column_indices.append(column)
+        values.append(value)
+
+    # each cycle uses its pairs
+    column = 0
+    for cycle in graph.cycles:
+        for p in cycle.pairs:
+            add_entry(p, column, 1)
+        column += 1
+
+    # each chain uses its altruistic donor and its pairs
+    for chain in graph.chains:
+        add_entry(num_pairs + chain.altruistic_donor, column, 1)
+        for p in chain.pairs:
+            add_entry(p, column, 1)
+        column += 1
+
+    # each chain arc uses its receiving pair (and its altruistic donor if it starts the chain)
+    # a pair can only continue a chain at position k + 1 if it received a kidney at position k:
+    # (arcs leaving pair i at position k + 1) - (arcs into pair i at position k) <= 0
+    flow_rows = {}  # (pair, position) -> flow row
+    for s, j, k in graph.chain_arcs:
+        if k > 1 and (s, k - 1) not in flow_rows:
+            flow_rows[(s, k - 1)] = num_pairs + num_donors + len(flow_rows)
+
+    for s, j, k in graph.chain_arcs:
+        add_entry(j, column, 1)
+        if k == 1:
+            add_entry(num_pairs + s, column, 1)
+        else:
+            add_entry(flow_rows[(s, k - 1)], column, 1)
+        if (j, k) in flow_rows:
+            add_entry(flow_rows[(j, k)], column, -1)
+        column += 1
 
-                # explore all possible next pairs that haven't been searched yet
-                next_pairs = [i for i in edges[start] if not i in found]
-                for next_pair in next_pairs:
-                    get_chains(next_pair, past + [start], found)
+    # get weights of each cycle and chain - will vary by problem type
+    weights = graph.cycle_weights + graph.chain_weights + graph.chain_arc_weights
+    row_upper = [1] * (num_pairs + num_donors) + [0] * len(flow_rows)
+
+    return PackingProblem(weights, row_indices, column_indices, values, row_upper)
+
+# solve the packing problem of a batch with the given backend, component by component if decompose
+# with SolveLimits, the solve is anytime (see solve_packing_problem_with_limits) and its SolveReport is recorded and
+# appended to reports if given
+def solve_packing(problem, backend, decompose=False, executor=None, limits=None, reports=None):
+    if limits is None:
+        if decompose:
+            return solve_packing_problem_by_component(problem, backend, executor)
+        return solve_packing_problem(problem, backend)
+
+    if decompose:
+        component_reports = []
+        x = solve_packing_problem_by_component(problem, backend, executor, limits, component_reports)
+        report = component_reports[0]
+    else:
+        x, report = solve_packing_problem_with_limits(problem, backend, limits)
+
+    instrumentation.count('gap', report.gap)
+    instrumentation.count('time_limit_hit', report.time_limit_hit)
+    if reports is not None:
+        reports.append(report)
+    return x
+
+# column generation - instead of enumerating every cycle and chain up front, start from a restricted master problem over the
+# 2-cycles and single-pair chains, repeatedly add the cycles and chains with positive reduced cost under the LP duals of the
+# pair and altruist rows, and finish with an integer solve over the generated columns only
+# pricing stops after max_pricing_nodes search nodes per iteration, and at most columns_per_iteration columns are added each time
+# (a warning is given if the node cap or max_iterations ends column generation before no column can improve the relaxation)
+def column_generation_solve_kidney_matching(pairs, altruistic_donors, problem_type, curr_time, edges=None, altruist_edges=None,
+                                            max_cycle_length=3, max_chain_length=10, backend=SolverBackend.PULP_CBC,
+                                            max_iterations=100, columns_per_iteration=1000, max_pricing_nodes=1000000, limits=None, reports=None):
+    if edges is None:
+        edges = Graph.find_edges(pairs)
+    if altruist_edges is None:
+        altruist_edges = compatibility.find_altruist_edges(altruistic_donors, pairs)
+
+    num_pairs = len(pairs)
+    in_edges = [set() for _ in range(num_pairs)]
+    for i in range(num_pairs):
+        for j in edges[i]:
+            in_edges[j].add(i)
+
+    pair_scores, altruist_scores, cycle_constant, chain_constant = Graph.find_vertex_scores(problem_type, pairs, altruistic_donors, curr_time)
+
+    # columns are keyed (None, pairs) for cycles and (altruistic donor, pairs) for chains
+    def column_weight(key):
+        d, c = key
+        if d is None:
+            return cycle_constant + sum(pair_scores[p] for p in c)
+        return chain_constant + altruist_scores[d] + sum(pair_scores[p] for p in c)
+
+    def master_problem(keys):
+        row_indices = []
+        column_indices = []
+        for column, (d, c) in enumerate(keys):
+            rows = list(c) if d is None else [num_pairs + d] + list(c)
+            row_indices.extend(rows)
+            column_indices.extend([column] * len(rows))
+        return PackingProblem([column_weight(key) for key in keys], row_indices, column_indices, [1] * len(row_indices),
+                              [1] * (num_pairs + len(altruistic_donors)))
+
+    # initial restricted master problem
+    columns = []
+    if max_cycle_length >= 2:
+        columns += [(None, (i, j)) for i in range(num_pairs) for j in edges[i] if i < j and i in edges[j]]
+    columns += [(d, (j,)) for d in range(len(altruistic_donors)) for j in altruist_edges[d]]
+    in_master = set(columns)
+
+    for _ in range(max_iterations):
+        if len(columns) > 0:
+            with instrumentation.stage('build_model'):
+                relaxation = master_problem(columns)
+            with instrumentation.stage('solve'):
+                _, duals = solve_lp_relaxation(relaxation, backend)
+        else:
+            duals = [0.] * (num_pairs + len(altruistic_donors))
+
+        # reduced cost of a column is its weight minus the duals of its rows, so each pair contributes its gain
+        gains = [pair_scores[p] - duals[p] for p in range(num_pairs)]
+        max_gain = max([0.] + gains)
+        best = []  # min-heap of (reduced cost, tie breaker, key) with the best columns found
+        nodes = 0
+
+        def consider(reduced_cost, key):
+            if reduced_cost > 1e-6 and key not in in_master:
+                if len(best) < columns_per_iteration:
+                    heapq.heappush(best, (reduced_cost, nodes, key))
+                elif reduced_cost > best[0][0]:
+                    heapq.heapreplace(best, (reduced_cost, nodes, key))
+
+        # price cycles, only extending a path while the cycle it could close into could still reach a positive reduced cost
+        # - the other pairs of a cycle from i are all larger than i, so each of them gains at most gain_after[i]
+        # the cycles from i are skipped altogether if even i cannot start one
+        with instrumentation.stage('find_cycles'):
+            gain_after = [0.] * (num_pairs + 1)
+            for p in range(num_pairs - 1, -1, -1):
+                gain_after[p] = max(gain_after[p + 1], gains[p])
+
+            def could_improve(path):
+                total = cycle_constant + sum(gains[p] for p in path)
+                return total + (max_cycle_length - len(path)) * gain_after[path[0] + 1] > 1e-6
+
+            for i in range(num_pairs):
+                if not could_improve([i]):
+                    continue
+                for path in enumeration.find_cycles_through(i, edges, in_edges, max_cycle_length, lambda j: j > i, could_improve):
+                    nodes += 1
+                    consider(cycle_constant + sum(gains[p] for p in path), (None, tuple(path)))
+                if nodes > max_pricing_nodes:
+                    break
+
+        # price chains, only extending a chain while it could still reach a positive reduced cost
+        with instrumentation.stage('find_chains'):
+            for d in range(len(altruistic_donors)):
+                base = chain_constant + altruist_scores[d] - duals[num_pairs + d]
+
+                def next_pairs(path):
+                    total = base + sum(gains[p] for p in path)
+                    if total + (max_chain_length - len(path)) * max_gain <= 1e-6:
+                        return ()
+                    return edges[path[-1]]
+
+                for first in altruist_edges[d]:
+                    for path in enumeration.find_paths(first, max_chain_length, next_pairs):
+                        nodes += 1
+                        consider(base + sum(gains[p] for p in path), (d, tuple(path)))
+                        if nodes > max_pricing_nodes:
+                            break
+                    if nodes > max_pricing_nodes:
+                        break
+
+        if len(best) == 0:
+            # pricing that stopped at the node cap has not shown that no column can improve the relaxation
+            if nodes > max_pricing_nodes:
+                warnings.warn(f'Column generation pricing stopped after {max_pricing_nodes} nodes, the matching may not be optimal')
+            break
+        for _, _, key in sorted(best, reverse=True):
+            columns.append(key)
+            in_master.add(key)
+    else:
+        warnings.warn(f'Column generation stopped after {max_iterations} iterations, the matching may not be optimal')
+
+    # integer solve over the generated columns
+    instrumentation.count('cycles', sum(1 for d, _ in columns if d is None))
+    instrumentation.count('chains', sum(1 for d, _ in columns if d is not None))
+    with instrumentation.stage('build_model'):
+        problem = master_problem(columns)
+    with instrumentation.stage('solve'):
+        x = solve_packing(problem, backend, limits=limits, reports=reports)
+    selected = [columns[c] for c in range(len(columns)) if x[c] == 1]
+
+    matched = [pairs[p] for d, c in selected for p in c]
+    used_altruistic_donors = [altruistic_donors[d] for d, c in selected if d is not None]
 
-            # search for all possible chains
-            for first_elem in first_elems:
-                get_chains(first_elem, [], set())
+    # check to make sure no pair or donor was used twice
+    assert len(matched) == len(set(matched))
+    assert len(used_altruistic_donors) == len(set(used_altruistic_donors))
 
-        # print(f'Number of Chains in Graph: {len(chains)}')
-        return chains
+    return matched, used_altruistic_donors
 
-    def find_chain_weights(problem_type, pairs, altruistic_donors, chains, curr_time):
-        if problem_type == ProblemType.SIMPLE: # if simple, weights are size of the cycle
-            return [c.size for c in chains]
-        elif problem_type == ProblemType.POTENTIALS: # if potentials, weights are size of chain minus potential of each vertex in cycle and minus potential of donor * constant
-            return [c.size - sum([pairs[p].patient.potential + pairs[p].donor.potential for p in c.pairs]) - 3*altruistic_donors[c.altruistic_donor].potential for c in chains]
-        elif problem_type == ProblemType.FAIRNESS: # if fairness, weights take into account waiting time and time before departure
-            return [1 + sum([sqrt(curr_time - pairs[p].arrival_time) + max(0, 10 - (pairs[p].departure_time - curr_time)) for p in c.pairs]) for c in chains]
+def solve_kidney_matching(pairs, altruistic_donors, problem_type, curr_time, edges=None, altruist_edges=None, cycles=None, chains=None,
+                          chain_formulation=ChainFormulation.ENUMERATE, max_cycle_length=3, max_chain_length=10, max_structures=None,
+                          backend=SolverBackend.PULP_CBC, decompose=False, executor=None, column_generation=False, limits=None, reports=None,
+                          enumeration_executor=None):
+    # column generation never builds the full graph of cycles and chains
+    if column_generation:
+        return column_generation_solve_kidney_matching(pairs, altruistic_donors, problem_type, curr_time, edges=edges, altruist_edges=altruist_edges,
+                                                       max_cycle_length=max_cycle_length, max_chain_length=max_chain_length, backend=backend,
+                                                       limits=limits, reports=reports)
 
-def solve_kidney_matching(pairs, altruistic_donors, problem_type, curr_time):
     # construct graph
-    graph = Graph(pairs, altruistic_donors, problem_type, curr_time)
+    graph = Graph(pairs, altruistic_donors, problem_type, curr_time, edges=edges, altruist_edges=altruist_edges, cycles=cycles, chains=chains,
+                  chain_formulation=chain_formulation, max_cycle_length=max_cycle_length, max_chain_length=max_chain_length,
+                  max_structures=max_structures, enumeration_executor=enumeration_executor)
 
     # get cycles and chains
     cycles = graph.cycles
     chains = graph.chains
+    chain_arcs = graph.chain_arcs
 
-    # initialize problem
-    problem = LpProblem('kidney_matching', LpMaximize)
-
-    # create decision variables for each cycle and chain
-    cycle_vars = LpVariable.dicts('cycle', range(len(cycles)), cat='Binary')
-    chain_vars = LpVariable.dicts('chain', range(len(chains)), cat='Binary')
-
-    cycles_chains_with_vertex = [[] for _ in range(len(pairs))] # cycles_with_vertex[i] is list of cycle and chain variables that contain vertex i
-    chains_with_donor = [[] for _ in range(len(altruistic_donors))] # chains_with_donor[i] is list of chain variables that start with donor i
-
-    # update cycles_chains_with_vertex by looping over all cycles
-    for i in range(len(cycles)):
-        for j in cycles[i].pairs:
-            cycles_chains_with_vertex[j].append(cycle_vars[i])
-
-    # update cycles_chains_with_vertex and chains_with_donor by looping over all chains
-    for i in range(len(chains)):
-        chains_with_donor[chains[i].altruistic_donor].append(chain_vars[i])
-        for j in chains[i].pairs:
-            cycles_chains_with_vertex[j].append(chain_vars[i])
+    # build the problem once and solve it with the selected backend
+    # if decompose, each independent component is solved on its own (concurrently if an executor is given)
+    # with limits (SolveLimits), the solver stops at the time limit or gap and the best packing found is used
+    with instrumentation.stage('build_model'):
+        problem = build_packing_problem(graph)
+    with instrumentation.stage('solve'):
+        x = solve_packing(problem, backend, decompose, executor, limits, reports)
 
-    # create constraint for each pair and donor 
-    for c in cycles_chains_with_vertex + chains_with_donor:
-        if len(c) > 0:
-            problem += lpSum(c) <= 1 # add constraint that each vertex can be used in at most 1 cycle or chain
-
-    # get weights of each cycle and chain - will vary by problem type
-    cycle_weights = graph.cycle_weights
-    chain_weights = graph.chain_weights
-    
-    # add objective function
-    problem += lpDot([cycle_vars[i] for i in range(len(cycle_vars))] + [chain_vars[i] for i in range(len(chain_vars))], cycle_weights + chain_weights)
-
-    # solve for optimal solution
-    # print('Solving')
-    problem.solve(PULP_CBC_CMD(msg=0))
-
-    # prints out optimal objective value
-    # print(f'Objective Value: {value(problem.objective)}')
+    # split the solution back into cycles, chains and chain arcs
+    cycle_values = x[:len(cycles)]
+    chain_values = x[len(cycles):len(cycles) + len(chains)]
+    chain_arc_values = x[len(cycles) + len(chains):]
 
     # gets (indices of) pairs that have been matched
-    matched = [pairs[p] for c in range(len(cycle_vars)) for p in cycles[c].pairs if value(cycle_vars[c]) == 1]
-    matched = matched + [pairs[p] for c in range(len(chain_vars)) for p in chains[c].pairs if value(chain_vars[c]) == 1]
+    matched = [pairs[p] for c in range(len(cycles)) for p in cycles[c].pairs if cycle_values[c] == 1]
+    matched = matched + [pairs[p] for c in range(len(chains)) for p in chains[c].pairs if chain_values[c] == 1]
     # print(f'Number of Matched Pairs: {len(matched)}')
 
     # get (indices of) altruistic donors that have been used
-    used_altruistic_donors = [altruistic_donors[chains[d].altruistic_donor] for d in range(len(chain_vars)) if value(chain_vars[d]) == 1]
+    used_altruistic_donors = [altruistic_donors[chains[d].altruistic_donor] for d in range(len(chains)) if chain_values[d] == 1]
+
+    # with the position-indexed formulation, every selected arc matches its receiving pair and first arcs use their altruistic donor
+    selected_arcs = [chain_arcs[a] for a in range(len(chain_arcs)) if chain_arc_values[a] == 1]
+    matched = matched + [pairs[j] for s, j, k in selected_arcs]
+    used_altruistic_donors = used_altruistic_donors + [altruistic_donors[s] for s, j, k in selected_arcs if k == 1]
     # print(f'Number of Altruistic Donors Used: {len(used_altruistic_donors)}')
 
     # check to make sure no pair or donor was used twice
@@ -192,39 +475,136 @@ def solve_kidney_matching(pairs, altruistic_donors, problem_type, curr_time):
 
     return matched, used_altruistic_donors
 
+# chains of at most max_chain_length pairs through pair vertex_id of a PoolGraph, at any position, as
+# (altruist id, tuple of pair ids) - found by walking back from the pair along in_edges to every pair an altruist can
+# donate to (the possible starts of the chain), then forward from the pair along out_edges for the rest of the chain
+# the search stops after max_paths partial paths (back and forward together), so its work is at most
+# max_paths * max_chain_length whatever the size of the pool - chains beyond that budget are not proposed
+def chains_through(vertex_id, pool_graph, max_chain_length, max_paths):
+    budget = max_paths
+    for back in enumeration.find_paths(vertex_id, max_chain_length, lambda path: pool_graph.in_edges[path[-1]]):
+        budget -= 1
+        if budget < 0:
+            return
+        altruists = pool_graph.altruist_in_edges[back[-1]]
+        if len(altruists) == 0:
+            continue
+
+        prefix = back[::-1]
+        before = set(back)
+        for forward in enumeration.find_paths(vertex_id, max_chain_length - len(back) + 1, lambda path: pool_graph.out_edges[path[-1]] - before):
+            budget -= 1
+            if budget < 0:
+                return
+            chain = tuple(prefix + forward[1:])
+            for a in altruists:
+                yield a, chain
+
+# chains of at most max_chain_length pairs from altruist vertex_id of a PoolGraph, with the same budget as chains_through
+def chains_from(vertex_id, pool_graph, max_chain_length, max_paths):
+    budget = max_paths
+    for first in pool_graph.altruist_edges[vertex_id]:
+        for path in enumeration.find_paths(first, max_chain_length, lambda path: pool_graph.out_edges[path[-1]]):
+            budget -= 1
+            if budget < 0:
+                return
+            yield vertex_id, tuple(path)
+
+# cycles and chains through the given vertices of a PoolGraph, as (altruist id or None, tuple of pair ids)
+# cycles come from the cycle index, chains are every chain through a new pair (see chains_through) or from a new
+# altruistic donor, each search bounded by max_chain_paths
+def structures_through(vertices, pool_graph, max_chain_length, max_chain_paths=1000):
+    for vertex in vertices:
+        if vertex not in pool_graph:
+            continue
+        vertex_id = pool_graph.vertex_ids[vertex]
+
+        if vertex_id in pool_graph.pairs:
+            for c in pool_graph.vertex_cycles[vertex_id]:
+                yield None, c
+            yield from chains_through(vertex_id, pool_graph, max_chain_length, max_chain_paths)
+        else:
+            yield from chains_from(vertex_id, pool_graph, max_chain_length, max_chain_paths)
+
+# greedy online matching - only looks at the cycles and chains through new_vertices (already added to pool_graph),
+# so its cost depends on the neighbourhood of the new arrivals rather than on the whole pool
+# takes the heaviest disjoint structures first, then runs up to local_search_steps rounds of swaps, each replacing
+# chosen structures by a conflicting candidate whenever that candidate is heavier than all of them together
+# the chain search from each new vertex looks at most max_chain_paths paths, and at most max_candidates structures are kept
+def greedy_solve_kidney_matching(new_vertices, pool_graph, problem_type, curr_time, max_chain_length=10, local_search_steps=0, max_candidates=10000,
+                                 max_chain_paths=1000):
+    candidates = []
+    seen = set()
+    for candidate in structures_through(new_vertices, pool_graph, max_chain_length, max_chain_paths):
+        if candidate not in seen:
+            seen.add(candidate)
+            candidates.append(candidate)
+            if len(candidates) == max_candidates:
+                break
+
+    if len(candidates) == 0:
+        return [], []
+
+    # local indices so the usual weight functions can be used
+    pair_ids = sorted({i for _, c in candidates for i in c})
+    altruist_ids = sorted({a for a, _ in candidates if a is not None})
+    pairs = [pool_graph.pairs[i] for i in pair_ids]
+    altruistic_donors = [pool_graph.altruists[a] for a in altruist_ids]
+    pair_index = {i: k for k, i in enumerate(pair_ids)}
+    altruist_index = {a: k for k, a in enumerate(altruist_ids)}
+
+    cycles = [Cycle([pair_index[i] for i in c]) for a, c in candidates if a is None]
+    chains = [Chain(altruist_index[a], [pair_index[i] for i in c]) for a, c in candidates if a is not None]
+    structures = cycles + chains
+    scores = objectives.vertex_scores(problem_type, pairs, altruistic_donors, curr_time)
+    weights = Graph.find_cycle_weights(problem_type, pairs, cycles, curr_time, scores) + Graph.find_chain_weights(problem_type, pairs, altruistic_donors, chains, curr_time, scores)
+
+    # vertices used by each structure (pair and altruist ids share the same id space)
+    vertices = [c for a, c in candidates if a is None] + [(a,) + c for a, c in candidates if a is not None]
+    order = sorted(range(len(structures)), key=lambda c: -weights[c])
+
+    # greedy pass
+    chosen = set()
+    owner = {}  # vertex id -> chosen structure using it
+    for c in order:
+        if weights[c] > 0 and not any(v in owner for v in vertices[c]):
+            chosen.add(c)
+            for v in vertices[c]:
+                owner[v] = c
+
+    # local search pass
+    for _ in range(local_search_steps):
+        improved = False
+        for c in order:
+            if c in chosen or weights[c] <= 0:
+                continue
+            conflicts = {owner[v] for v in vertices[c] if v in owner}
+            if weights[c] > sum(weights[d] for d in conflicts) + 1e-9:
+                for d in conflicts:
+                    chosen.remove(d)
+                    for v in vertices[d]:
+                        del owner[v]
+                chosen.add(c)
+                for v in vertices[c]:
+                    owner[v] = c
+                improved = True
+        if not improved:
+            break
+
+    matched = [pairs[p] for c in chosen for p in structures[c].pairs]
+    used_altruistic_donors = [altruistic_donors[structures[c].altruistic_donor] for c in chosen if c >= len(cycles)]
+
+    # check to make sure no pair or donor was used twice
+    assert len(matched) == len(set(matched))
+    assert len(used_altruistic_donors) == len(set(used_altruistic_donors))
+
+    return matched, used_altruistic_donors
+
 if __name__ == "__main__":
-    solve_kidney_matching(all_pairs, [generate_patient_donor_pair().donor for _ in range(5)], ProblemType.FAIRNESS, 5)
+    # generate patient-donor pairs
+    number_of_pairs = 500
+    all_pairs = []
+    for i in range(number_of_pairs):
+        all_pairs.append(generate_patient_donor_pair())
 
-### code for greedy approach 
-# def greedy_solve_kidney_matching(new_pair, existing_pairs, problem_type):
-#     pairs = existing_pairs + [new_pair] # new pair is put at the end of existing pairs
-#     new_ind = len(pairs) - 1 # index of new pair is at the end of pairs list
-
-#     edges = Graph.find_edges(pairs) # edges for new graph with all pairs
-#     cycles = [] # cycles involving new pair
-
-#     # iterate over all pairs the new pair can donate to
-#     for p in edges[new_ind]:
-#         # check for 2-cycle with p as other element
-#         if new_ind in edges[p]:
-#             cycles.append(Cycle([new_ind, p]))
-#         # check for 3-cycle with p and v as other elements
-#         for v in edges[p]:
-#             if new_ind in edges[v]:
-#                 cycles.append(Cycle([new_ind, p, v]))
-
-#     # get weights of all possible cycles
-#     cycle_weights = Graph.find_cycle_weights(problem_type, pairs, cycles)
-
-#     # return cycle with max weight if possible
-#     if len(cycles) > 0:
-#         selected_cycle_ind = cycle_weights.index(max(cycle_weights))
-#         selected = cycles[selected_cycle_ind].pairs
-#     else:
-#         selected = []
-
-#     # return the pairs that are matched (if possible)
-#     print(selected)
-#     return selected
-
-# greedy_solve_kidney_matching(generate_patient_donor_pair(), all_pairs, ProblemType.SIMPLE)
\ No newline at end of file
+    solve_kidney_matching(all_pairs, [generate_patient_donor_pair().donor for _ in range(5)], ProblemType.FAIRNESS, 5)
@@ -0,0 +1,118 @@
+# Checks of the packing problem backends against each other on small random pools
+# Run with: python -m pytest -q test_backends.py
+from concurrent.futures import ThreadPoolExecutor
+import contextlib
+import functools
+import random
+import warnings
+
+import pytest
+
+import backends
+from backends import (PackingProblem, SolveLimits, SolverBackend, greedy_packing, solve_packing_problem, solve_packing_problem_by_component,
+                      solve_packing_problem_with_limits, solve_with_python)
+from patient_donor_pairs import generate_patient_donor_pair, generate_altruistic_donor
+from solver import Graph, ProblemType, ChainFormulation, build_packing_problem
+
+# packing problem of a random pool, the same for a given seed
+def random_problem(seed, problem_type, chain_formulation, num_pairs=40, num_altruists=3):
+    random.seed(seed)
+    pairs = [generate_patient_donor_pair() for _ in range(num_pairs)]
+    altruistic_donors = [generate_altruistic_donor() for _ in range(num_altruists)]
+    graph = Graph(pairs, altruistic_donors, problem_type, 0, chain_formulation=chain_formulation, max_chain_length=4)
+    return build_packing_problem(graph)
+
+def feasible(problem, x):
+    activity = [0.] * problem.num_rows
+    for r, c, v in zip(problem.row_indices, problem.column_indices, problem.values):
+        activity[r] += v * x[c]
+    return all(a <= upper + 1e-9 for a, upper in zip(activity, problem.row_upper))
+
+@pytest.fixture(autouse=True)
+def quiet_pulp():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        yield
+
+@pytest.mark.parametrize('chain_formulation', list(ChainFormulation))
+@pytest.mark.parametrize('problem_type', [ProblemType.SIMPLE, ProblemType.POTENTIALS, ProblemType.FAIRNESS])
+@pytest.mark.parametrize('seed', range(3))
+def test_python_backend_matches_cbc(seed, problem_type, chain_formulation):
+    problem = random_problem(seed, problem_type, chain_formulation)
+    python = solve_packing_problem(problem, SolverBackend.PYTHON)
+    cbc = solve_packing_problem(problem, SolverBackend.PULP_CBC)
+
+    assert feasible(problem, python)
+    assert problem.objective(python) == pytest.approx(problem.objective(cbc))
+
+@pytest.mark.parametrize('chain_formulation', list(ChainFormulation))
+def test_python_backend_bound_is_valid(chain_formulation):
+    problem = random_problem(0, ProblemType.POTENTIALS, chain_formulation, num_pairs=80, num_altruists=5)
+    optimum = problem.objective(solve_packing_problem(problem, SolverBackend.PULP_CBC))
+
+    x, bound, _ = solve_with_python(problem, SolveLimits(gap=0.5))
+    assert feasible(problem, x)
+    assert problem.objective(x) >= 0.5 * optimum - 1e-9
+    assert bound >= optimum - 1e-9
+
+def test_node_cap_never_returns_less_than_greedy():
+    problem = random_problem(1, ProblemType.FAIRNESS, ChainFormulation.POSITION_INDEXED, num_pairs=80, num_altruists=5)
+    greedy = problem.objective(greedy_packing(problem))
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        x, bound, time_limit_hit = solve_with_python(problem, SolveLimits(), greedy_packing(problem), max_nodes=1)
+    assert problem.objective(x) == greedy
+    assert bound >= greedy
+    assert not time_limit_hit
+
+# three columns that pairwise share a row - the optimum is 1, but the LP relaxation reaches 3/2
+odd_cycle = PackingProblem([1., 1., 1.], [0, 0, 1, 1, 2, 2], [0, 1, 1, 2, 2, 0], [1] * 6, [1, 1, 1])
+
+def test_odd_cycle():
+    x, bound, _ = solve_with_python(odd_cycle)
+    assert odd_cycle.objective(x) == 1.
+    assert bound == pytest.approx(1.)
+
+def test_unproven_solve_raises(monkeypatch):
+    monkeypatch.setattr(backends, 'backend_solver', lambda backend: functools.partial(solve_with_python, max_nodes=1))
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        with pytest.raises(Exception, match='before proving'):
+            solve_packing_problem(odd_cycle, SolverBackend.PYTHON)
+        x, report = solve_packing_problem_with_limits(odd_cycle, SolverBackend.PYTHON, SolveLimits(gap=0.))
+    assert odd_cycle.objective(x) == 1.
+    assert report.bound == pytest.approx(1.5)
+    assert report.gap > 0.
+
+def test_limited_solve_reports_time_limit():
+    problem = random_problem(2, ProblemType.SIMPLE, ChainFormulation.ENUMERATE, num_pairs=60)
+    x, report = solve_packing_problem_with_limits(problem, SolverBackend.PYTHON, SolveLimits(time_limit=0.))
+    assert feasible(problem, x)
+    assert report.objective >= problem.objective(greedy_packing(problem))
+    assert report.bound >= report.objective
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_components_match_whole_problem(workers):
+    problem = random_problem(3, ProblemType.FAIRNESS, ChainFormulation.ENUMERATE, num_pairs=60)
+    whole = problem.objective(solve_packing_problem(problem, SolverBackend.PULP_CBC))
+
+    with ThreadPoolExecutor(workers) if workers is not None else contextlib.nullcontext() as executor:
+        x = solve_packing_problem_by_component(problem, SolverBackend.PULP_CBC, executor)
+        reports = []
+        y = solve_packing_problem_by_component(problem, SolverBackend.PULP_CBC, executor, SolveLimits(time_limit=60), reports)
+    assert problem.objective(x) == pytest.approx(whole)
+    assert problem.objective(y) == pytest.approx(whole)
+    assert reports[0].objective == pytest.approx(whole)
+
+@pytest.mark.parametrize('workers', [None, 2])
+def test_components_after_deadline_get_greedy_packing(workers):
+    problem = random_problem(3, ProblemType.FAIRNESS, ChainFormulation.ENUMERATE, num_pairs=60)
+
+    reports = []
+    with ThreadPoolExecutor(workers) if workers is not None else contextlib.nullcontext() as executor:
+        x = solve_packing_problem_by_component(problem, SolverBackend.PULP_CBC, executor, SolveLimits(time_limit=0), reports)
+    assert feasible(problem, x)
+    assert reports[0].time_limit_hit
+    assert reports[0].objective == problem.objective(x)
+    assert reports[0].bound >= problem.objective(solve_packing_problem(problem, SolverBackend.PULP_CBC)) - 1e-9
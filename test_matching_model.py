@@ -0,0 +1,44 @@
+# Checks of the persistent matching model against solving every batch from scratch
+# Run with: python -m pytest -q test_matching_model.py
+import random
+import warnings
+
+import pytest
+
+from backends import SolveLimits
+from matching_model import MatchingModel
+from patient_donor_pairs import generate_patient_donor_pair, generate_altruistic_donor
+from pool_graph import PoolGraph
+from solver import ProblemType, solve_kidney_matching
+
+@pytest.fixture(autouse=True)
+def quiet_pulp():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        yield
+
+def test_empty_pool_is_reported():
+    reports = []
+    model = MatchingModel(ProblemType.SIMPLE, limits=SolveLimits(time_limit=10))
+    assert model.solve(PoolGraph().snapshot(), 0, reports) == ([], [])
+    assert len(reports) == 1
+    assert reports[0].gap == 0. and not reports[0].time_limit_hit
+
+@pytest.mark.parametrize('seed', range(3))
+def test_model_matches_rebuilt_solve(seed):
+    random.seed(seed)
+    pool_graph = PoolGraph(3, 4)
+    model = MatchingModel(ProblemType.SIMPLE, max_chain_length=4)
+    for batch in range(5):
+        for _ in range(15):
+            pool_graph.add_pair(generate_patient_donor_pair())
+        pool_graph.add_altruist(generate_altruistic_donor())
+
+        snapshot = pool_graph.snapshot()
+        matched, donors = model.solve(snapshot, batch)
+        expected, _ = solve_kidney_matching(snapshot.pairs, snapshot.altruistic_donors, ProblemType.SIMPLE, batch, edges=snapshot.edges,
+                                            altruist_edges=snapshot.altruist_edges, cycles=snapshot.cycles, chains=snapshot.chains,
+                                            max_chain_length=4)
+        assert len(matched) == len(expected)
+        for vertex in matched + donors:
+            pool_graph.remove(vertex)
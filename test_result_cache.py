@@ -0,0 +1,42 @@
+# Checks of the code fingerprint and the result cache
+# Run with: python -m pytest -q test_result_cache.py
+import glob
+import os
+import shutil
+
+from result_cache import ResultCache, code_fingerprint, simulation_files
+
+package = os.path.dirname(os.path.abspath(__file__))
+
+# a copy of the package to change files in
+def copy_package(tmp_path):
+    for path in glob.glob(os.path.join(package, '*.py')) + [os.path.join(package, 'distributions.txt')]:
+        shutil.copy(path, tmp_path)
+    return str(tmp_path)
+
+def test_simulation_files_follow_imports():
+    files = simulation_files(package)
+    assert 'simulator.py' in files and 'backends.py' in files and 'instrumentation.py' in files
+    assert 'distributions.txt' in files
+    assert 'experiments.py' not in files and 'benchmarks.py' not in files and 'result_cache.py' not in files
+
+def test_fingerprint_changes_with_simulation_code_only(tmp_path):
+    directory = copy_package(tmp_path)
+    fingerprint = code_fingerprint(directory)
+
+    with open(os.path.join(directory, 'experiments.py'), 'a') as f:
+        f.write('\n# a new sweep\n')
+    assert code_fingerprint(directory) == fingerprint
+
+    # a module simulator.py only imports indirectly
+    with open(os.path.join(directory, 'objectives.py'), 'a') as f:
+        f.write('\n# a changed objective\n')
+    assert code_fingerprint(directory) != fingerprint
+
+def test_cache_round_trip(tmp_path):
+    cache = ResultCache(str(tmp_path), fingerprint='code')
+    configuration = {'batch_size': 10}
+    assert cache.get(configuration, 5, 1) is None
+    cache.put(configuration, 5, 1, {'Number of Pairs Matched': 3})
+    assert cache.get(configuration, 5, 1) == {'Number of Pairs Matched': 3}
+    assert ResultCache(str(tmp_path), fingerprint='other code').get(configuration, 5, 1) is None
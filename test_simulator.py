@@ -0,0 +1,91 @@
+# Checks that checkpointed runs of the simulator give the same results as uninterrupted ones
+# Run with: python -m pytest -q test_simulator.py
+import os
+import pickle
+import random
+import shutil
+import warnings
+
+import pytest
+
+import simulator
+from simulator import DynamicSimulator
+from solver import ProblemType, MatchingMode
+
+base = dict(pair_arrival_rate=40, pair_departure_rate=0.5, altruist_arrival_rate=3, altruist_departure_rate=0.5, batch_size=5)
+configurations = [
+    dict(problem_type=ProblemType.SIMPLE),
+    dict(problem_type=ProblemType.FAIRNESS, seed=3, keep_history=False),
+    dict(problem_type=ProblemType.POTENTIALS, matching_mode=MatchingMode.GREEDY, local_search_steps=2),
+    dict(problem_type=ProblemType.FAIRNESS, persistent_model=True, seed=1),
+]
+
+@pytest.fixture(autouse=True)
+def quiet_pulp():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        yield
+
+# what a run returns, with vertices as (id, match time) so runs in different stores can be compared, and statistics
+# by repr (statistics of empty groups are NaN, which is never equal to itself)
+def results(run):
+    return [sorted((v.id, v.match_time) for v in vertices) for vertices in run[:4]], repr(run[4])
+
+@pytest.mark.parametrize('configuration', configurations)
+def test_resume_matches_uninterrupted_run(configuration, tmp_path, monkeypatch):
+    configuration = dict(base, **configuration)
+    random.seed(0)
+    uninterrupted = results(DynamicSimulator(**configuration).run(6))
+
+    # keep a copy of the checkpoint (and history) written after batch 5, as if the run had been stopped there
+    checkpoint_path = str(tmp_path / 'run.pkl')
+    copy_path = str(tmp_path / 'copy.pkl')
+    checkpoint = DynamicSimulator.checkpoint
+    def checkpoint_and_copy(self):
+        checkpoint(self)
+        if self.state.batches == 5:
+            shutil.copy(checkpoint_path, copy_path)
+            if os.path.exists(checkpoint_path + '.history'):
+                shutil.copy(checkpoint_path + '.history', copy_path + '.history')
+    monkeypatch.setattr(DynamicSimulator, 'checkpoint', checkpoint_and_copy)
+
+    random.seed(0)
+    checkpointed = results(DynamicSimulator(**configuration, checkpoint_path=checkpoint_path, checkpoint_batches=1).run(6))
+    random.seed(1)    # unseeded runs must get the global random stream back from the checkpoint
+    resumed = results(simulator.resume(copy_path))
+
+    assert checkpointed == uninterrupted
+    assert resumed == uninterrupted
+
+def test_checkpoints_leave_out_history(tmp_path, monkeypatch):
+    # number of pairs and altruistic donors in the store at the last checkpoint
+    counts = []
+    checkpoint = DynamicSimulator.checkpoint
+    def checkpoint_and_count(self):
+        checkpoint(self)
+        counts.append((self.store.count(True), self.store.count(False)))
+    monkeypatch.setattr(DynamicSimulator, 'checkpoint', checkpoint_and_count)
+
+    checkpoint_path = str(tmp_path / 'run.pkl')
+    DynamicSimulator(**base, problem_type=ProblemType.SIMPLE, seed=2, checkpoint_path=checkpoint_path, checkpoint_batches=1).run(6)
+
+    # the checkpoint only holds the vertices still in the pool, the others come back from the history file
+    with open(checkpoint_path, 'rb') as f:
+        saved, _ = pickle.load(f)
+    assert saved.store.count(True) + saved.store.count(False) == len(saved.pool_graph)
+    loaded = DynamicSimulator.load(checkpoint_path)
+    assert (loaded.store.count(True), loaded.store.count(False)) == counts[-1]
+
+def test_checkpoint_path_alone_uses_default_interval(tmp_path):
+    checkpoint_path = str(tmp_path / 'run.pkl')
+    DynamicSimulator(**base, problem_type=ProblemType.SIMPLE, seed=2, checkpoint_path=checkpoint_path).run(2)
+    assert simulator.default_checkpoint_seconds > 0
+    assert not os.path.exists(checkpoint_path)
+
+def test_wait_time_percentiles_only_when_asked_for():
+    default = DynamicSimulator(**base, problem_type=ProblemType.SIMPLE, seed=4).run(2)[4]
+    with_quantiles = DynamicSimulator(**base, problem_type=ProblemType.SIMPLE, seed=4, wait_time_quantiles=[0.5, 0.9]).run(2)[4]
+
+    assert not any('Percentile' in key for key in default)
+    assert 'Pair 50th Percentile Wait Time' in with_quantiles and 'Altruist 90th Percentile Wait Time' in with_quantiles
+    assert repr(default) == repr({key: value for key, value in with_quantiles.items() if 'Percentile' not in key})